@@ -0,0 +1,253 @@
+from array import array
+from machine import mem32
+import utime
+from voltagesampler import VoltageSampler
+
+
+class ADCRing:
+    """
+    Last `size` readings of one ADC channel in preallocated arrays.
+    Readings are 16x the 12 bit code (so burst means keep their fraction).
+    latest, mean and min are O(1) - a running sum for the mean and a
+    monotonic queue of positions for the min - and push doesn't allocate.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.values = array('H', [0] * size)
+        self.min_positions = array('H', [0] * size)   # Queue of positions with rising values, oldest first
+        self.min_head = 0
+        self.min_count = 0
+        self.position = 0   # Next position, counts round 0 to 2 * size so the age of a queued one is known
+        self.count = 0
+        self.total = 0
+
+    def push(self, value):
+        size = self.size
+        slot = self.position % size
+        if self.count == size:
+            self.total -= self.values[slot]
+        else:
+            self.count += 1
+        self.values[slot] = value
+        self.total += value
+
+        # Drop the min candidate that's left the window, then any that this reading beats
+        positions = self.min_positions
+        if self.min_count and (self.position - positions[self.min_head]) % (2 * size) >= size:
+            self.min_head = (self.min_head + 1) % size
+            self.min_count -= 1
+        while self.min_count:
+            tail = (self.min_head + self.min_count - 1) % size
+            if self.values[positions[tail] % size] < value:
+                break
+            self.min_count -= 1
+        positions[(self.min_head + self.min_count) % size] = self.position
+        self.min_count += 1
+        self.position = (self.position + 1) % (2 * size)
+
+    def latest(self):
+        return self.values[(self.position - 1) % self.size]
+
+    def mean(self):
+        return self.total / self.count
+
+    def min(self):
+        return self.values[self.min_positions[self.min_head] % self.size]
+
+
+class PWMPhase:
+    """
+    Where a PWM output is in its cycle, from the RP2040 PWM slice's registers.
+    The counter runs 0 to TOP and wraps, the output is high while the counter
+    is below the channel's compare value, so how long until the next edge is
+    known without watching the pin. Assumes the slice isn't in phase correct
+    mode (MicroPython's PWM doesn't use it).
+    """
+    PWM_BASE = 0x40050000
+    SLICE_STRIDE = 0x14
+    CTR = 0x08
+    CC = 0x0C
+    TOP = 0x10
+
+    def __init__(self, pin, freq):
+        """
+        :param pin: GPIO the PWM is on
+        :param freq: PWM frequency it was set up with
+        """
+        base = PWMPhase.PWM_BASE + ((pin >> 1) & 7) * PWMPhase.SLICE_STRIDE
+        self.ctr_address = base + PWMPhase.CTR
+        self.cc_address = base + PWMPhase.CC
+        self.top_address = base + PWMPhase.TOP
+        self.cc_shift = 16 if pin & 1 else 0   # Odd pins are channel B, top half of CC
+        self.period_us = 1000000 // freq
+
+    def counts(self):
+        """Counter steps per PWM cycle."""
+        return (mem32[self.top_address] & 0xFFFF) + 1
+
+    def on_counts(self):
+        """Counter steps per cycle the output is high."""
+        return (mem32[self.cc_address] >> self.cc_shift) & 0xFFFF
+
+    def counter(self):
+        return mem32[self.ctr_address] & 0xFFFF
+
+
+class ADCAcquisition:
+    """
+    Reads the ADC channels in the background from a Scheduler job, so the
+    control loop and timerSetPiTemp take the latest readings from ring
+    buffers instead of waiting on the ADC.
+    Each run takes a burst of the supply voltage through the VoltageSampler
+    (bad codes dropped) and every DIE_TEMPERATURE_EVERY runs the die
+    temperature, round robin on the one ADC.
+    The RP2040's free running round robin mode is not used - its FIFO
+    doesn't say which channel a result is from, so without DMA keeping
+    up an overflow would mix the channels up.
+
+    With the element heater's PWMPhase set each burst is timed against the
+    PWM cycle and also goes into a loaded (heater on) or unloaded ring, so
+    V^2/R can use the voltage the element actually gets rather than a mix
+    of sagged and recovered readings. PERIOD_MS isn't a multiple of the 20ms
+    PWM period so the bursts walk through the cycle, and when a loaded
+    reading is due and the heater is about to switch on the run waits for it.
+    """
+    PERIOD_MS = 23
+    VOLTAGE_RING_SIZE = 32           # ~740ms of supply readings for the sag statistics
+    DIE_TEMPERATURE_RING_SIZE = 8
+    DIE_TEMPERATURE_EVERY = 10       # Runs between die temperature readings (~230ms)
+    PHASE_RING_SIZE = 8              # Loaded and unloaded readings
+    SETTLE_US = 20                   # After a heater switching edge before a reading is trusted
+    SYNC_WAIT_US = 1500              # Longest a run waits for the heater to switch on
+    LOADED_EVERY = 4                 # Runs between waiting for a loaded reading
+    LOADED_STALE_RUNS = 45           # ~1s without a loaded reading and loaded_volts comes from the last sag
+
+    def __init__(self, voltage_sampler, die_temperature_adc):
+        """
+        :param voltage_sampler: VoltageSampler for the divider pin
+        :param die_temperature_adc: ADC(4), the RP2040's temperature sensor
+        """
+        self.voltage_sampler = voltage_sampler
+        self.die_temperature_adc = die_temperature_adc
+        self.voltage = ADCRing(ADCAcquisition.VOLTAGE_RING_SIZE)
+        self.die_temperature = ADCRing(ADCAcquisition.DIE_TEMPERATURE_RING_SIZE)
+        self.runs = 0
+        self.pwm_phase = None
+        self.loaded_voltage = ADCRing(ADCAcquisition.PHASE_RING_SIZE)
+        self.unloaded_voltage = ADCRing(ADCAcquisition.PHASE_RING_SIZE)
+        self.loaded_age = 0     # Runs since the last loaded reading
+        self.sag = 0            # Unloaded less loaded when the last loaded reading was taken, ring units
+        self.burst_us = 100     # How long the last burst took, so a phase window can be checked it fits
+
+    def set_pwm_phase(self, pwm_phase):
+        """Time the supply readings against the heater's PWM (None to stop)."""
+        self.pwm_phase = pwm_phase
+
+    def run(self, t=None):
+        """Scheduler job - also called directly when readings are needed with the scheduler stopped."""
+        if self.pwm_phase is None:
+            code = self.voltage_sampler.sample_code()
+        else:
+            code = self._sample_synchronised()
+        if code is not None:
+            self.voltage.push(int(code * 16))
+        if self.runs % ADCAcquisition.DIE_TEMPERATURE_EVERY == 0 or self.die_temperature.count == 0:
+            code = self.die_temperature_adc.read_u16() >> 4
+            if code not in VoltageSampler.DNL_CODES:   # Same bad codes as the divider pin
+                self.die_temperature.push(code << 4)
+        self.runs = (self.runs + 1) % ADCAcquisition.DIE_TEMPERATURE_EVERY
+
+    def _sample_synchronised(self):
+        # One burst placed in the PWM cycle, pushed to the loaded or unloaded ring when
+        # it was clear of the switching edges. Returns its code for the all readings ring.
+        phase = self.pwm_phase
+        counts = phase.counts()
+        on = phase.on_counts()
+        counter = phase.counter()
+        # Converted through counts per 100us so nothing outgrows a small int (no allocation)
+        counts_per_100us = counts * 100 // phase.period_us or 1
+        settle = ADCAcquisition.SETTLE_US * counts_per_100us // 100
+        burst = (min(self.burst_us, 10000) + ADCAcquisition.SETTLE_US) * counts_per_100us // 100
+        self.loaded_age += 1
+
+        ring = None
+        if on >= counts:
+            ring = self.loaded_voltage      # Full duty, no edges
+        elif on == 0:
+            ring = self.unloaded_voltage
+        elif settle <= counter and counter + burst < on:
+            ring = self.loaded_voltage
+        elif on + settle <= counter and counter + burst < counts:
+            ring = self.unloaded_voltage
+        if (ring is not self.loaded_voltage and 0 < on < counts and settle + burst < on
+                and self.loaded_age > ADCAcquisition.LOADED_EVERY
+                and counts - counter <= ADCAcquisition.SYNC_WAIT_US * counts_per_100us // 100):
+            # Heater switches on shortly - wait for it rather than hoping a later run lands in the on time
+            utime.sleep_us((counts - counter + settle) * 100 // counts_per_100us)
+            ring = self.loaded_voltage
+            counter = phase.counter()
+
+        start_us = utime.ticks_us()
+        code = self.voltage_sampler.sample_code()
+        self.burst_us = utime.ticks_diff(utime.ticks_us(), start_us)
+        if code is None or ring is None:
+            return code
+        if 0 < on < counts:
+            # Throw it away if an edge went by during the burst (e.g. held up by an interrupt)
+            end = phase.counter()
+            if end < counter or (ring is self.loaded_voltage and end >= on):
+                return code
+        ring.push(int(code * 16))
+        if ring is self.loaded_voltage:
+            self.loaded_age = 0
+            if self.unloaded_voltage.count:
+                self.sag = self.unloaded_voltage.mean() - self.loaded_voltage.mean()
+        return code
+
+    def loaded_volts(self):
+        """
+        Supply voltage with the heater on, None before the first loaded reading.
+        Once the heater's been off a while it's the unloaded voltage less the last sag seen.
+        """
+        if self.loaded_voltage.count == 0:
+            return None
+        if self.loaded_age > ADCAcquisition.LOADED_STALE_RUNS and self.unloaded_voltage.count:
+            return self.voltage_sampler.volts((self.unloaded_voltage.mean() - self.sag) / 16)
+        return self.voltage_sampler.volts(self.loaded_voltage.mean() / 16)
+
+    def unloaded_volts(self):
+        """Supply voltage with the heater off, None before the first unloaded reading."""
+        if self.unloaded_voltage.count == 0:
+            return None
+        return self.voltage_sampler.volts(self.unloaded_voltage.mean() / 16)
+
+    def latest_volts(self):
+        """Latest supply voltage as read, None if there's nothing yet."""
+        if self.voltage.count == 0:
+            return None
+        return self.voltage_sampler.volts(self.voltage.latest() / 16)
+
+    def input_volts(self, previous_reading=False):
+        """Latest supply voltage, previous_reading if there's nothing yet. Big drops are stepped as get_input_volts does."""
+        volts = self.latest_volts()
+        if volts is None:
+            return previous_reading
+        return self.voltage_sampler.limit_drop(volts, previous_reading)
+
+    def input_volts_mean(self):
+        return self.voltage_sampler.volts(self.voltage.mean() / 16)
+
+    def input_volts_min(self):
+        return self.voltage_sampler.volts(self.voltage.min() / 16)
+
+    def pi_temperature(self):
+        """Die temperature from the mean of the last few readings - one reading is noisy."""
+        for _ in range(4):
+            if self.die_temperature.count:
+                break
+            self.run()
+        if self.die_temperature.count == 0:
+            raise ValueError("no good die temperature reading")
+        volts = self.die_temperature.mean() * 3.3 / 65520
+        return 27 - (volts - 0.706) / 0.001721
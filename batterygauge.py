@@ -0,0 +1,184 @@
+import utime
+
+
+class BatteryGauge:
+    """
+    State of charge and runtime for lipo and lead packs.
+    The control loop works out the open circuit voltage - the terminal voltage
+    plus the drop across the pack's internal resistance at the current the
+    delivered watts draw - and that's looked up on a per cell discharge curve.
+    That's believed once the pack has rested (REST_MS with the heater off) and
+    becomes the anchor; in between the state of charge is the anchor less the
+    Wh delivered since, over the pack's capacity. The capacity comes from the profile, or is learnt from how far
+    the rested state of charge fell for the Wh delivered.
+    Remaining sessions and minutes are worked out from the mean power of the
+    sessions run so far and the profile's session length.
+    The learnt values and the count are saved to STATE_FILE so they survive a reboot.
+    """
+    # (volts per cell, % charge) rising, resting voltage
+    LIPO_CURVE = ((3.27, 0), (3.61, 5), (3.69, 10), (3.71, 15), (3.73, 20), (3.75, 25), (3.77, 30),
+                  (3.79, 35), (3.80, 40), (3.82, 45), (3.84, 50), (3.85, 55), (3.87, 60), (3.91, 65),
+                  (3.95, 70), (3.98, 75), (4.02, 80), (4.08, 85), (4.11, 90), (4.15, 95), (4.20, 100))
+    LEAD_CURVE = ((1.75, 0), (1.92, 10), (1.94, 20), (1.97, 30), (1.99, 40), (2.02, 50),
+                  (2.04, 60), (2.06, 70), (2.08, 80), (2.10, 90), (2.12, 100))
+    UPDATE_MS = 1000
+    REST_MS = 60000            # Heater off this long and the voltage is believed
+    MIN_LEARN_PERCENT = 10     # State of charge the pack must fall by between rests to learn the capacity from
+    SESSION_WATTS_ALPHA = 0.02 # Per update, for the mean session power
+    SAVE_MS = 600000           # Save at most this often while running, and whenever a session ends
+    STATE_FILE = '/battery_state.txt'
+
+    def __init__(self):
+        self.soc = None              # % charge, None until the first update
+        self.anchor_soc = None       # Rested state of charge the count runs from
+        self.wh_since_anchor = 0.0
+        self.learn_soc = None        # Rested state of charge the capacity learning runs from
+        self.learn_wh = 0.0
+        self.learnt_capacity_wh = 0.0
+        self.wh_total = 0.0          # Delivered since the state was first saved
+        self.session_watts = 0.0     # Mean power while in a session, 0 until one has run
+        self.rest_ms = 0
+        self.last_ms = None
+        self.last_save_ms = 0
+        self.in_session = False
+        self.saved_soc = None        # From STATE_FILE, kept if the first reading agrees with it
+        self.dirty = False
+
+    def curve(self, power_type):
+        return BatteryGauge.LIPO_CURVE if power_type == 'lipo' else BatteryGauge.LEAD_CURVE
+
+    def cell_soc(self, curve, cell_volts):
+        """% charge for a resting cell voltage, straight lines between the curve's points."""
+        if cell_volts <= curve[0][0]:
+            return 0
+        for index in range(1, len(curve)):
+            volts, soc = curve[index]
+            if cell_volts < volts:
+                low_volts, low_soc = curve[index - 1]
+                return low_soc + (soc - low_soc) * (cell_volts - low_volts) / (volts - low_volts)
+        return 100
+
+    def capacity_wh(self, shared_state):
+        if shared_state.battery_capacity_wh > 0:
+            return shared_state.battery_capacity_wh
+        return self.learnt_capacity_wh
+
+    def update(self, shared_state):
+        """Scheduler job work - call every UPDATE_MS on the core that owns shared_state."""
+        now_ms = utime.ticks_ms()
+        dt_ms = 0 if self.last_ms is None else utime.ticks_diff(now_ms, self.last_ms)
+        self.last_ms = now_ms
+        power_type = shared_state.power_type
+        open_volts = shared_state.battery_open_volts
+        if power_type not in ('lipo', 'lead') or not open_volts:
+            shared_state.battery_soc = None
+            return
+
+        # Energy delivered since the last update
+        watts = shared_state.watts
+        wh = watts * dt_ms / 3600000
+        self.wh_since_anchor += wh
+        self.learn_wh += wh
+        self.wh_total += wh
+        if wh:
+            self.dirty = True
+
+        cells = shared_state.lipo_count if power_type == 'lipo' else shared_state.lead_cells
+        curve = self.curve(power_type)
+        voltage_soc = self.cell_soc(curve, open_volts / cells)
+
+        if watts > 0:
+            self.rest_ms = 0
+        else:
+            self.rest_ms += dt_ms
+        if self.anchor_soc is None:
+            # First reading - the pack has rested while we were off. Keep the saved count if it agrees
+            # (the voltage curve is only good to a few %), otherwise the pack's been charged or swapped
+            if self.saved_soc is not None and abs(self.saved_soc - voltage_soc) < BatteryGauge.MIN_LEARN_PERCENT:
+                voltage_soc = self.saved_soc
+            self.rest(voltage_soc)
+        elif self.rest_ms >= BatteryGauge.REST_MS:
+            self.rest(voltage_soc)
+
+        capacity_wh = self.capacity_wh(shared_state)
+        if capacity_wh > 0:
+            soc = self.anchor_soc - self.wh_since_anchor * 100 / capacity_wh
+        else:
+            soc = voltage_soc   # Nothing to count against until the capacity's been learnt
+        self.soc = max(0, min(100, soc))
+        shared_state.battery_soc = self.soc
+
+        # Mean session power and what's left at it
+        mode = shared_state.get_mode()
+        in_session = mode == "Session" or mode == "autosession"
+        if in_session and watts > 0:
+            if self.session_watts == 0:
+                self.session_watts = watts
+            else:
+                self.session_watts += (watts - self.session_watts) * BatteryGauge.SESSION_WATTS_ALPHA
+        shared_state.battery_minutes = None
+        shared_state.battery_sessions = None
+        if capacity_wh > 0 and self.session_watts > 0:
+            cutoff_volts = shared_state.lipo_safe_volts if power_type == 'lipo' else shared_state.lead_safe_volts / cells
+            usable_percent = self.soc - self.cell_soc(curve, cutoff_volts)
+            usable_wh = max(0, usable_percent) * capacity_wh / 100
+            shared_state.battery_minutes = int(usable_wh * 60 / self.session_watts)
+            if shared_state.session_timeout:
+                session_wh = self.session_watts * shared_state.session_timeout / 3600000
+                shared_state.battery_sessions = int(usable_wh / session_wh)
+
+        if (self.in_session and not in_session) or (
+                self.dirty and utime.ticks_diff(now_ms, self.last_save_ms) >= BatteryGauge.SAVE_MS):
+            self.save()
+            self.last_save_ms = now_ms
+        self.in_session = in_session
+
+    def rest(self, voltage_soc):
+        """The pack's rested - take its voltage state of charge and learn the capacity if it's fallen far enough."""
+        if self.learn_soc is not None:
+            fallen = self.learn_soc - voltage_soc
+            if fallen >= BatteryGauge.MIN_LEARN_PERCENT and self.learn_wh > 0:
+                capacity_wh = self.learn_wh * 100 / fallen
+                if self.learnt_capacity_wh > 0:
+                    capacity_wh = self.learnt_capacity_wh * 0.7 + capacity_wh * 0.3
+                self.learnt_capacity_wh = capacity_wh
+                self.dirty = True
+                self.learn_soc = None
+            elif fallen < -BatteryGauge.MIN_LEARN_PERCENT / 2:
+                self.learn_soc = None   # Charged since - start again from here
+        if self.learn_soc is None:
+            self.learn_soc = voltage_soc
+            self.learn_wh = 0.0
+        self.anchor_soc = voltage_soc
+        self.wh_since_anchor = 0.0
+
+    def load(self):
+        try:
+            with open(BatteryGauge.STATE_FILE, 'r') as f:
+                for line in f:
+                    if '=' not in line:
+                        continue
+                    key, value = line.split('=', 1)
+                    value = float(value)
+                    if key == 'soc':
+                        self.saved_soc = value
+                    elif key == 'learnt_capacity_wh':
+                        self.learnt_capacity_wh = value
+                    elif key == 'wh_total':
+                        self.wh_total = value
+                    elif key == 'session_watts':
+                        self.session_watts = value
+        except (OSError, ValueError):
+            pass   # Nothing saved yet
+
+    def save(self):
+        try:
+            with open(BatteryGauge.STATE_FILE, 'w') as f:
+                if self.soc is not None:
+                    f.write('soc=' + str(self.soc) + '\n')
+                f.write('learnt_capacity_wh=' + str(self.learnt_capacity_wh) + '\n')
+                f.write('wh_total=' + str(self.wh_total) + '\n')
+                f.write('session_watts=' + str(self.session_watts) + '\n')
+            self.dirty = False
+        except OSError as e:
+            print(f"Warning: Could not save battery state: {e}")
@@ -0,0 +1,76 @@
+class BatteryModel:
+    """
+    Battery pack as an open circuit voltage behind an internal resistance:
+    volts = open_volts - amps * resistance.
+    Both are fitted online from (current, voltage) readings by least squares
+    with old readings forgotten at FORGET per reading, so the fit follows the
+    pack as it discharges and warms up. From the fit the mean terminal
+    voltage at any duty cycle can be predicted, and the highest duty that
+    keeps it above the cutoff worked out before the pack gets there.
+    """
+    FORGET = 0.98                # Weight kept by the older readings each new one - ~50 reading memory
+    MIN_CURRENT_SPREAD = 0.5     # Amps (standard deviation) the readings must cover before the fit is used
+    MIN_RESISTANCE = 0.01        # Fits outside these are noise, keep the last good one
+    MAX_RESISTANCE = 2.0
+    CELL_RESISTANCE = {'lipo': 0.015, 'lead': 0.01}   # Per cell, typical - used until there's a fit
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.weight = 0.0
+        self.sum_amps = 0.0
+        self.sum_volts = 0.0
+        self.sum_amps_squared = 0.0
+        self.sum_amps_volts = 0.0
+        self.open_volts = None     # None until the readings have covered enough current to fit
+        self.resistance = None
+
+    def add_reading(self, amps, volts):
+        forget = BatteryModel.FORGET
+        self.weight = self.weight * forget + 1
+        self.sum_amps = self.sum_amps * forget + amps
+        self.sum_volts = self.sum_volts * forget + volts
+        self.sum_amps_squared = self.sum_amps_squared * forget + amps * amps
+        self.sum_amps_volts = self.sum_amps_volts * forget + amps * volts
+
+        mean_amps = self.sum_amps / self.weight
+        variance = self.sum_amps_squared / self.weight - mean_amps * mean_amps
+        if variance < BatteryModel.MIN_CURRENT_SPREAD * BatteryModel.MIN_CURRENT_SPREAD:
+            return
+        mean_volts = self.sum_volts / self.weight
+        resistance = (mean_amps * mean_volts - self.sum_amps_volts / self.weight) / variance
+        if BatteryModel.MIN_RESISTANCE <= resistance <= BatteryModel.MAX_RESISTANCE:
+            self.resistance = resistance
+            self.open_volts = mean_volts + resistance * mean_amps
+
+    def ready(self):
+        return self.resistance is not None
+
+    def open_circuit_volts(self, volts, amps, default_resistance):
+        """Terminal volts measured with amps flowing plus the drop across the pack - the fitted resistance or default_resistance."""
+        resistance = self.resistance if self.resistance is not None else default_resistance
+        return volts + amps * resistance
+
+    def full_duty_sag(self, heater_resistance):
+        """Volts the pack drops by with the heater on all the time."""
+        return self.open_volts * self.resistance / (heater_resistance + self.resistance)
+
+    def predicted_volts(self, duty_percent, heater_resistance):
+        """Mean terminal voltage with the heater on for duty_percent of the time."""
+        return self.open_volts - self.full_duty_sag(heater_resistance) * duty_percent / 100
+
+    def max_duty_percent(self, min_volts, heater_resistance, volts, duty_percent):
+        """
+        Highest duty that keeps the voltage at or above min_volts, 100 before the fit is ready.
+        Worked from volts measured at duty_percent now rather than the fitted open voltage,
+        which lags behind a discharging pack - only the sag per % duty comes from the fit.
+        """
+        if not self.ready():
+            return 100
+        max_duty = duty_percent + (volts - min_volts) * 100 / self.full_duty_sag(heater_resistance)
+        if max_duty > 100:
+            return 100
+        if max_duty < 0:
+            return 0
+        return max_duty
@@ -1,6 +1,7 @@
 import utime
 import uasyncio as asyncio
 from machine import reset
+from loopstats import LoopStats, format_us
 #from customtimer import CustomTimer
 
 class DisplayManager:
@@ -177,7 +178,7 @@ class DisplayManager:
         # Display error message with word wrapping
         max_lines = 3
         chars_per_line = 16
-        words = error_message.split()
+        words = str(error_message).split()  # ErrorRecords are only formatted here
         lines = []
         current_line = ""
         
@@ -496,7 +497,14 @@ class DisplayManager:
                 t = t + " " + str(int((shared_state.session_timeout - shared_state.get_session_mode_duration())/1000)) + "s"
         self.display.text(t, 0, 16)
 
-        if self.shared_state.control == 'temperature_pid':
+        battery_text = self.battery_text()
+        if battery_text is not None and self.display_height >= 64:
+            self.display.text(battery_text, 0, 32)
+            battery_text = None
+        if battery_text is not None and (self.shared_state.control != 'temperature_pid' or shared_state.get_mode() == "Off"):
+            # Bottom line is free, or only has the idle PID's stats
+            self.display.text(battery_text, 0, 24)
+        elif self.shared_state.control == 'temperature_pid':
             if shared_state.get_mode() == "autosession":
                 # When autosession is running, display elapsed and remaining time
                 elapsed_ms = utime.ticks_diff(utime.ticks_ms(), shared_state.autosession_start_time)
@@ -517,6 +525,18 @@ class DisplayManager:
                     
             self.display.text(t, 0, 24)
 
+    def battery_text(self):
+        """Charge left, then sessions and minutes of heating left once the BatteryGauge knows them - None on mains."""
+        shared_state = self.shared_state
+        if shared_state.battery_soc is None:
+            return None
+        t = "B:" + str(int(shared_state.battery_soc)) + "%"
+        if shared_state.battery_sessions is not None:
+            t = t + " " + str(shared_state.battery_sessions) + "x"
+        if shared_state.battery_minutes is not None:
+            t = t + " " + str(shared_state.battery_minutes) + "m"
+        return t
+
     def show_screen_show_settings(self):
         self.display.fill(0)
         
@@ -563,6 +583,26 @@ class DisplayManager:
 
         self.display.show()
 
+    def show_screen_loop_stats(self):
+        self.display.fill(0)
+        loop_stats = self.shared_state.loop_stats
+        if loop_stats is None:
+            self.display.text("Loop stats off", 0, 0, 1)
+            self.display.show()
+            return
+
+        stage = self.shared_state.loop_stats_line
+        if stage >= len(LoopStats.STAGE_NAMES):
+            stage = len(LoopStats.STAGE_NAMES) - 1
+            self.shared_state.loop_stats_line = stage
+        count, min_us, avg_us, p99_us, max_us = loop_stats.summary(stage)
+
+        self.display.text(LoopStats.STAGE_NAMES[stage], 0, 0, 1)
+        self.display.text("mn" + format_us(min_us) + " av" + format_us(avg_us), 0, 8, 1)
+        self.display.text("99" + format_us(p99_us) + " mx" + format_us(max_us), 0, 16, 1)
+        self.display.text("ovr " + str(self.shared_state.control_loop_overruns) + " n " + str(count), 0, 24, 1)
+        self.display.show()
+
     
     def show_screen_profiles(self):
         self.display.fill(0)
@@ -677,7 +717,7 @@ class DisplayManager:
         method = getattr(self, method_name, None)
         if method:
             # Keep graph-like and interactive screens displayed in a small async loop so they yield
-            graph_options = {'graph_bar', 'graph_line', 'graph_setpoint', 'temp_watts_line', 'watts_line', 'profiles', 'show_settings', 'autosession_profiles'}
+            graph_options = {'graph_bar', 'graph_line', 'graph_setpoint', 'temp_watts_line', 'watts_line', 'profiles', 'show_settings', 'autosession_profiles', 'loop_stats'}
             #if asyncio and option in graph_options:
             if option in graph_options:
                 try:
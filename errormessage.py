@@ -3,3 +3,31 @@ class ErrorMessage(Exception):
     def __init__(self, error_code, error_message="An error has occurred"):
         self.error_code = error_code
         super().__init__(error_message)
+
+
+class ErrorRecord:
+    """
+    Preallocated error raised from the control loop without building strings.
+    code and message are fixed, source (a name shown before the message) and
+    detail (a number, or exception, shown after it) are filled in each time
+    it's raised. Text is only put together when something shows it.
+    """
+
+    def __init__(self, error_code, error_message):
+        self.code = error_code
+        self.message = error_message
+        self.source = None
+        self.detail = None
+        self.count = 0                    # Times raised since power on
+        self.error = (error_code, self)   # Reused as SharedState.current_error
+
+    def text(self):
+        text = self.message
+        if self.source is not None:
+            text = self.source + " " + text
+        if self.detail is not None:
+            text = text + " " + str(self.detail)
+        return text
+
+    def __str__(self):
+        return self.text()
@@ -82,16 +82,32 @@ class InductionHeater(BaseHeater):
 
 
 class ElementHeater(BaseHeater): 
-    def __init__(self, element_pin):
+    """
+    Element on a PWM pin. With dither the duty is kept to 1/DITHER_STEPS of a
+    duty_u16 code and dither() - a Scheduler job once per PWM period - puts out
+    the code below or above it, carrying the left over fraction on to the next
+    period (first order sigma-delta), so the mean power steps finer than one code.
+    Only small ints are used so the job doesn't allocate. The job isn't locked to
+    the PWM's wrap, a period now and then gets two updates or none, which costs
+    at most a code for that period.
+    """
+    PWM_FREQ = 50  # Maybe too much? need to see how this goes with nichrome
+    DITHER_STEPS = 256  # Per code
+
+    def __init__(self, element_pin, dither=False):
         super().__init__() 
         print("ElementHeater Initialising ...")
         self.element = Pin(element_pin, Pin.OUT)
         self.pwm = PWM(self.element) 
-        self.pwm.freq(50) # Maybe too much? need to see how this goes with nichrome
+        self.pwm.freq(ElementHeater.PWM_FREQ)
         self.pwm.duty_u16(0) # Initialize PWM duty cycle to 0 (off)
         self._power = 0
         self.max_duty_cycle_percent = 0
         self.max_duty_cycle = 0
+        self.dither_enabled = dither
+        self.dither_period_ms = 1000 // ElementHeater.PWM_FREQ
+        self._duty = 0          # In 1/DITHER_STEPS of a code, one attribute so the other core sees code and fraction together
+        self._dither_error = 0
         print("ElementHeater initialised.")
 
     def on(self, power=100): # Default to full power (now 100)
@@ -100,6 +116,7 @@ class ElementHeater(BaseHeater):
 
 
     def off(self):
+        self._duty = 0  # Before the write so a dither() part way through puts it back to 0
         self.pwm.duty_u16(0) # Set PWM duty cycle to 0 (off)
         self._is_on = False
 
@@ -109,8 +126,14 @@ class ElementHeater(BaseHeater):
 
     def set_power(self, power):
         power = min(power, self.max_duty_cycle_percent)
-        duty_cycle = int(power * 655.35)
-        duty_cycle = min(duty_cycle, self.max_duty_cycle)
+        if self.dither_enabled:
+            steps = ElementHeater.DITHER_STEPS
+            duty = min(int(power * 655.35 * steps), self.max_duty_cycle * steps)
+            self._duty = duty
+            duty_cycle = duty // steps
+        else:
+            duty_cycle = int(power * 655.35)
+            duty_cycle = min(duty_cycle, self.max_duty_cycle)
         #print(duty_cycle)
         self.pwm.duty_u16(duty_cycle)
         self._is_on = power > 0
@@ -119,6 +142,23 @@ class ElementHeater(BaseHeater):
     def get_power(self):
         return self._power
 
+    def dither(self, t=None):
+        """Scheduler job, every dither_period_ms - the code for the next PWM period."""
+        duty = self._duty
+        code = duty // ElementHeater.DITHER_STEPS   # Not divmod, its tuple would allocate
+        fraction = duty - code * ElementHeater.DITHER_STEPS
+        if fraction == 0:
+            return  # Whole code, set_power has already written it
+        error = self._dither_error + fraction
+        if error >= ElementHeater.DITHER_STEPS:
+            error -= ElementHeater.DITHER_STEPS
+            code += 1   # Can't pass max_duty_cycle, duty is below it when there's a fraction
+        self._dither_error = error
+        self.pwm.duty_u16(code)
+        if self._duty != duty:
+            # set_power or off ran on the other core while this was writing - theirs stands
+            self.pwm.duty_u16(self._duty // ElementHeater.DITHER_STEPS)
+
 #class ElementHeater(BaseHeater): 
 #    def __init__(self, element_pin):
 #        super().__init__() # Initialise the BaseHeater attributes
@@ -0,0 +1,88 @@
+import utime
+
+
+class INA226:
+    """
+    INA226 current/voltage/power monitor on I2C, high side shunt in the heater supply.
+    Runs continuously converting shunt and bus voltage with averaging so each
+    result covers several heater PWM periods. read() only fetches a result when
+    the chip flags a new one, into a preallocated buffer.
+    """
+    # Registers
+    CONFIG = 0x00
+    SHUNT_VOLTAGE = 0x01
+    BUS_VOLTAGE = 0x02
+    POWER = 0x03
+    CURRENT = 0x04
+    CALIBRATION = 0x05
+    MASK_ENABLE = 0x06
+    MANUFACTURER_ID = 0xFE
+
+    TI_ID = 0x5449
+    CONVERSION_READY = 0x0008    # CVRF in MASK_ENABLE, cleared by reading it
+    MODE_CONTINUOUS = 0x07       # Shunt and bus, continuous
+    BUS_VOLTS_PER_BIT = 0.00125
+    AVERAGES = (1, 4, 16, 64, 128, 256, 512, 1024)
+    CONVERSION_US = (140, 204, 332, 588, 1100, 2116, 4156, 8244)
+
+    def __init__(self, i2c, address=0x40, shunt_ohms=0.002, max_amps=20, averages=64, conversion_us=1100):
+        """
+        :param i2c: I2C bus (the display's)
+        :param address: I2C address, 0x40-0x4F from A0/A1
+        :param shunt_ohms: shunt resistor
+        :param max_amps: largest current expected, sets the current resolution
+        :param averages: samples averaged per result - one of AVERAGES
+        :param conversion_us: shunt and bus conversion time - one of CONVERSION_US
+        """
+        if averages not in INA226.AVERAGES or conversion_us not in INA226.CONVERSION_US:
+            raise ValueError("INA226 averages/conversion time not supported")
+        self.i2c = i2c
+        self.address = address
+        self._buffer = bytearray(2)   # Reused for every register read/write so reading doesn't allocate
+
+        if self.read_register(INA226.MANUFACTURER_ID) != INA226.TI_ID:
+            raise OSError("INA226 not found at " + hex(address))
+
+        self.amps_per_bit = max_amps / 32768
+        self.watts_per_bit = self.amps_per_bit * 25
+        self.write_register(INA226.CALIBRATION, int(0.00512 / (self.amps_per_bit * shunt_ohms)))
+        conversion = INA226.CONVERSION_US.index(conversion_us)
+        self.write_register(INA226.CONFIG, (INA226.AVERAGES.index(averages) << 9) | (conversion << 6) | (conversion << 3) | INA226.MODE_CONTINUOUS)
+        self.result_period_ms = averages * conversion_us * 2 // 1000 + 1   # Time between results
+
+        self.volts = 0.0
+        self.amps = 0.0
+        self.watts = 0.0
+        self.sample_time_us = 0   # ticks_us the current result was read
+        self.samples = 0          # Results read since power on
+
+    def write_register(self, register, value):
+        buffer = self._buffer
+        buffer[0] = (value >> 8) & 0xFF
+        buffer[1] = value & 0xFF
+        self.i2c.writeto_mem(self.address, register, buffer)
+
+    def read_register(self, register):
+        buffer = self._buffer
+        self.i2c.readfrom_mem_into(self.address, register, buffer)
+        return (buffer[0] << 8) | buffer[1]
+
+    def read_signed(self, register):
+        value = self.read_register(register)
+        if value & 0x8000:
+            value -= 0x10000
+        return value
+
+    def read(self, t=None):
+        """
+        Fetch the latest result if the chip has a new one. Returns True if it did.
+        Can be used as a Scheduler job callback.
+        """
+        if not self.read_register(INA226.MASK_ENABLE) & INA226.CONVERSION_READY:
+            return False
+        self.volts = self.read_register(INA226.BUS_VOLTAGE) * INA226.BUS_VOLTS_PER_BIT
+        self.amps = self.read_signed(INA226.CURRENT) * self.amps_per_bit
+        self.watts = self.read_register(INA226.POWER) * self.watts_per_bit
+        self.sample_time_us = utime.ticks_us()
+        self.samples += 1
+        return True
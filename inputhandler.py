@@ -1,6 +1,7 @@
 import utime
 from machine import Timer, Pin
 from rotary_irq_rp2 import RotaryIRQ
+from loopstats import LoopStats
 import utils
 
 class InputHandler:
@@ -116,6 +117,14 @@ class InputHandler:
             self.shared_state.rotary_last_mode = "Show Settings"
             #print("setup rotarty show settings" + str(self.rotary.value()))
 
+        elif self.shared_state.rotary_last_mode != "Loop Stats" and self.shared_state.menu_options[self.shared_state.current_menu_position] == "Loop Stats":
+            self.rotary.set(value=self.shared_state.loop_stats_line)
+            self.previous_rotary_value = self.shared_state.loop_stats_line
+            self.rotary.set(min_val=0)
+            self.rotary.set(max_val=len(LoopStats.STAGE_NAMES) - 1)
+            self.rotary.set(range_mode=RotaryIRQ.RANGE_BOUNDED)
+            self.shared_state.rotary_last_mode = "Loop Stats"
+
         else:
             #need to update to temperature-setpoint and for when we have watts-pid control
             if self.shared_state.rotary_last_mode != "setpoint":
@@ -179,6 +188,9 @@ class InputHandler:
             elif self.shared_state.rotary_last_mode == "Show Settings":
                 # Update show settings line
                 self.shared_state.show_settings_line = self.rotary.value()
+            elif self.shared_state.rotary_last_mode == "Loop Stats":
+                # Select which control loop stage to show
+                self.shared_state.loop_stats_line = self.rotary.value()
             else:
                 # Regular setpoint/watts adjustment
                 # Determine adjustment per rotary detent.
@@ -381,7 +393,7 @@ class InputHandler:
 
             # Set new control and update rotary to appropriate value
             self.shared_state.control = new_control
-            self.shared_state.pid.reset()
+            self.shared_state.reset_pid()
             if new_control == 'watts':
                 self.rotary.set(value=self.shared_state.set_watts)
                 self.previous_rotary_value = self.shared_state.set_watts
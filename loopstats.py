@@ -0,0 +1,131 @@
+import utime
+from array import array
+
+
+class LoopStats:
+    """
+    Low overhead per-stage timing for the control loop.
+    Durations are recorded in microseconds into fixed size histograms so
+    nothing is allocated while recording. Totals are kept in two 32 bit
+    words - whole TOTAL_CARRY_US and the rest - so they don't wrap (one
+    word would after ~72 minutes of sample_dt) and never need a big int.
+    Buckets 0-7 hold exact values, after that each power of two is split
+    into 4 buckets (so p99 is accurate to within 25%).
+    Only create this when loop_stats_enabled is set in the profile - callers
+    check for None so there is no cost when disabled.
+    """
+
+    # Stage indexes - keep in the same order as STAGE_NAMES
+    THERMOCOUPLE = 0
+    INPUT_VOLTS = 1
+    PID = 2
+    SET_POWER = 3
+    AUTOSESSION = 4
+    LOG = 5
+    LOOP = 6
+    SAMPLE_DT = 7    # Time between the thermocouple samples the PID ran on - not a duration of our code
+    DT_JITTER = 8    # How much SAMPLE_DT moved from one PID update to the next
+
+    STAGE_NAMES = ('thermocouple', 'input_volts', 'pid', 'set_power', 'autosession', 'log', 'loop', 'sample_dt', 'dt_jitter')
+
+    BUCKETS = 96  # Covers up to ~33 seconds which is far more than we need
+    TOTAL_CARRY_SHIFT = 20
+    TOTAL_CARRY_US = 1 << TOTAL_CARRY_SHIFT
+
+    def __init__(self):
+        stages = len(LoopStats.STAGE_NAMES)
+        self.counts = array('L', [0] * stages)
+        self.totals = array('L', [0] * stages)          # Under TOTAL_CARRY_US
+        self.total_carries = array('L', [0] * stages)   # Whole TOTAL_CARRY_US
+        self.mins = array('L', [0] * stages)
+        self.maxs = array('L', [0] * stages)
+        self.histogram = array('L', [0] * (stages * LoopStats.BUCKETS))
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+            self.totals[i] = 0
+            self.total_carries[i] = 0
+            self.mins[i] = 0
+            self.maxs[i] = 0
+        for i in range(len(self.histogram)):
+            self.histogram[i] = 0
+
+    @staticmethod
+    def bucket_index(duration_us):
+        shift = 0
+        while duration_us >= 8:
+            duration_us >>= 1
+            shift += 1
+        if shift == 0:
+            return duration_us
+        index = 8 + (shift - 1) * 4 + (duration_us - 4)
+        if index >= LoopStats.BUCKETS:
+            index = LoopStats.BUCKETS - 1
+        return index
+
+    @staticmethod
+    def bucket_upper_us(index):
+        """Largest duration that falls into a bucket."""
+        if index < 8:
+            return index
+        shift = (index - 8) // 4 + 1
+        mantissa = (index - 8) % 4 + 4
+        return ((mantissa + 1) << shift) - 1
+
+    def record(self, stage, start_us):
+        """Record time since start_us (from utime.ticks_us()) against a stage."""
+        self.record_us(stage, utime.ticks_diff(utime.ticks_us(), start_us))
+
+    def record_us(self, stage, duration_us):
+        """Record a duration already worked out against a stage."""
+        if duration_us < 0:
+            duration_us = 0
+        if self.counts[stage] == 0 or duration_us < self.mins[stage]:
+            self.mins[stage] = duration_us
+        if duration_us > self.maxs[stage]:
+            self.maxs[stage] = duration_us
+        self.counts[stage] += 1
+        total = self.totals[stage] + duration_us
+        if total >= LoopStats.TOTAL_CARRY_US:
+            self.total_carries[stage] += total >> LoopStats.TOTAL_CARRY_SHIFT
+            total &= LoopStats.TOTAL_CARRY_US - 1
+        self.totals[stage] = total
+        self.histogram[stage * LoopStats.BUCKETS + LoopStats.bucket_index(duration_us)] += 1
+
+    def percentile(self, stage, percent):
+        count = self.counts[stage]
+        if count == 0:
+            return 0
+        target = (count * percent + 99) // 100  # Round up so p99 of 10 samples is the max
+        seen = 0
+        base = stage * LoopStats.BUCKETS
+        for i in range(LoopStats.BUCKETS):
+            seen += self.histogram[base + i]
+            if seen >= target:
+                # Bucket upper bound can be above the real max so clamp to it
+                return min(LoopStats.bucket_upper_us(i), self.maxs[stage])
+        return self.maxs[stage]
+
+    def summary(self, stage):
+        """Return (count, min, avg, p99, max) in microseconds for a stage."""
+        count = self.counts[stage]
+        avg = (self.total_carries[stage] * LoopStats.TOTAL_CARRY_US + self.totals[stage]) // count if count else 0
+        return count, self.mins[stage], avg, self.percentile(stage, 99), self.maxs[stage]
+
+    def report(self, shared_state=None):
+        """Print a table of all stages to the serial console."""
+        print("Loop stats (us):  count    min    avg    p99    max")
+        for stage, name in enumerate(LoopStats.STAGE_NAMES):
+            count, mn, avg, p99, mx = self.summary(stage)
+            print(f"{name:<14}{count:>9}{mn:>7}{avg:>7}{p99:>7}{mx:>7}")
+        if shared_state is not None:
+            print(f"overruns: {shared_state.control_loop_overruns} missed ticks: {shared_state.control_loop_missed_ticks} max latency: {shared_state.control_loop_max_latency_us}us")
+            print(f"pid dt: {shared_state.pid_dt_us}us max dt jitter: {shared_state.pid_dt_max_jitter_us}us")
+
+
+def format_us(duration_us):
+    """Short duration text for the small display."""
+    if duration_us >= 10000:
+        return str(duration_us // 1000) + "ms"
+    return str(duration_us) + "us"
@@ -5,13 +5,19 @@ import machine
 from machine import ADC, Pin, I2C, Timer, WDT, PWM, reset
 import uasyncio as asyncio
 
-from thermocouple import Thermocouple
+from thermocouple import Thermocouple, MAX_PROBES
 from displaymanager import DisplayManagerFactory
 from inputhandler import InputHandler
 from menusystem import MenuSystem
 from heaters import HeaterFactory
 import utils
 from shared_state import SharedState
+from loopstats import LoopStats
+from adcacquisition import ADCAcquisition, PWMPhase
+from ina226 import INA226
+from snapshot import Snapshot
+from batterymodel import BatteryModel
+from batterygauge import BatteryGauge
 
 
 # Load hardware configuration
@@ -36,14 +42,37 @@ hardware_pin_switch_middle = hw.get('switch_middle', 24)
 hardware_pin_switch_right = hw.get('switch_right', 25)
 
 hardware_pin_thermocouple_sck = hw.get('thermocouple_sck', 6)
-hardware_pin_thermocouple_cs = hw.get('thermocouple_cs', 7)
+hardware_pin_thermocouple_cs = [int(pin) for pin in str(hw.get('thermocouple_cs', 7)).split(',')]  # One CS per thermocouple, e.g. 7,9
+hardware_thermocouple_names = hw.get('thermocouple_names', None)  # Names for each CS, e.g. tip,coil
+if hardware_thermocouple_names is not None:
+    hardware_thermocouple_names = [name.strip() for name in str(hardware_thermocouple_names).split(',')]
 hardware_pin_thermocouple_so = hw.get('thermocouple_so', 8)
+# Thermocouple driver: 'bitbang' (any pins), 'pio' (background PIO state machine), 'spi' (hardware SPI block thermocouple_spi_id) or 'softspi'
+hardware_thermocouple_driver = hw.get('thermocouple_driver', 'bitbang')
+hardware_thermocouple_spi_id = hw.get('thermocouple_spi_id', 0)
+hardware_pin_thermocouple_mosi = hw.get('thermocouple_mosi', None)  # Unconnected pin SPI can claim as MOSI
+hardware_thermocouple_pio_sm = hw.get('thermocouple_pio_sm', 0)  # State machine for thermocouple_driver = pio
+hardware_thermocouple_type = hw.get('thermocouple_type', 'max6675')  # max6675, max31855 or max31856
+hardware_thermocouple_averaging = hw.get('thermocouple_averaging', 1)  # MAX31856 samples per reading
+hardware_thermocouple_mains_hz = hw.get('thermocouple_mains_hz', 50)  # MAX31856 mains rejection
 
 hardware_pin_heater = hw.get('heater', 22)
 hardware_pin_voltage_divider_adc = hw.get('voltage_divider_adc', 28)
+hardware_voltage_divider_r1 = hw.get('voltage_divider_r1', 910000)  # Measured values give a calibrated divider
+hardware_voltage_divider_r2 = hw.get('voltage_divider_r2', 102000)
+hardware_voltage_adc_samples = hw.get('voltage_adc_samples', 8)
+hardware_voltage_pwm_sync = hw.get('voltage_pwm_sync', 1) == 1  # Time supply readings against the element's PWM
+hardware_heater_dither = hw.get('heater_dither', 0) == 1  # Dither the element's duty for steps finer than one PWM code
+hardware_ina226 = hw.get('ina226', 0) == 1  # INA226 power monitor on the display's I2C bus
+hardware_ina226_address = hw.get('ina226_address', 0x40)
+hardware_ina226_shunt_ohms = float(hw.get('ina226_shunt_ohms', 0.002))
+hardware_ina226_max_amps = hw.get('ina226_max_amps', 20)
+
+# Run sensor/PID/heater/safety on the RP2040's second core (1) or with the UI on one core (0)
+dual_core_control = hw.get('dual_core_control', 0) == 1
 
 # Configure global hardware pins in utils module
-utils.set_voltage_divider_adc_pin(hardware_pin_voltage_divider_adc)
+utils.set_voltage_divider_adc_pin(hardware_pin_voltage_divider_adc, hardware_voltage_divider_r1, hardware_voltage_divider_r2, hardware_voltage_adc_samples)
 
 
 ####################################
@@ -52,198 +81,485 @@ utils.set_voltage_divider_adc_pin(hardware_pin_voltage_divider_adc)
 
 
 
+def timerUpdateBatteryGauge(t):
+    # Core 0 in both modes - it has the watts and voltage from the control loop and owns the filesystem
+    battery_gauge.update(shared_state)
+
+
 def timerSetPiTemp(t):
-    global pi_temperature_sensor, pidTimer, display_manager, heater, shared_state
+    global adc_acquisition, pidTimer, display_manager, heater, shared_state
    
-    shared_state.pi_temperature = utils.get_pi_temperature_or_handle_error(pi_temperature_sensor,display_manager,shared_state)
+    shared_state.pi_temperature = utils.get_pi_temperature_or_handle_error(adc_acquisition,display_manager,shared_state)
     
     # Check if the temperature is safe
     if shared_state.pi_temperature > shared_state.pi_temperature_limit:
         try:
             if not pidTimer.is_timer_running(): pidTimer.stop() 
+            pause_control(True)
             heater.off()
             error_text = shared_state.error_messages.get("pi-too_hot", "PI too hot")
             shared_state.set_error("pi-too_hot", error_text)
             while not shared_state.pi_temperature <= shared_state.pi_temperature_limit:
-                shared_state.pi_temperature = utils.get_pi_temperature_or_handle_error(pi_temperature_sensor,display_manager,shared_state)
+                adc_acquisition.run()  # Scheduler is held up in here so read the ADC ourselves
+                shared_state.pi_temperature = utils.get_pi_temperature_or_handle_error(adc_acquisition,display_manager,shared_state)
                 utime.sleep_ms(250)  # Warning shown for 5 secs so has had a time to cool down a bit
             
             shared_state.clear_error()
-            pidTimer.start()
+            pause_control(False)
+            if not dual_core_control: pidTimer.start()
         except Exception as e:
             heater.off()
             print("Error updating display or deinitializing timers:", e)
             # dont feed watchdog let it reboot
     else:
-        if not pidTimer.is_timer_running(): pidTimer.start()
+        if not dual_core_control and not pidTimer.is_timer_running(): pidTimer.start()
+
+
+# Control loop
+#
+# The pidTimer callback runs in IRQ context so it only timestamps the tick
+# and wakes control_task() through a ThreadSafeFlag. All the real work
+# (thermocouple bit-banging, ADC, PID, heater output, logging) happens in
+# the control task where it can yield to the display and input tasks
+# between stages instead of stalling everything inside the callback.
+
+control_flag = asyncio.ThreadSafeFlag()
+control_tick_us = 0           # ticks_us() of the last timer tick
+control_tick_pending = False  # True until control_task has picked up the tick
+
+
+def get_control_period_ms():
+    # Reading the MAX6675 starts its next conversion so a period of whole
+    # conversions keeps the control tick in phase with the sensor
+    conversion_period_ms = thermocouple.conversion_period_ms if thermocouple is not None else None
+    return shared_state.get_control_period_ms(conversion_period_ms)
+
+
+def timerControlTick(t):
+    global control_tick_us, control_tick_pending
+    if control_tick_pending:
+        # Previous tick not picked up yet - control task is running late
+        shared_state.control_loop_missed_ticks += 1
+    control_tick_us = utime.ticks_us()
+    control_tick_pending = True
+    control_flag.set()
+
+
+# Supply readings for the control loop
+#
+# The ADC job fills the rings on core 0. With dual core control the control
+# loop runs on core 1, so rather than reading the rings while core 0 is
+# writing them the ADC job publishes what it has just read to
+# supply_snapshot after each run (the job is the only writer) and the
+# control loop copies that. With one core the control loop reads the rings.
+
+# Supply snapshot fields - written by the ADC job
+SUP_VOLTS = 0        # Latest reading, before limit_drop
+SUP_MEAN = 1
+SUP_MIN = 2
+SUP_LOADED = 3       # Heater on, None until measured
+SUP_UNLOADED = 4     # Heater off, None until measured
+SUP_SIZE = 5
+
+supply_snapshot = Snapshot(SUP_SIZE)
+supply_readings = [None] * SUP_SIZE   # The control loop's copy
+
+
+def fillSupplyReadings(values):
+    # Leaves values as they were until the rings have a reading
+    if adc_acquisition.voltage.count == 0:
+        return
+    values[SUP_VOLTS] = adc_acquisition.latest_volts()
+    values[SUP_MEAN] = adc_acquisition.input_volts_mean()
+    values[SUP_MIN] = adc_acquisition.input_volts_min()
+    values[SUP_LOADED] = adc_acquisition.loaded_volts()
+    values[SUP_UNLOADED] = adc_acquisition.unloaded_volts()
+
+
+def publishSupplyReadings():
+    # Core 0: hand the supply readings to the control core
+    if adc_acquisition.voltage.count == 0:
+        return
+    fillSupplyReadings(supply_snapshot.back_buffer())
+    supply_snapshot.publish()
+
+
+def readSupply(values):
+    # Control loop: the latest supply readings into values
+    if dual_core_control:
+        if supply_snapshot.seq() != 0:
+            supply_snapshot.read_into(values)
+    else:
+        fillSupplyReadings(values)
 
 
-def timerUpdatePIDandHeater(t):  #may replace what this does in the check thermocouple function 
+def timerReadADC(t):
+    adc_acquisition.run()
+    if dual_core_control:
+        publishSupplyReadings()
+
+
+# INA226 readings for the control loop - passed over as the supply readings are, so
+# the control loop always sees one result's volts, amps, watts and time together
+
+# Power monitor snapshot fields - written by the INA226 job
+PM_VOLTS = 0
+PM_AMPS = 1
+PM_WATTS = 2
+PM_SAMPLE_US = 3     # ticks_us the result was read
+PM_SAMPLES = 4       # Results read since power on
+PM_SIZE = 5
+
+power_monitor_snapshot = Snapshot(PM_SIZE)
+power_monitor_readings = [0] * PM_SIZE   # The control loop's copy
+
+
+def fillPowerMonitorReadings(values):
+    values[PM_VOLTS] = ina226.volts
+    values[PM_AMPS] = ina226.amps
+    values[PM_WATTS] = ina226.watts
+    values[PM_SAMPLE_US] = ina226.sample_time_us
+    values[PM_SAMPLES] = ina226.samples
+
+
+def publishPowerMonitorReadings():
+    # Core 0: hand the latest INA226 result to the control core
+    fillPowerMonitorReadings(power_monitor_snapshot.back_buffer())
+    power_monitor_snapshot.publish()
+
+
+def readPowerMonitor(values):
+    # Control loop: the latest INA226 result into values
+    if dual_core_control:
+        if power_monitor_snapshot.seq() != 0:
+            power_monitor_snapshot.read_into(values)
+    else:
+        fillPowerMonitorReadings(values)
+
+
+def timerReadINA226(t):
+    if ina226.read() and dual_core_control:
+        publishPowerMonitorReadings()
+
+
+def updateWattsPID(shared_state, power_model):
+    # Watts control on the INA226's measured power. V^2/R gives the starting duty
+    # (so switching to watts doesn't bump) and the PID trims out what the model
+    # gets wrong - supply sag, wiring losses, the element's resistance changing with temperature
+    power_monitor = power_monitor_readings
+    watts_pid = shared_state.watts_pid
+    watts_pid.setpoint = shared_state.set_watts
+    if watts_pid.output_limits[1] != shared_state.heater_max_duty_cycle_percent:
+        watts_pid.output_limits = (0, shared_state.heater_max_duty_cycle_percent)  # Don't wind up past the max watts limit
+    if not watts_pid.auto_mode:
+        shared_state.watts_pid_power = power_model.duty_for_watts(shared_state.set_watts)
+        watts_pid.set_auto_mode(True, last_output=shared_state.watts_pid_power)
+        shared_state.watts_pid_last_sample_us = power_monitor[PM_SAMPLE_US]  # Result from before now isn't for this duty
+        return shared_state.watts_pid_power
+    dt_us = utime.ticks_diff(power_monitor[PM_SAMPLE_US], shared_state.watts_pid_last_sample_us)
+    if dt_us > 0:
+        # New result - run on the time between results as the temperature PID does
+        shared_state.watts_pid_last_sample_us = power_monitor[PM_SAMPLE_US]
+        shared_state.watts_pid_power = watts_pid(power_monitor[PM_WATTS], dt=dt_us / 1000000)
+    return shared_state.watts_pid_power
+
+
+def updateBatteryModel(shared_state, duty_percent, loaded_volts, unloaded_volts):
+    # Current and voltage pairs for the pack's internal resistance fit - from the INA226 if there's
+    # one, else the PWM synchronised loaded/unloaded readings, else the mean voltage against the mean
+    # current for the duty. The mean lags the duty by the ring's length so that's only used once the
+    # duty has held steady for a couple of ticks.
+    battery_model = shared_state.battery_model
+    if ina226 is not None:
+        power_monitor = power_monitor_readings
+        if power_monitor[PM_SAMPLES] != shared_state.battery_model_samples:
+            shared_state.battery_model_samples = power_monitor[PM_SAMPLES]
+            battery_model.add_reading(power_monitor[PM_AMPS], power_monitor[PM_VOLTS])
+    elif loaded_volts is not None and unloaded_volts is not None:
+        battery_model.add_reading(0, unloaded_volts)
+        battery_model.add_reading(loaded_volts / shared_state.heater_resistance, loaded_volts)
+    elif abs(duty_percent - shared_state.battery_model_duty) > 0.5:
+        shared_state.battery_model_duty = duty_percent
+        shared_state.battery_model_steady_ticks = 0
+    elif shared_state.battery_model_steady_ticks < 2:
+        shared_state.battery_model_steady_ticks += 1
+    else:
+        if battery_model.ready():
+            on_amps = battery_model.open_volts / (shared_state.heater_resistance + battery_model.resistance)
+        else:
+            on_amps = shared_state.input_volts_mean / shared_state.heater_resistance  # Overestimate until there's a fit
+        battery_model.add_reading(on_amps * duty_percent / 100, shared_state.input_volts_mean)
+
+
+def updatePIDandHeater(shared_state):  #may replace what this does in the check thermocouple function 
                                  #this needs a major clear up now we have share_state 
-    global heater, thermocouple, pidTimer, display_manager, shared_state
+    # shared_state is passed in as in dual core mode this runs on core 1 against its own control_state
+    global heater, thermocouple, pidTimer, display_manager, ina226
+
+    loop_stats = shared_state.loop_stats  # None when disabled in profile
 
     if shared_state.pid.setpoint != shared_state.temperature_setpoint:
         shared_state.pid.setpoint = shared_state.temperature_setpoint
 
-    if thermocouple is not None:
+    off_sampler = thermocouple.off_temperature_sampler if thermocouple is not None else None
+
+    if off_sampler is not None and off_sampler.is_settling():
+        # Heater is off waiting for a clean induction reading (started on an earlier tick)
+        need_heater_off_temperature = False
+        if off_sampler.ready():
+            if loop_stats: stage_start_us = utime.ticks_us()
+            new_heater_temperature, _ = utils.get_thermocouple_temperature_or_handle_error(thermocouple, heater, pidTimer, display_manager, shared_state)
+            if loop_stats: loop_stats.record(LoopStats.THERMOCOUPLE, stage_start_us)
+            off_sampler.done()  # Power gets restored below if the reading is good
+        else:
+            new_heater_temperature = shared_state.heater_temperature  # Keep last good reading until then
+    elif thermocouple is not None:
+        if loop_stats: stage_start_us = utime.ticks_us()
         new_heater_temperature, need_heater_off_temperature = utils.get_thermocouple_temperature_or_handle_error(thermocouple, heater, pidTimer, display_manager, shared_state)
+        if loop_stats: loop_stats.record(LoopStats.THERMOCOUPLE, stage_start_us)
     else:
         new_heater_temperature = 0
         need_heater_off_temperature = False
 
     if new_heater_temperature < 0: # Non fatal error occured 
         heater.off() #should already be off
-        return   # Let timer run this again and hopefully next time error has passed
+        return False   # Let timer run this again and hopefully next time error has passed
 
     # new temperature is valid
+    estimator = thermocouple.temperature_estimator if thermocouple is not None else None
+    estimating = estimator is not None and estimator.enabled
+    if estimating:
+        # Move the estimate on with the power applied since the last tick, then correct it if there's a new reading
+        heater_power = 0
+        if heater.is_on():
+            heater_power = heater.get_power() if shared_state.heater_type == 'element' else 100
+        estimator.predict(utime.ticks_ms(), heater_power)
+        if thermocouple.sample_fresh:
+            estimator.correct(new_heater_temperature, thermocouple.sample_time)
+        if estimator.temperature is None:
+            estimating = False  # Nothing to estimate from yet (e.g. no fresh reading since a reset) - use the reading
+        else:
+            new_heater_temperature = estimator.temperature
+            shared_state.heater_temperature_rate = estimator.rate()
     shared_state.heater_temperature = new_heater_temperature
+    # When the temperature was taken - the PID's dt runs from sample to sample, not from call to call
+    if thermocouple is not None and not estimating:
+        sample_us = thermocouple.sample_time_us
+    else:
+        sample_us = utime.ticks_us()  # Estimate (or no sensor) is for now
     
-    shared_state.input_volts = utils.get_input_volts(shared_state.input_volts)
-
-    #shared_state.heater_max_duty_cycle_percent - need to update this now and adjust to MAX WATTS (add to shared state)
-    if shared_state.input_volts > 0:
-        shared_state.heater_max_duty_cycle_percent = (shared_state.temporary_max_watts / (shared_state.input_volts * shared_state.input_volts / shared_state.heater_resistance)) * 100  
+    if loop_stats: stage_start_us = utime.ticks_us()
+    supply = supply_readings
+    readSupply(supply)  # Latest background readings, no ADC wait
+    if ina226 is not None:
+        readPowerMonitor(power_monitor_readings)
+    if supply[SUP_VOLTS] is not None:
+        shared_state.input_volts = adc_acquisition.voltage_sampler.limit_drop(supply[SUP_VOLTS], shared_state.input_volts)
+    shared_state.input_volts_mean = supply[SUP_MEAN]
+    shared_state.input_volts_min = supply[SUP_MIN]
+    # V^2/R and the max duty use the voltage the element gets while it's on, if it's been measured
+    loaded_volts = supply[SUP_LOADED]
+    shared_state.input_volts_loaded = loaded_volts if loaded_volts is not None else shared_state.input_volts
+    unloaded_volts = supply[SUP_UNLOADED]
+    shared_state.input_volts_unloaded = unloaded_volts if unloaded_volts is not None else shared_state.input_volts
+    # Mean supply voltage for the duty being applied - the loaded and unloaded readings weighted by
+    # the duty when they're measured, as the ring mean is noisy with the readings at random PWM phases
+    duty_percent = 0
+    if heater.is_on():
+        duty_percent = heater.get_power() if shared_state.heater_type == 'element' else 100
+    if loaded_volts is not None and unloaded_volts is not None:
+        shared_state.input_volts_duty_mean = unloaded_volts - (unloaded_volts - loaded_volts) * duty_percent / 100
     else:
-        shared_state.heater_max_duty_cycle_percent = 100
-        
-    if shared_state.heater_max_duty_cycle_percent > 100:
-        shared_state.heater_max_duty_cycle_percent = 100
-    heater.set_max_duty_cycle(shared_state.heater_max_duty_cycle_percent)
+        shared_state.input_volts_duty_mean = shared_state.input_volts_mean
+    battery = shared_state.power_type == 'lipo' or shared_state.power_type == 'lead'
+    if battery:
+        updateBatteryModel(shared_state, duty_percent, loaded_volts, unloaded_volts)
+    if loop_stats: loop_stats.record(LoopStats.INPUT_VOLTS, stage_start_us)
+
+    # Max duty cycle for the (temporary) max watts at this voltage - only recalculated when it moves
+    power_model = shared_state.power_model
+    power_model.set_max_watts(shared_state.temporary_max_watts)
+    if power_model.update_volts(shared_state.input_volts_loaded):
+        shared_state.heater_max_duty_cycle_percent = power_model.max_duty_cycle_percent
+        heater.set_max_duty_cycle(shared_state.heater_max_duty_cycle_percent)
     
     if need_heater_off_temperature:
         heater.off()
         print("Getting safe off heater temperature")
-        utime.sleep_ms(301) # lets give everything a moment to calm down
-        new_heater_temperature, _ = utils.get_thermocouple_temperature_or_handle_error(thermocouple, heater, pidTimer, display_manager, shared_state)
-        if new_heater_temperature < 0: # Non fatal error occured 
-            return   # Let timer run this again and hopefully next time error has passed
-        # new off temperature is valid
-        shared_state.heater_temperature = new_heater_temperature
+        off_sampler.start()  # Reading is taken on a later tick once the off window has passed
 
-    # Append to ring buffer - automatically removes oldest when full
-    shared_state.temperature_readings.append(int(shared_state.heater_temperature))
-    shared_state.input_volts_readings.append(shared_state.input_volts)
-
-    shared_state.temperature_setpoint_readings.append(int(shared_state.temperature_setpoint))
-
-    # Calculate watts and append to ring buffer
-    if heater.is_on():
+    # Calculate watts
+    if ina226 is not None:
+        shared_state.watts = int(power_monitor_readings[PM_WATTS])  # Measured, includes the supply sag and the element's resistance drift
+    elif heater.is_on():
         # Calculate actual watts from voltage, resistance, and actual duty cycle
         # Don't use heater_max_duty_cycle_percent as that's a safety limit, not the actual power
-        shared_state.watts = int((((shared_state.input_volts*shared_state.input_volts) / shared_state.heater_resistance) * (heater.get_power() / 100)))
+        shared_state.watts = int(power_model.watts_for_duty(heater.get_power()))
     else:
         shared_state.watts = 0
-    
-    shared_state.watt_readings.append(shared_state.watts)
 
-    # Check if autosession is active and update setpoint if needed
-    if shared_state.get_mode() == "autosession" and shared_state.autosession_profile:
-        # Calculate actual elapsed time since autosession start (adjusted by rotary dial)
-        elapsed_ms = utime.ticks_diff(utime.ticks_ms(), shared_state.autosession_start_time)
-        # Clamp elapsed time to valid range (0 to profile duration)
-        elapsed_ms = max(0, elapsed_ms)
-        
-        profile_setpoint = shared_state.autosession_profile.get_setpoint_at_elapsed_time(elapsed_ms)
-        
-        if profile_setpoint is not None:
-            # Profile is still active, update setpoint
-            shared_state.temperature_setpoint = profile_setpoint
+    if battery:
+        # Pack voltage with the drop from the mean current added back, for the BatteryGauge on core 0
+        if ina226 is not None:
+            amps = power_monitor_readings[PM_AMPS]
         else:
-            # Profile has finished
-            # End the session when autosession profile completes
-            shared_state.set_mode("Off")
+            amps = shared_state.watts / shared_state.input_volts_loaded if shared_state.input_volts_loaded else 0
+        cells = shared_state.lipo_count if shared_state.power_type == 'lipo' else shared_state.lead_cells
+        shared_state.battery_open_volts = shared_state.battery_model.open_circuit_volts(
+            shared_state.input_volts_duty_mean, amps, BatteryModel.CELL_RESISTANCE[shared_state.power_type] * cells)
+
+    # Check if autosession is active and update setpoint if needed
+    updateAutosessionSetpoint(shared_state)
+
+    settling = off_sampler is not None and off_sampler.is_settling()
+
+    stale_sample = thermocouple is not None and not thermocouple.sample_fresh and not estimating
+    if stale_sample:
+        shared_state.stale_sample_count += 1
 
     if shared_state.control == 'temperature_pid' or shared_state.control == 'autosession':
-        if shared_state.heater_temperature is not None:
-            power = shared_state.pid(shared_state.heater_temperature)  # Update pid even if heater is off
+        if settling:
+            power = 0  # Don't feed the PID the pre off-window reading again
+        elif stale_sample:
+            power = shared_state.pid_power  # No new conversion - hold output, the next one's dt covers this tick
+        elif shared_state.heater_temperature is not None:
+            dt_us = shared_state.pid_sample_dt_us(sample_us)
+            if dt_us == 0:
+                power = shared_state.pid_power  # Same sample as last time
+            else:
+                if loop_stats: stage_start_us = utime.ticks_us()
+                if dt_us is None:
+                    power = shared_state.pid(shared_state.heater_temperature)  # First since a reset, PID times it from the reset
+                else:
+                    power = shared_state.pid(shared_state.heater_temperature, dt=dt_us / 1000000)  # Update pid even if heater is off
+                if loop_stats: loop_stats.record(LoopStats.PID, stage_start_us)
+                shared_state.pid_power = power
         else:
             power = 0  # No valid temperature, stay off
     elif shared_state.control == 'duty_cycle':
         power = shared_state.set_duty_cycle  # Use duty cycle directly (0-100%)
+    elif ina226 is not None and shared_state.get_mode() != "Off":
+        power = updateWattsPID(shared_state, power_model)
     else:
         # In watts mode, calculate duty cycle needed to produce desired watts at current voltage
-        # watts = (V^2 / R) * (duty% / 100)
-        # duty% = (watts * R / V^2) * 100
-        if shared_state.input_volts > 0:
-            power = (shared_state.set_watts * shared_state.heater_resistance / (shared_state.input_volts * shared_state.input_volts)) * 100
-        else:
-            power = 0
+        power = power_model.duty_for_watts(shared_state.set_watts)
+
+    if shared_state.watts_pid.auto_mode and (shared_state.control != 'watts' or shared_state.get_mode() == "Off"):
+        shared_state.watts_pid.auto_mode = False  # Seeded again from V^2/R when watts control next runs
 
     power = min(power , 100)  #Limit happening in heater set power but lets limit here too
     
+    # Supply voltage check for the profile's power_type (built in apply_profile)
+    # Checked while off too so its error clears once the voltage recovers
+    # On the mean voltage - the latest reading swings with where it landed in the PWM cycle
+    power_safety = shared_state.power_safety
+    power_safe = power_safety.check(shared_state.input_volts_duty_mean, shared_state)
+
+    if battery and shared_state.battery_sag_limit:
+        # Keep the predicted sag above the cutoff so the check above doesn't end the session
+        shared_state.battery_duty_cap = shared_state.battery_model.max_duty_percent(
+            power_safety.threshold_volts + shared_state.battery_sag_margin, shared_state.heater_resistance,
+            shared_state.input_volts_duty_mean, duty_percent)
+        if power > shared_state.battery_duty_cap:
+            power = shared_state.battery_duty_cap
+
     if shared_state.get_mode() == "Off": 
         heater.off()
-        return
+        return True
     
-    if shared_state.power_type == 'lipo':
-        if (shared_state.input_volts / shared_state.lipo_count) < shared_state.lipo_safe_volts:
-            heater.off()
-            shared_state.set_mode("Off")
-            error_text = shared_state.error_messages.get("battery_level-too-low", "Battery too low")
-            shared_state.set_error("battery_level-too-low", error_text)
-        else:
-            # Voltage is safe, clear error
-            shared_state.clear_error()
-    elif shared_state.power_type == 'lead':
-        if shared_state.input_volts  < shared_state.lead_safe_volts:
-            heater.off()
-            shared_state.set_mode("Off")
-            error_text = shared_state.error_messages.get("battery_level-too-low", "Battery too low")
-            shared_state.set_error("battery_level-too-low", error_text)
-        else:
-            # Voltage is safe, clear error
-            shared_state.clear_error()
-    elif shared_state.power_type == 'mains':
-        if shared_state.input_volts > shared_state.mains_safe_volts:
-            heater.off()
-            shared_state.set_mode("Off")
-            error_text = shared_state.error_messages.get("mains-voltage-too-high", "Mains voltage too high")
-            shared_state.set_error("mains-voltage-too-high", error_text)
-        else:
-            # Voltage is safe, clear error
-            shared_state.clear_error()
-    else:
+    if not power_safe:
         heater.off()
         shared_state.set_mode("Off")
-        error_text = shared_state.error_messages.get("unknown-power-type", "Unknown power type")
-        shared_state.set_error("unknown-power-type", error_text)    
-   
+        power_safety.trip(shared_state)
+        return True
+
+    if settling:
+        # Safety checks above still run but heater stays off until the off reading is taken
+        heater.off()
+        return True
         
     if power > shared_state.power_threshold:
-        # Temperature over-limit protection with hysteresis
-        if shared_state.heater_temperature > 250:
+        # Temperature over-limit protection with hysteresis - on the hottest thermocouple if there's more than one
+        hottest_temperature = shared_state.heater_temperature
+        if shared_state.heater_max_temperature > hottest_temperature:
+            hottest_temperature = shared_state.heater_max_temperature
+        if hottest_temperature > 250:
             shared_state.heater_too_hot = True
-        elif shared_state.heater_temperature < 240:  # Hysteresis threshold
+        elif hottest_temperature < 240:  # Hysteresis threshold
             shared_state.heater_too_hot = False
         
         if shared_state.heater_too_hot:
             # Ensure heater is OFF before showing error
             heater.set_power(0)
             heater.off()
-            error_text = "Pausing heater - " + shared_state.error_messages["heater-too_hot"] + " " + str(shared_state.heater_temperature)
+            error_text = "Pausing heater - " + shared_state.error_messages["heater-too_hot"] + " " + str(hottest_temperature)
             print(error_text)
             # Set error in shared_state to display on screen
             if not shared_state.has_error():
                 shared_state.set_error("heater-too_hot", error_text)
         else:
-            # Temperature is safe, clear error flag
-            shared_state.clear_error()
+            # Temperature is safe, clear our error - not ones raised by other checks
+            current_error = shared_state.current_error
+            if current_error is not None and current_error[0] == "heater-too_hot":
+                shared_state.clear_error()
             # Only turn heater back on if we were trying to heat
             if not heater.is_on():
                 if shared_state.get_mode() != "Off":
                     heater.on(power)
             # Set power only when temperature is safe
             if shared_state.heater_type == 'element':
+                if loop_stats: stage_start_us = utime.ticks_us()
                 heater.set_power(power)
+                if loop_stats: loop_stats.record(LoopStats.SET_POWER, stage_start_us)
     else:
         heater.off()  #Maybe we call this no matter what just in case?
-    
+    return True
+
+
+def updateAutosessionSetpoint(shared_state):
+    if shared_state.get_mode() == "autosession" and shared_state.autosession_profile:
+        loop_stats = shared_state.loop_stats
+
+        # Calculate actual elapsed time since autosession start (adjusted by rotary dial)
+        elapsed_ms = utime.ticks_diff(utime.ticks_ms(), shared_state.autosession_start_time)
+        # Clamp elapsed time to valid range (0 to profile duration)
+        elapsed_ms = max(0, elapsed_ms)
+        
+        if loop_stats: stage_start_us = utime.ticks_us()
+        profile_setpoint = shared_state.autosession_profile.get_setpoint_at_elapsed_time(elapsed_ms)
+        if loop_stats: loop_stats.record(LoopStats.AUTOSESSION, stage_start_us)
+        
+        if profile_setpoint is not None:
+            # Profile is still active, update setpoint
+            shared_state.temperature_setpoint = profile_setpoint
+        else:
+            # Profile has finished
+            # End the session when autosession profile completes
+            shared_state.set_mode("Off")
+
+
+def updateReadingsAndLog():
+    global heater, shared_state
+
+    loop_stats = shared_state.loop_stats
+
+    # Append to ring buffer - automatically removes oldest when full
+    shared_state.temperature_readings.append(int(shared_state.heater_temperature))
+    probe_readings = shared_state.probe_temperature_readings
+    if len(probe_readings) > 1:
+        for index in range(len(probe_readings)):
+            probe_readings[index].append(int(shared_state.probe_temperatures[index]))
+    shared_state.input_volts_readings.append(shared_state.input_volts)
+    shared_state.temperature_setpoint_readings.append(int(shared_state.temperature_setpoint))
+    shared_state.watt_readings.append(shared_state.watts)
+
     # Log autosession data if active and logging is enabled
     if shared_state.autosession_logging_enabled and shared_state.get_mode() == "autosession" and shared_state.autosession_profile:
         elapsed_ms = utime.ticks_diff(utime.ticks_ms(), shared_state.autosession_start_time)
         elapsed_ms = max(0, elapsed_ms)
         
         # Log the data with buffering
+        if loop_stats: stage_start_us = utime.ticks_us()
         shared_state.autosession_log_buffer, shared_state.autosession_log_file = utils.log_autosession_data(
             shared_state.autosession_log_file,
             shared_state.autosession_log_buffer,
@@ -259,9 +575,267 @@ def timerUpdatePIDandHeater(t):  #may replace what this does in the check thermo
             shared_state.autosession_log_buffer_flush_threshold,
             shared_state.led_blue_pin
         )
+        if loop_stats: loop_stats.record(LoopStats.LOG, stage_start_us)
+
 
+async def control_task():
+    global control_tick_pending
+    while True:
+        await control_flag.wait()
+        control_tick_pending = False
+        tick_us = control_tick_us
 
+        # Wake-up latency: time between the timer tick and the task running
+        latency_us = utime.ticks_diff(utime.ticks_us(), tick_us)
+        if latency_us > shared_state.control_loop_max_latency_us:
+            shared_state.control_loop_max_latency_us = latency_us
 
+        try:
+            # Stage 1: sensor read, safety checks and heater output
+            readings_valid = updatePIDandHeater(shared_state)
+            # Let display and input tasks run before the bookkeeping stage
+            await asyncio.sleep_ms(0)
+            # Stage 2: graph ring buffers and autosession logging
+            if readings_valid:
+                updateReadingsAndLog()
+        except Exception as e:
+            heater.off()
+            print(f"Error in control task: {e}")
+
+        # Deadline is the next tick - if we are still running when it fires we have overrun
+        duration_us = utime.ticks_diff(utime.ticks_us(), tick_us)
+        shared_state.control_loop_last_us = duration_us
+        if duration_us > shared_state.control_loop_max_us:
+            shared_state.control_loop_max_us = duration_us
+        if duration_us > pidTimer.period * 1000:
+            shared_state.control_loop_overruns += 1
+        if shared_state.loop_stats:
+            shared_state.loop_stats.record(LoopStats.LOOP, tick_us)
+
+
+# Dual core control (dual_core_control = 1 in the hardware profile)
+#
+# Core 1 runs the sensor read, PID, heater output and safety checks in a
+# plain loop against its own control_state. Core 0 keeps async_main, the
+# display and input. Nothing is shared between the two apart from
+# Snapshots: commands, the supply and INA226 readings (core 0 -> core 1) and
+# readings (core 1 -> core 0), so neither core ever waits on a lock held
+# by the other.
+
+# Command snapshot fields - written by core 0
+CMD_SETPOINT = 0
+CMD_MODE = 1
+CMD_MODE_SEQ = 2
+CMD_CONTROL = 3
+CMD_SET_WATTS = 4
+CMD_SET_DUTY = 5
+CMD_TEMP_MAX_WATTS = 6
+CMD_PID_RESET_COUNT = 7
+CMD_PROFILE_SEQ = 8
+CMD_PROFILE_CONFIG = 9
+CMD_PERIOD_MS = 10
+CMD_SIZE = 11
+
+# Readings snapshot fields - written by core 1
+RD_TEMPERATURE = 0
+RD_INPUT_VOLTS = 1
+RD_WATTS = 2
+RD_MAX_DUTY = 3
+RD_P = 4
+RD_I = 5
+RD_D = 6
+RD_ERROR = 7
+RD_MODE = 8
+RD_MODE_SEQ = 9      # mode_seq of the last command applied
+RD_LOOP_COUNT = 10
+RD_LOOP_US = 11
+RD_OVERRUNS = 12
+RD_STALE = 13
+RD_VALID = 14
+RD_PID_DT = 15
+RD_DT_MAX_JITTER = 16
+RD_BATTERY_OPEN_VOLTS = 17
+RD_PROBES = 18       # MAX_PROBES thermocouple temperatures from here
+RD_SIZE = RD_PROBES + MAX_PROBES
+
+command_snapshot = Snapshot(CMD_SIZE)
+readings_snapshot = Snapshot(RD_SIZE)
+control_state = None     # Core 1's SharedState, created by startDualCoreControl()
+control_paused = False   # Set by core 0 while the Pi is too hot - core 1 keeps the heater off
+
+
+def pause_control(paused):
+    global control_paused
+    control_paused = paused
+
+
+def publishCommands():
+    # Core 0: hand the user's settings to the control core
+    values = command_snapshot.back_buffer()
+    values[CMD_SETPOINT] = shared_state.temperature_setpoint
+    values[CMD_MODE] = shared_state.get_mode()
+    values[CMD_MODE_SEQ] = shared_state.mode_seq
+    values[CMD_CONTROL] = shared_state.control
+    values[CMD_SET_WATTS] = shared_state.set_watts
+    values[CMD_SET_DUTY] = shared_state.set_duty_cycle
+    values[CMD_TEMP_MAX_WATTS] = shared_state.temporary_max_watts
+    values[CMD_PID_RESET_COUNT] = shared_state.pid_reset_count
+    values[CMD_PROFILE_SEQ] = shared_state.profile_seq
+    values[CMD_PROFILE_CONFIG] = shared_state.profile_config
+    values[CMD_PERIOD_MS] = get_control_period_ms()
+    command_snapshot.publish()
+
+
+def core1ControlLoop():
+    commands = [0] * CMD_SIZE
+    mode_seq = -1
+    pid_reset_count = -1
+    profile_seq = control_state.profile_seq
+    loop_count = 0
+    overruns = 0
+    next_tick_us = utime.ticks_us()
+
+    while True:
+        tick_us = utime.ticks_us()
+        command_snapshot.read_into(commands)
+
+        if commands[CMD_PROFILE_SEQ] != profile_seq:
+            profile_seq = commands[CMD_PROFILE_SEQ]
+            if commands[CMD_PROFILE_CONFIG] is not None:
+                control_state.apply_profile(commands[CMD_PROFILE_CONFIG])
+                control_state.set_loop_stats_enabled(False)  # Core 0 owns the stats
+        control_state.temperature_setpoint = commands[CMD_SETPOINT]
+        control_state.control = commands[CMD_CONTROL]
+        control_state.set_watts = commands[CMD_SET_WATTS]
+        control_state.set_duty_cycle = commands[CMD_SET_DUTY]
+        control_state.temporary_max_watts = commands[CMD_TEMP_MAX_WATTS]
+        if commands[CMD_MODE_SEQ] != mode_seq:
+            # Only take the mode when core 0 changes it so a safety trip here is not undone
+            mode_seq = commands[CMD_MODE_SEQ]
+            control_state.mode = commands[CMD_MODE]
+        if commands[CMD_PID_RESET_COUNT] != pid_reset_count:
+            pid_reset_count = commands[CMD_PID_RESET_COUNT]
+            control_state.pid.reset()
+            control_state.pid_last_sample_us = None
+
+        readings_valid = False
+        if control_paused:
+            heater.off()
+        else:
+            try:
+                readings_valid = updatePIDandHeater(control_state)
+            except Exception as e:
+                heater.off()
+                print(f"Error in core 1 control loop: {e}")
+
+        loop_count += 1
+        duration_us = utime.ticks_diff(utime.ticks_us(), tick_us)
+        period_us = commands[CMD_PERIOD_MS] * 1000
+        if duration_us > period_us:
+            overruns += 1
+
+        p, i, d = control_state.pid.components
+        values = readings_snapshot.back_buffer()
+        values[RD_TEMPERATURE] = control_state.heater_temperature
+        values[RD_INPUT_VOLTS] = control_state.input_volts
+        values[RD_WATTS] = control_state.watts
+        values[RD_MAX_DUTY] = control_state.heater_max_duty_cycle_percent
+        values[RD_P] = p
+        values[RD_I] = i
+        values[RD_D] = d
+        values[RD_ERROR] = control_state.current_error
+        values[RD_MODE] = control_state.mode
+        values[RD_MODE_SEQ] = mode_seq
+        values[RD_LOOP_COUNT] = loop_count
+        values[RD_LOOP_US] = duration_us
+        values[RD_OVERRUNS] = overruns
+        values[RD_STALE] = control_state.stale_sample_count
+        values[RD_VALID] = readings_valid
+        values[RD_PID_DT] = control_state.pid_dt_us
+        values[RD_DT_MAX_JITTER] = control_state.pid_dt_max_jitter_us
+        values[RD_BATTERY_OPEN_VOLTS] = control_state.battery_open_volts
+        probe_temperatures = control_state.probe_temperatures
+        for index in range(len(probe_temperatures)):
+            values[RD_PROBES + index] = probe_temperatures[index]
+        readings_snapshot.publish()
+
+        # Fixed rate from the first tick, skip ahead rather than burst if we fell behind
+        next_tick_us = utime.ticks_add(next_tick_us, period_us)
+        wait_us = utime.ticks_diff(next_tick_us, utime.ticks_us())
+        if wait_us < 0:
+            next_tick_us = utime.ticks_us()
+        elif wait_us >= 1000:
+            utime.sleep_ms(wait_us // 1000)
+
+
+def startDualCoreControl():
+    global control_state
+    import _thread
+
+    # Core 1 gets its own state and PID so core 0 never sees them half updated
+    control_state = SharedState(led_red_pin=led_red_pin, led_green_pin=led_green_pin, led_blue_pin=led_blue_pin)
+    if shared_state.profile_config is not None:
+        control_state.apply_profile(shared_state.profile_config)
+    control_state.set_loop_stats_enabled(False)
+    control_state.control = shared_state.control
+    control_state.heater_temperature = shared_state.heater_temperature
+    control_state.input_volts = shared_state.input_volts
+    control_state.set_probes(shared_state.probe_names)
+    if thermocouple is not None:
+        thermocouple.shared_state = control_state  # Read errors are raised against core 1's state
+
+    publishCommands()
+    publishSupplyReadings()  # So core 1 has readings before the ADC job's first run
+    if ina226 is not None:
+        publishPowerMonitorReadings()
+    _thread.start_new_thread(core1ControlLoop, ())
+    print("Control loop running on core 1")
+
+
+async def dual_core_sync_task():
+    # Core 0 side of dual core control - pass settings over and bring readings back
+    readings = [0] * RD_SIZE
+    loop_count = 0
+    last_error = None
+    while True:
+        publishCommands()
+        if readings_snapshot.seq() != 0:
+            readings_snapshot.read_into(readings)
+            if readings[RD_LOOP_COUNT] != loop_count:
+                loop_count = readings[RD_LOOP_COUNT]
+                shared_state.heater_temperature = readings[RD_TEMPERATURE]
+                shared_state.input_volts = readings[RD_INPUT_VOLTS]
+                shared_state.watts = readings[RD_WATTS]
+                shared_state.heater_max_duty_cycle_percent = readings[RD_MAX_DUTY]
+                shared_state.set_pid_components(readings[RD_P], readings[RD_I], readings[RD_D])
+                shared_state.control_loop_last_us = readings[RD_LOOP_US]
+                if readings[RD_LOOP_US] > shared_state.control_loop_max_us:
+                    shared_state.control_loop_max_us = readings[RD_LOOP_US]
+                shared_state.control_loop_overruns = readings[RD_OVERRUNS]
+                shared_state.stale_sample_count = readings[RD_STALE]
+                shared_state.pid_dt_us = readings[RD_PID_DT]
+                shared_state.pid_dt_max_jitter_us = readings[RD_DT_MAX_JITTER]
+                shared_state.battery_open_volts = readings[RD_BATTERY_OPEN_VOLTS]
+                for index in range(len(shared_state.probe_temperatures)):
+                    shared_state.probe_temperatures[index] = readings[RD_PROBES + index]
+
+                # Only pass errors over when they change so core 0's own errors are left alone
+                error = readings[RD_ERROR]
+                if error != last_error:
+                    if error is not None:
+                        shared_state.set_error(error[0], error[1])
+                    elif shared_state.current_error == last_error:
+                        shared_state.clear_error()
+                    last_error = error
+
+                # Core 1 switched itself off (safety trip) without a mode change from us
+                if readings[RD_MODE] == "Off" and readings[RD_MODE_SEQ] == shared_state.mode_seq and shared_state.get_mode() != "Off":
+                    shared_state.set_mode("Off")
+
+                updateAutosessionSetpoint(shared_state)
+                if readings[RD_VALID]:
+                    updateReadingsAndLog()
+        await asyncio.sleep_ms(20)
 
 
 
@@ -411,6 +985,16 @@ else:
         utime.sleep_ms(100)
 print("Display initialised.")
 
+# INA226 shares the display's I2C bus - Scheduler jobs are soft callbacks that run
+# between bytecodes, so a read can't land in the middle of a display transfer
+ina226 = None
+if hardware_ina226:
+    try:
+        ina226 = INA226(display.i2c, hardware_ina226_address, hardware_ina226_shunt_ohms, hardware_ina226_max_amps)
+        print("INA226 initialised.")
+    except Exception as e:
+        print(f"INA226 not available, watts control uses V^2/R: {e}")
+
 
 try:
     display_manager = DisplayManagerFactory.create_display_manager(display_type, display, shared_state)
@@ -488,7 +1072,10 @@ del button_pin
 # Initialize thermocouple before switching on heater
 try:
     utime.sleep_ms(100)
-    thermocouple = Thermocouple(hardware_pin_thermocouple_sck, hardware_pin_thermocouple_cs, hardware_pin_thermocouple_so, shared_state.heater_on_temperature_difference_threshold, shared_state)
+    thermocouple = Thermocouple(hardware_pin_thermocouple_sck, hardware_pin_thermocouple_cs, hardware_pin_thermocouple_so, shared_state.heater_on_temperature_difference_threshold, shared_state,
+                                driver=hardware_thermocouple_driver, spi_id=hardware_thermocouple_spi_id, mosi_pin_number=hardware_pin_thermocouple_mosi, pio_sm=hardware_thermocouple_pio_sm,
+                                probe_names=hardware_thermocouple_names, thermocouple_type=hardware_thermocouple_type,
+                                averaging=hardware_thermocouple_averaging, mains_hz=hardware_thermocouple_mains_hz)
     utime.sleep_ms(350)
 except Exception as e:
     error_text = "Thermocouple init failed: " + str(e)
@@ -516,9 +1103,11 @@ if shared_state.has_error():
         shared_state.rotary_last_mode = None
 
 
-# PI Temperature Sensor 
+# PI Temperature Sensor and supply voltage - read round robin in the background by adcTimer
 pi_temperature_sensor = machine.ADC(4)
-shared_state.pi_temperature = utils.get_pi_temperature_or_handle_error(pi_temperature_sensor, display_manager, shared_state)
+adc_acquisition = ADCAcquisition(utils.get_voltage_sampler(), pi_temperature_sensor)
+adc_acquisition.run()
+shared_state.pi_temperature = utils.get_pi_temperature_or_handle_error(adc_acquisition, display_manager, shared_state)
 
 
 # InputHandler
@@ -540,22 +1129,36 @@ while shared_state.input_volts is False:
 if shared_state.heater_type == 'induction':
     # InductionHeater requires timer and coil pins
     # Coil pins need to be defined in hardware.txt, using defaults for now
-    ihTimer = utils.CustomTimer(-1, machine.Timer.PERIODIC, lambda t: None)  # Timer for coil switching
+    ihTimer = utils.CustomTimer(-1, machine.Timer.PERIODIC, lambda t: None, priority=utils.PRIORITY_CONTROL, name='coil_switch')  # Timer for coil switching
     heater = HeaterFactory.create_heater('induction', coil_pins=(12, 13), timer=ihTimer)
 else:
     # ElementHeater (default)
-    heater = HeaterFactory.create_heater('element', hardware_pin_heater)
+    heater = HeaterFactory.create_heater('element', hardware_pin_heater, dither=hardware_heater_dither)
 
 heater.off()
 
+if hardware_voltage_pwm_sync and shared_state.heater_type == 'element':
+    # Supply readings split into heater on (loaded) and off, the loaded one gives the real watts
+    adc_acquisition.set_pwm_phase(PWMPhase(hardware_pin_heater, heater.PWM_FREQ))
+
 
 
-pidTimer = utils.CustomTimer(371, machine.Timer.PERIODIC, timerUpdatePIDandHeater)  # need to have timer setup before calling below 
+pidTimer = utils.CustomTimer(get_control_period_ms(), machine.Timer.PERIODIC, timerControlTick, priority=utils.PRIORITY_CONTROL)  # need to have timer setup before calling below 
 shared_state.heater_temperature, _ = utils.get_thermocouple_temperature_or_handle_error(thermocouple, heater, pidTimer, display_manager, shared_state)
 # Do not start timers here; they'll be started when the asyncio loop is running
 # pidTimer.start()
 # pid.reset()
-piTempTimer = utils.CustomTimer(903, machine.Timer.PERIODIC, timerSetPiTemp)
+piTempTimer = utils.CustomTimer(903, machine.Timer.PERIODIC, timerSetPiTemp, priority=utils.PRIORITY_SAFETY)
+adcTimer = utils.CustomTimer(ADCAcquisition.PERIOD_MS, machine.Timer.PERIODIC, timerReadADC, priority=utils.PRIORITY_SAFETY, name='adc')
+battery_gauge = BatteryGauge()
+battery_gauge.load()
+batteryTimer = utils.CustomTimer(BatteryGauge.UPDATE_MS, machine.Timer.PERIODIC, timerUpdateBatteryGauge, priority=utils.PRIORITY_UI, name='battery')
+ditherTimer = None
+if shared_state.heater_type == 'element' and heater.dither_enabled:
+    ditherTimer = utils.CustomTimer(heater.dither_period_ms, machine.Timer.PERIODIC, heater.dither, priority=utils.PRIORITY_CONTROL, name='dither')  # Once per PWM period
+inaTimer = None
+if ina226 is not None:
+    inaTimer = utils.CustomTimer(20, machine.Timer.PERIODIC, timerReadINA226, priority=utils.PRIORITY_CONTROL, name='ina226')  # Polls for each averaged result
 print("Timers initialised.")
 
 #enable_watchdog = False
@@ -565,16 +1168,45 @@ if enable_watchdog:
 
 
 async def async_main():
-    # Start periodic timers now that (optionally) the asyncio loop is running.
+    if dual_core_control:
+        try:
+            shared_state.reset_pid()
+            startDualCoreControl()
+            asyncio.create_task(dual_core_sync_task())
+        except Exception as e:
+            print(f"Error starting dual core control: {e}")
+    else:
+        # Control task must be waiting on control_flag before the first tick
+        asyncio.create_task(control_task())
+
+        # Start periodic timers now that (optionally) the asyncio loop is running.
+        try:
+            pidTimer.start()
+            shared_state.reset_pid()
+        except Exception as e:
+            print(f"Error starting pidTimer: {e}")
     try:
-        pidTimer.start()
-        shared_state.pid.reset()
+        adcTimer.start()
     except Exception as e:
-        print(f"Error starting pidTimer: {e}")
+        print(f"Error starting adcTimer: {e}")
+    if ditherTimer is not None:
+        try:
+            ditherTimer.start()
+        except Exception as e:
+            print(f"Error starting ditherTimer: {e}")
+    if inaTimer is not None:
+        try:
+            inaTimer.start()
+        except Exception as e:
+            print(f"Error starting inaTimer: {e}")
     try:
         piTempTimer.start()
     except Exception as e:
         print(f"Error starting piTempTimer: {e}")
+    try:
+        batteryTimer.start()
+    except Exception as e:
+        print(f"Error starting batteryTimer: {e}")
 
     # Start display heartbeat as a background task if available
     if hasattr(display_manager, 'start_heartbeat') and asyncio:
@@ -593,6 +1225,8 @@ async def async_main():
 
     await asyncio.sleep_ms(100)  # Brief pause before main loop
 
+    watchdog_readings_seq = -1
+
     while True:
         try:
             # Check and display any active errors
@@ -747,12 +1381,27 @@ async def async_main():
             if shared_state.control == "temperature_pid" or shared_state.control == "autosession":   
                 #need to reset pid if big temp change from setpoint too
                 if shared_state.heater_temperature > (shared_state.temperature_setpoint + shared_state.pid_reset_high_temperature):
-                    shared_state.pid.reset()
+                    shared_state.reset_pid()
                 # Prevent overshoot by resetting PID if integral is too high while still far from setpoint
                 elif shared_state.heater_temperature >= (shared_state.temperature_setpoint - shared_state.pid_reset_low_temperature) and shared_state.pid.components[1] > shared_state.pid_reset_i_threshold:
-                    shared_state.pid.reset()
-
-            if enable_watchdog:
+                    shared_state.reset_pid()
+
+            # Profile may have changed the control period
+            # (core 1 picks it up from the command snapshot in dual core mode)
+            control_period_ms = get_control_period_ms()
+            if not dual_core_control and pidTimer.period != control_period_ms:
+                print(f"Control period changed to {control_period_ms}ms")
+                pidTimer.set_period(control_period_ms)
+
+            # Print loop stats to the serial console every loop_stats_report_interval
+            if shared_state.loop_stats and utime.ticks_diff(utime.ticks_ms(), shared_state.loop_stats_last_report_time) >= shared_state.loop_stats_report_interval:
+                shared_state.loop_stats_last_report_time = utime.ticks_ms()
+                shared_state.loop_stats.report(shared_state)
+                utils.scheduler.report()
+
+            # In dual core mode only feed the watchdog while core 1 is still publishing readings
+            if enable_watchdog and (not dual_core_control or readings_snapshot.seq() != watchdog_readings_seq):
+                watchdog_readings_seq = readings_snapshot.seq()
                 try:
                     watchdog.feed()
                 except Exception:
@@ -0,0 +1,144 @@
+import utime
+
+
+class MAX31855:
+    """
+    MAX31855 K type thermocouple converter - 14 bit, 0.25C steps, ~100ms conversions.
+    Read bit banged on the same three pins as the MAX6675 or through SPI/SoftSPI.
+    Same interface as max6675_utime.MAX6675 so Thermocouple can use either.
+    """
+    MEASUREMENT_PERIOD_MS = 100
+
+    # Fault bits in the last byte of the frame
+    FAULT_OPEN = 0x01
+    FAULT_SHORT_GND = 0x02
+    FAULT_SHORT_VCC = 0x04
+
+    def __init__(self, cs, sck=None, so=None, spi=None):
+        """
+        :param cs: CS (select) pin, must be configured as Pin.OUT
+        :param sck: SCK (clock) pin, Pin.OUT - for bit banging
+        :param so: SO (data) pin, Pin.IN - for bit banging
+        :param spi: SPI or SoftSPI in mode 0 (polarity=0, phase=0) to use instead of bit banging
+        """
+        self._cs = cs
+        self._cs.high()
+        self._sck = sck
+        self._so = so
+        self._spi = spi
+        if spi is None:
+            self._sck.low()
+        self._buffer = bytearray(4)  # Reused for every read so reading doesn't allocate
+
+        self._last_measurement_start = 0
+        self._last_read_temp = 0
+        self._last_read_time = 0
+        self._last_read_time_us = 0
+        self._fresh = False
+        self._error = 0
+        self._fault = 0
+        self._internal_temp = 0
+
+    def _cycle_sck(self):
+        self._sck.high()
+        utime.sleep_us(1)
+        self._sck.low()
+        utime.sleep_us(1)
+
+    def _read_frame(self):
+        buffer = self._buffer
+        self._cs.low()
+        if self._spi is not None:
+            self._spi.readinto(buffer)
+        else:
+            utime.sleep_us(1)
+            for i in range(4):
+                byte = 0
+                for bit in range(8):
+                    if i or bit:
+                        self._cycle_sck()  # D31 is on SO as soon as CS goes low
+                    byte = (byte << 1) | self._so.value()
+                buffer[i] = byte
+        self._cs.high()  # Starts the next conversion
+
+    def refresh(self):
+        """
+        Start a new measurement.
+        """
+        self._cs.low()
+        self._cs.high()
+        self._last_measurement_start = utime.ticks_ms()
+
+    def ready(self):
+        """
+        Signals if measurement is finished.
+        :return: True if measurement is ready for reading.
+        """
+        return utime.ticks_diff(utime.ticks_ms(), self._last_measurement_start) > MAX31855.MEASUREMENT_PERIOD_MS
+
+    def error(self):
+        """
+        Returns fault bit of last reading - set for an open thermocouple or one shorted to GND/VCC.
+        """
+        return self._error
+
+    def fault(self):
+        """
+        Returns the FAULT_ bits of the last reading.
+        """
+        return self._fault
+
+    def internal_temperature(self):
+        """
+        Returns the chip's cold junction temperature from the last reading.
+        """
+        return self._internal_temp
+
+    def fresh(self):
+        """
+        Returns True if the last call to `read` returned a new conversion rather than
+        repeating the previous value.
+        """
+        return self._fresh
+
+    def sample_time(self):
+        """
+        Returns ticks_ms timestamp of when the value returned by `read` was taken.
+        """
+        return self._last_read_time
+
+    def sample_time_us(self):
+        """
+        Returns ticks_us timestamp of when the value returned by `read` was taken.
+        """
+        return self._last_read_time_us
+
+    def read(self):
+        """
+        Reads last measurement and starts a new one. If new measurement is not ready yet, returns last value.
+        :return: Measured temperature
+        """
+        if self.ready():
+            self._read_frame()
+            self._last_measurement_start = utime.ticks_ms()
+
+            # D31-18 signed thermocouple temperature, D16 fault, D15-4 signed internal temperature, D2-0 fault bits
+            # Worked out a byte at a time so nothing goes over MicroPython's small int range
+            buffer = self._buffer
+            value = (buffer[0] << 6) | (buffer[1] >> 2)
+            if value & 0x2000:
+                value -= 0x4000
+            internal = (buffer[2] << 4) | (buffer[3] >> 4)
+            if internal & 0x800:
+                internal -= 0x1000
+            self._error = buffer[1] & 1
+            self._fault = buffer[3] & 0x07
+            self._last_read_temp = value * 0.25
+            self._internal_temp = internal * 0.0625
+            self._last_read_time = self._last_measurement_start
+            self._last_read_time_us = utime.ticks_us()
+            self._fresh = True
+        else:
+            self._fresh = False
+
+        return self._last_read_temp
@@ -0,0 +1,147 @@
+import utime
+
+
+class MAX31856:
+    """
+    MAX31856 thermocouple converter - 19 bit, 0.0078125C steps.
+    Runs in automatic conversion mode with 1-16 samples averaged and the
+    mains rejection filter for 50 or 60Hz. Needs SPI/SoftSPI in mode 1
+    (polarity=0, phase=1) with MOSI connected to SDI as it's set up through
+    its registers.
+    Same interface as max6675_utime.MAX6675 so Thermocouple can use either.
+    """
+    # Registers
+    CR0 = 0x00
+    CR1 = 0x01
+    LTCBH = 0x0C   # Temperature is LTCBH, LTCBM, LTCBL then SR so one read gets it all
+    SR = 0x0F
+    WRITE = 0x80
+
+    CR0_AUTO = 0x80            # Automatic conversion mode
+    CR0_OPEN_DETECT = 0x10     # Open thermocouple detection on
+    CR0_50HZ = 0x01
+    TC_TYPE_K = 0x03
+    AVERAGING = (1, 2, 4, 8, 16)
+
+    # SR fault bits
+    FAULT_OPEN = 0x01
+    FAULT_OVUV = 0x02          # Input over/under voltage
+    FAULT_TC_LOW = 0x04
+    FAULT_TC_HIGH = 0x08
+    FAULT_CJ_LOW = 0x10
+    FAULT_CJ_HIGH = 0x20
+    FAULT_TC_RANGE = 0x40
+    FAULT_CJ_RANGE = 0x80
+
+    def __init__(self, spi, cs, averaging=1, mains_hz=50):
+        """
+        :param spi: SPI or SoftSPI in mode 1, <= 5MHz
+        :param cs: CS (select) pin, must be configured as Pin.OUT
+        :param averaging: samples averaged per reading - 1, 2, 4, 8 or 16
+        :param mains_hz: mains frequency to reject, 50 or 60
+        """
+        if averaging not in MAX31856.AVERAGING:
+            raise ValueError(f"MAX31856 averaging must be one of {MAX31856.AVERAGING}")
+        self._spi = spi
+        self._cs = cs
+        self._cs.high()
+        # Reused for every read so reading doesn't allocate
+        self._register_buffer = bytearray(2)
+        self._read_command = bytearray(5)
+        self._read_command[0] = MAX31856.LTCBH
+        self._read_buffer = bytearray(5)
+
+        # Each extra averaged sample adds about one mains filter conversion
+        if mains_hz == 60:
+            self.MEASUREMENT_PERIOD_MS = 82 + (averaging - 1) * 33
+        else:
+            self.MEASUREMENT_PERIOD_MS = 98 + (averaging - 1) * 40
+
+        self._last_measurement_start = 0
+        self._last_read_temp = 0
+        self._last_read_time = 0
+        self._last_read_time_us = 0
+        self._fresh = False
+        self._fault = 0
+
+        self.write_register(MAX31856.CR1, (MAX31856.AVERAGING.index(averaging) << 4) | MAX31856.TC_TYPE_K)
+        self.write_register(MAX31856.CR0, MAX31856.CR0_AUTO | MAX31856.CR0_OPEN_DETECT | (MAX31856.CR0_50HZ if mains_hz != 60 else 0))
+        self._last_measurement_start = utime.ticks_ms()  # First conversion starts now
+
+    def write_register(self, register, value):
+        buffer = self._register_buffer
+        buffer[0] = register | MAX31856.WRITE
+        buffer[1] = value
+        self._cs.low()
+        self._spi.write(buffer)
+        self._cs.high()
+
+    def refresh(self):
+        """
+        Conversions run continuously, nothing to do.
+        """
+        pass
+
+    def ready(self):
+        """
+        Signals if a new conversion should be available.
+        :return: True if a conversion has finished since the last read.
+        """
+        return utime.ticks_diff(utime.ticks_ms(), self._last_measurement_start) >= self.MEASUREMENT_PERIOD_MS
+
+    def error(self):
+        """
+        Returns the fault status register from the last reading, non zero if there's a fault.
+        """
+        return self._fault
+
+    def fault(self):
+        """
+        Returns the FAULT_ bits of the last reading.
+        """
+        return self._fault
+
+    def fresh(self):
+        """
+        Returns True if the last call to `read` returned a new conversion rather than
+        repeating the previous value.
+        """
+        return self._fresh
+
+    def sample_time(self):
+        """
+        Returns ticks_ms timestamp of when the value returned by `read` was taken.
+        """
+        return self._last_read_time
+
+    def sample_time_us(self):
+        """
+        Returns ticks_us timestamp of when the value returned by `read` was taken.
+        """
+        return self._last_read_time_us
+
+    def read(self):
+        """
+        Reads the latest conversion if a new one should be ready, otherwise returns the last value.
+        :return: Measured temperature
+        """
+        if self.ready():
+            self._cs.low()
+            self._spi.write_readinto(self._read_command, self._read_buffer)
+            self._cs.high()
+            self._last_measurement_start = utime.ticks_ms()
+
+            # 19 bit signed temperature in the top of LTCBH/M/L, 1/128C per bit
+            buffer = self._read_buffer
+            value = (buffer[1] << 11) | (buffer[2] << 3) | (buffer[3] >> 5)
+            if value & 0x40000:
+                value -= 0x80000
+            self._fault = buffer[4]
+            self._last_read_temp = value / 128
+            self._last_read_time = self._last_measurement_start
+            self._last_read_time_us = utime.ticks_us()
+            self._fresh = True
+        else:
+            self._fresh = False
+
+        return self._last_read_temp
@@ -0,0 +1,143 @@
+import rp2
+import utime
+from array import array
+
+
+@rp2.asm_pio(set_init=rp2.PIO.OUT_HIGH, sideset_init=rp2.PIO.OUT_LOW, in_shiftdir=rp2.PIO.SHIFT_LEFT)
+def max6675_program():
+    # CS is the set pin, SCK the side set pin and SO the in pin. Runs at 1MHz.
+    pull(block)             .side(0)        # Conversion wait count, put once by MAX6675PIO
+    mov(y, osr)             .side(0)
+    wrap_target()
+    set(pins, 0)            .side(0) [1]    # CS low latches the last conversion, D15 on SO
+    set(x, 15)              .side(0)
+    label("bit")
+    nop()                   .side(0)        # SCK falling edge shifts out the next bit
+    in_(pins, 1)            .side(0)
+    jmp(x_dec, "bit")       .side(1)
+    set(pins, 1)            .side(0)        # CS high starts the next conversion
+    push(block)             .side(0)
+    irq(rel(0))             .side(0)        # MAX6675PIO._irq timestamps the frame
+    mov(x, y)               .side(0)
+    label("wait")
+    jmp(x_dec, "wait")      .side(0) [15]   # 16 cycles per count (4 delay bits left with one side set pin)
+    wrap()
+
+
+class MAX6675PIO:
+    """
+    MAX6675 clocked by a PIO state machine, one frame per conversion with no
+    CPU time spent on bit timing. Each frame is timestamped in the state
+    machine's IRQ handler into a ring buffer, so read() only looks at the
+    newest entry and never waits on the chip.
+    Same interface as max6675_utime.MAX6675 so Thermocouple can use either.
+    """
+    MEASUREMENT_PERIOD_MS = 220
+    PIO_FREQ = 1000000
+    CONVERSION_WAIT_US = 230000   # A bit over the conversion time - reading sooner aborts the conversion
+    RING_SIZE = 8
+
+    def __init__(self, sm_id, sck, cs, so):
+        """
+        :param sm_id: PIO state machine to use (0-7), must not be used by anything else
+        :param sck: SCK (clock) pin
+        :param cs: CS (select) pin
+        :param so: SO (data) pin
+        """
+        self._frames = array('H', [0] * MAX6675PIO.RING_SIZE)
+        self._times = array('i', [0] * MAX6675PIO.RING_SIZE)   # ticks_ms each frame was read
+        self._times_us = array('i', [0] * MAX6675PIO.RING_SIZE)   # ... and in ticks_us
+        self._head = 0        # Next slot the IRQ handler writes
+        self._read_head = 0   # _head as it was at the last read()
+        self._missed = 0      # Frames overwritten before read() saw them
+
+        self._last_read_temp = 0
+        self._last_read_time = 0
+        self._last_read_time_us = 0
+        self._fresh = False
+        self._error = 0
+
+        self._sm = rp2.StateMachine(sm_id, max6675_program, freq=MAX6675PIO.PIO_FREQ,
+                                    set_base=cs, sideset_base=sck, in_base=so)
+        self._sm.irq(self._irq, hard=True)
+        self._sm.put(MAX6675PIO.CONVERSION_WAIT_US * MAX6675PIO.PIO_FREQ // 1000000 // 16)
+        self._sm.active(1)
+
+    def _irq(self, sm):
+        # Hard IRQ - must not allocate
+        while sm.rx_fifo():
+            head = self._head
+            self._frames[head] = sm.get()
+            self._times[head] = utime.ticks_ms()
+            self._times_us[head] = utime.ticks_us()
+            self._head = (head + 1) % MAX6675PIO.RING_SIZE
+
+    def deinit(self):
+        self._sm.active(0)
+        self._sm.irq(None)
+
+    def refresh(self):
+        """
+        Conversions are started by the state machine, nothing to do.
+        """
+        pass
+
+    def ready(self):
+        """
+        :return: True if a frame has arrived since the last read.
+        """
+        return self._head != self._read_head
+
+    def error(self):
+        """
+        Returns error bit of last reading - set if the thermocouple is open circuit.
+        """
+        return self._error
+
+    def fresh(self):
+        """
+        Returns True if the last call to `read` returned a new conversion rather than
+        repeating the previous value.
+        """
+        return self._fresh
+
+    def sample_time(self):
+        """
+        Returns ticks_ms timestamp of when the value returned by `read` was taken.
+        """
+        return self._last_read_time
+
+    def sample_time_us(self):
+        """
+        Returns ticks_us timestamp of when the value returned by `read` was taken.
+        """
+        return self._last_read_time_us
+
+    def missed(self):
+        """
+        Returns how many frames were overwritten in the ring buffer before being read.
+        """
+        return self._missed
+
+    def read(self):
+        """
+        Returns the newest frame's temperature, or the last value if no frame has arrived since.
+        :return: Measured temperature
+        """
+        head = self._head
+        if head != self._read_head:
+            waiting = (head - self._read_head) % MAX6675PIO.RING_SIZE
+            self._missed += waiting - 1
+            self._read_head = head
+            newest = (head - 1) % MAX6675PIO.RING_SIZE
+            # Frame is D15 dummy sign bit, D14-D3 temperature, D2 open thermocouple, D1 id, D0 tristate
+            frame = self._frames[newest]
+            self._error = (frame >> 2) & 1
+            self._last_read_temp = ((frame >> 3) & 0xFFF) * 0.25
+            self._last_read_time = self._times[newest]
+            self._last_read_time_us = self._times_us[newest]
+            self._fresh = True
+        else:
+            self._fresh = False
+
+        return self._last_read_temp
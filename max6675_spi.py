@@ -0,0 +1,89 @@
+import utime
+
+
+class MAX6675SPI:
+    """
+    MAX6675 read through machine.SPI/SoftSPI in one 16 bit transaction.
+    Same interface as max6675_utime.MAX6675 so Thermocouple can use either.
+    """
+    MEASUREMENT_PERIOD_MS = 220
+
+    def __init__(self, spi, cs):
+        """
+        :param spi: SPI or SoftSPI set up for mode 0 (polarity=0, phase=0), <= 4MHz
+        :param cs: CS (select) pin, must be configured as Pin.OUT
+        """
+        self._spi = spi
+        self._cs = cs
+        self._cs.high()
+        self._buffer = bytearray(2)  # Reused for every read so reading doesn't allocate
+
+        self._last_measurement_start = 0
+        self._last_read_temp = 0
+        self._last_read_time = 0   # ticks_ms when _last_read_temp was read from the chip
+        self._last_read_time_us = 0
+        self._fresh = False        # True if the last call to read() got a new conversion
+        self._error = 0
+
+    def refresh(self):
+        """
+        Start a new measurement.
+        """
+        self._cs.low()
+        self._cs.high()
+        self._last_measurement_start = utime.ticks_ms()
+
+    def ready(self):
+        """
+        Signals if measurement is finished.
+        :return: True if measurement is ready for reading.
+        """
+        return utime.ticks_diff(utime.ticks_ms(), self._last_measurement_start) > MAX6675SPI.MEASUREMENT_PERIOD_MS
+
+    def error(self):
+        """
+        Returns error bit of last reading - set if the thermocouple is open circuit.
+        """
+        return self._error
+
+    def fresh(self):
+        """
+        Returns True if the last call to `read` returned a new conversion rather than
+        repeating the previous value.
+        """
+        return self._fresh
+
+    def sample_time(self):
+        """
+        Returns ticks_ms timestamp of when the value returned by `read` was taken.
+        """
+        return self._last_read_time
+
+    def sample_time_us(self):
+        """
+        Returns ticks_us timestamp of when the value returned by `read` was taken.
+        """
+        return self._last_read_time_us
+
+    def read(self):
+        """
+        Reads last measurement and starts a new one. If new measurement is not ready yet, returns last value.
+        :return: Measured temperature
+        """
+        if self.ready():
+            # Frame is D15 dummy sign bit, D14-D3 temperature, D2 open thermocouple, D1 id, D0 tristate
+            self._cs.low()
+            self._spi.readinto(self._buffer)
+            self._cs.high()  # Starts the next conversion
+            self._last_measurement_start = utime.ticks_ms()
+
+            frame = (self._buffer[0] << 8) | self._buffer[1]
+            self._error = (frame >> 2) & 1
+            self._last_read_temp = ((frame >> 3) & 0xFFF) * 0.25
+            self._last_read_time = self._last_measurement_start
+            self._last_read_time_us = utime.ticks_us()
+            self._fresh = True
+        else:
+            self._fresh = False
+
+        return self._last_read_temp
@@ -24,6 +24,9 @@ class MAX6675:
 
         self._last_measurement_start = 0
         self._last_read_temp = 0
+        self._last_read_time = 0   # ticks_ms when _last_read_temp was read from the chip
+        self._last_read_time_us = 0
+        self._fresh = False        # True if the last call to read() got a new conversion
         self._error = 0
 
     def _cycle_sck(self):
@@ -56,6 +59,25 @@ class MAX6675:
         """
         return self._error
 
+    def fresh(self):
+        """
+        Returns True if the last call to `read` returned a new conversion rather than
+        repeating the previous value.
+        """
+        return self._fresh
+
+    def sample_time(self):
+        """
+        Returns ticks_ms timestamp of when the value returned by `read` was taken.
+        """
+        return self._last_read_time
+
+    def sample_time_us(self):
+        """
+        Returns ticks_us timestamp of when the value returned by `read` was taken.
+        """
+        return self._last_read_time_us
+
     def read(self):
         """
         Reads last measurement and starts a new one. If new measurement is not ready yet, returns last value.
@@ -92,5 +114,10 @@ class MAX6675:
             self._last_measurement_start = utime.ticks_ms()
 
             self._last_read_temp = value * 0.25
+            self._last_read_time = self._last_measurement_start
+            self._last_read_time_us = utime.ticks_us()
+            self._fresh = True
+        else:
+            self._fresh = False
 
         return self._last_read_temp
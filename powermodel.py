@@ -0,0 +1,56 @@
+class PowerModel:
+    """
+    Electrical model of the heater: watts = V^2 / R * duty.
+    Keeps 1/R and the full power watts (V^2/R) for the last input voltage so
+    the control loop doesn't redo the division every tick. The max duty for
+    the watts limit is only worked out again when the voltage moves more
+    than volts_hysteresis or the limit/resistance change.
+    """
+
+    def __init__(self, heater_resistance, max_watts, volts_hysteresis=0.05):
+        self.volts_hysteresis = volts_hysteresis
+        self.heater_resistance = heater_resistance
+        self.inverse_resistance = 1 / heater_resistance
+        self.max_watts = max_watts
+        self.volts = None              # Voltage the cached values were worked out for
+        self.full_power_watts = 0      # V^2/R - watts at 100% duty
+        self.max_duty_cycle_percent = None   # None until the first update_volts, so that one always reports a change
+        self._dirty = True
+
+    def set_resistance(self, heater_resistance):
+        if heater_resistance != self.heater_resistance:
+            self.heater_resistance = heater_resistance
+            self.inverse_resistance = 1 / heater_resistance
+            self._dirty = True
+
+    def set_max_watts(self, max_watts):
+        if max_watts != self.max_watts:
+            self.max_watts = max_watts
+            self._dirty = True
+
+    def update_volts(self, volts):
+        """Take a new input voltage reading. Returns True if max_duty_cycle_percent changed."""
+        if not self._dirty and self.volts is not None and abs(volts - self.volts) < self.volts_hysteresis:
+            return False
+        self._dirty = False
+        self.volts = volts
+        if volts > 0:
+            self.full_power_watts = volts * volts * self.inverse_resistance
+            max_duty = self.max_watts * 100 / self.full_power_watts
+        else:
+            self.full_power_watts = 0
+            max_duty = 100
+        if max_duty > 100:
+            max_duty = 100
+        if max_duty == self.max_duty_cycle_percent:
+            return False
+        self.max_duty_cycle_percent = max_duty
+        return True
+
+    def watts_for_duty(self, duty_percent):
+        return self.full_power_watts * duty_percent / 100
+
+    def duty_for_watts(self, watts):
+        if self.full_power_watts <= 0:
+            return 0
+        return watts * 100 / self.full_power_watts
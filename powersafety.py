@@ -0,0 +1,69 @@
+class PowerSafety:
+    """
+    Input voltage safety check for one power_type, built once per profile by
+    create_power_safety() with its threshold already worked out so the
+    control loop only does one comparison per tick.
+    The error is only set when the check trips the heater off and only
+    cleared when the voltage comes back, so it doesn't keep clearing errors
+    raised by something else.
+    """
+
+    def __init__(self, error_code, error_message, threshold_volts):
+        self.error_code = error_code
+        self.error_message = error_message
+        self.threshold_volts = threshold_volts
+        self.safe = True
+
+    def is_safe(self, input_volts):
+        raise NotImplementedError("Subclasses must implement this method")
+
+    def check(self, input_volts, shared_state):
+        """Return True if input_volts is safe. Clears our error when it becomes safe again."""
+        safe = self.is_safe(input_volts)
+        if safe != self.safe:
+            self.safe = safe
+            if safe and shared_state.current_error and shared_state.current_error[0] == self.error_code:
+                shared_state.clear_error()
+        return safe
+
+    def trip(self, shared_state):
+        """Show our error - call when switching the heater off because check() failed."""
+        shared_state.set_error(self.error_code, self.error_message)
+
+
+class MinimumVoltageSafety(PowerSafety):
+    """Batteries - unsafe below the cutoff."""
+
+    def is_safe(self, input_volts):
+        return input_volts >= self.threshold_volts
+
+
+class MaximumVoltageSafety(PowerSafety):
+    """Mains supplies - unsafe above the limit."""
+
+    def is_safe(self, input_volts):
+        return input_volts <= self.threshold_volts
+
+
+class UnknownPowerTypeSafety(PowerSafety):
+    """Never safe - the profile has a power_type we don't know how to check."""
+
+    def is_safe(self, input_volts):
+        return False
+
+
+def create_power_safety(shared_state):
+    """Build the safety check for the current profile's power_type."""
+    power_type = shared_state.power_type
+    messages = shared_state.error_messages
+    if power_type == 'lipo':
+        # Whole pack cutoff so the loop doesn't divide by lipo_count every tick
+        return MinimumVoltageSafety("battery_level-too-low", messages.get("battery_level-too-low", "Battery too low"),
+                                    shared_state.lipo_count * shared_state.lipo_safe_volts)
+    elif power_type == 'lead':
+        return MinimumVoltageSafety("battery_level-too-low", messages.get("battery_level-too-low", "Battery too low"),
+                                    shared_state.lead_safe_volts)
+    elif power_type == 'mains':
+        return MaximumVoltageSafety("mains-voltage-too-high", messages.get("mains-voltage-too-high", "Mains voltage too high"),
+                                    shared_state.mains_safe_volts)
+    return UnknownPowerTypeSafety("unknown-power-type", messages.get("unknown-power-type", "Unknown power type"), 0)
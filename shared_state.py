@@ -1,8 +1,17 @@
 import utime
 from collections import deque
 from simple_pid import PID
+from loopstats import LoopStats
+from errormessage import ErrorRecord
+from powersafety import create_power_safety
+from batterymodel import BatteryModel
+from powermodel import PowerModel
 
 class SharedState:
+    # Codes with a preallocated ErrorRecord for raise_error()
+    ERROR_RECORD_CODES = ("thermocouple-read_error", "thermocouple-invalid_reading", "thermocouple-zero_reading",
+                          "thermocouple-below_zero", "thermocouple-above_limit")
+
     def __init__(self, led_red_pin, led_green_pin, led_blue_pin):
         self.led_red_pin = led_red_pin
         self.led_green_pin = led_green_pin
@@ -36,6 +45,22 @@ class SharedState:
         self.lead_safe_volts = 12.0 
         self.mains_safe_volts = 28.0 
 
+        # Batteries - duty is capped ahead of the cutoff using the pack's fitted internal resistance,
+        # so a sagging pack gives a session at reduced power rather than a "Battery too low" shutdown
+        self.battery_model = BatteryModel()
+        self.battery_sag_limit = True
+        self.battery_sag_margin = 0.2      # Volts above the cutoff the predicted voltage is kept
+        self.battery_duty_cap = 100        # Duty cap from the model this tick, 100 when it isn't limiting
+        self.lead_cells = 6
+        self.battery_capacity_wh = 0.0     # 0 - BatteryGauge learns it
+        self.battery_soc = None            # % charge from the BatteryGauge, None on mains
+        self.battery_minutes = None        # Heating time left at the mean session power, None until known
+        self.battery_sessions = None       # Sessions of the profile's length left
+        self.battery_open_volts = 0        # Load corrected pack voltage, published for the BatteryGauge on core 0
+        self.battery_model_samples = 0     # INA226 results the model has been given
+        self.battery_model_duty = 0        # Without an INA226 or PWM synchronised readings - duty the mean
+        self.battery_model_steady_ticks = 0  # voltage is settling on and control ticks it's been held
+
         self.heater_resistance = 0.49 # Ohms - need to set this correctly for the heater coil being used
 
         self.heater_type = 'element'  # Heater type: 'element' or 'induction' 
@@ -48,13 +73,28 @@ class SharedState:
 
         self.temporary_max_watts = self.max_watts  # Temporary Max Watts variable - defaults to max_watts
         self.heater_max_duty_cycle_percent = 0 #this now gets adjusted automatically based on max_watts / watt level
+        self.power_model = PowerModel(self.heater_resistance, self.temporary_max_watts)  # V^2/R maths for max duty and watts
         self.input_volts = False  # Needs to be False at startup
+        self.input_volts_mean = 0  # Over the last ~740ms of background readings, mean - min is the supply sag
+        self.input_volts_min = 0
+        self.input_volts_loaded = 0     # With the heater on (PWM synchronised readings), what V^2/R uses
+        self.input_volts_unloaded = 0   # With the heater off
+        self.input_volts_duty_mean = 0  # Mean for the duty being applied, what the power_type check uses
         
         # PI Temperature monitoring
         self.pi_temperature_limit = 60  # Shutdown if PI exceeds this temperature
         
         # PID Tuning - can be loaded from profile
         self.pid_temperature_tunings = (2.3, 0.03, 0)  # (P, I, D) - example for 2x lipo batteries
+        self.pid_watts_tunings = (0.02, 0.2, 0)        # (P, I, D) for watts control with an INA226 - % duty per watt
+
+        # Watts PID - only used in watts control with an INA226 measuring the power, switched on
+        # (seeded with the V^2/R duty) by updateWattsPID and off again when leaving watts control
+        self.watts_pid = PID(*self.pid_watts_tunings, setpoint=self.set_watts)
+        self.watts_pid.output_limits = (0, 100)
+        self.watts_pid.auto_mode = False
+        self.watts_pid_power = 0                 # Last watts PID output - held between INA226 results
+        self.watts_pid_last_sample_us = 0        # ticks_us of the INA226 result it last ran on
         
         # Track which profile is currently loaded 
         #need to rename to profile_name 
@@ -89,6 +129,41 @@ class SharedState:
         self.display_contrast = 255
         self.display_rotate = True
         
+        # Control loop period
+        # Free running the control timer has no phase relationship with the thermocouple
+        # conversions so some ticks re-use the previous reading. With sensor_synchronised_control
+        # the period becomes control_period_conversions sensor conversions and the PID is only
+        # updated when a new reading is available.
+        self.control_period_ms = 371              # Free running control period
+        self.sensor_synchronised_control = False
+        self.control_period_conversions = 2       # Conversions per control tick when synchronised
+        self.control_period_guard_ms = 10         # Added per conversion so timer jitter never reads early
+        self.pid_power = 0                        # Last PID output - held when the sample is stale
+        self.stale_sample_count = 0               # Control ticks that got a repeated thermocouple reading
+        # PID timestep from the sample timestamps rather than when the PID happens to be called - see pid_sample_dt_us()
+        self.pid_last_sample_us = None            # ticks_us of the sample the PID last ran on, None after a reset
+        self.pid_dt_us = 0                        # Time between the last two samples the PID ran on
+        self.pid_dt_jitter_us = 0                 # How far pid_dt_us moved from the one before
+        self.pid_dt_max_jitter_us = 0
+
+        # Thermocouple outlier filter (TemperatureFilter) - Thermocouple picks changes up via profile_seq
+        self.thermocouple_filter = 'none'         # 'none', 'median' or 'trimmed_mean'
+        self.thermocouple_filter_samples = 3      # Readings the filter looks at
+        self.thermocouple_filter_trim = 1         # Readings dropped from each end for trimmed_mean
+        self.thermocouple_filter_max_rate = 0     # C/s a reading can move before it's gated, 0 = off
+
+        # Temperature estimator (TemperatureEstimator) - predicts between conversions so the
+        # loop can run every estimator_control_period_ms
+        self.temperature_estimator = False
+        self.estimator_control_period_ms = 100
+        self.estimator_alpha = 0.5                # Share of the reading error taken into the temperature
+        self.estimator_beta = 0.1                 # ... and into the learnt rate
+        self.estimator_heat_rate = 0.0            # C/s the heater adds at 100% power, 0 = learn the rate only
+        self.heater_temperature_rate = 0.0        # Estimated C/s, 0 when the estimator is off
+
+        # How multiple thermocouples make heater_temperature: 'max', 'mean' or a thermocouple name
+        self.thermocouple_combine = 'max'
+
         # Autosession logging - whether to log autosession data to file
         self.autosession_logging_enabled = False  # Disabled by default, enable in profile if needed
         
@@ -102,8 +177,13 @@ class SharedState:
         # maxlen matches display width so each reading = one pixel column on graphs
         # Note: These will be re-initialized after display setup with correct width
         self.temperature_readings = deque([], self.display_width)  # Stores temperature values
-        self.heater_temperature = 0  # Overal heater temperature from thermocouple at the moment only deals with one 
-                                     # possibly extend to deal with multpile but not to start with
+        self.heater_temperature = 0  # Overal heater temperature - thermocouples combined by thermocouple_combine
+        self.heater_max_temperature = 0  # Hottest thermocouple, used by the too hot check
+
+        # Per thermocouple readings, sized by set_probes() when the thermocouples are set up
+        self.probe_names = []
+        self.probe_temperatures = []
+        self.probe_temperature_readings = []
 
         self.input_volts_readings = deque([], self.display_width)  # Stores voltage values
         self.input_volts = 0
@@ -115,6 +195,20 @@ class SharedState:
         
         self.pi_temperature = 0         # PI Pico chip temperature
 
+        # Control loop timing - updated by control_task in main
+        self.control_loop_last_us = 0          # Duration of last control loop run (tick to end)
+        self.control_loop_max_us = 0           # Longest control loop run seen
+        self.control_loop_max_latency_us = 0   # Longest delay between timer tick and control task waking
+        self.control_loop_overruns = 0         # Runs that finished after the next tick was due
+        self.control_loop_missed_ticks = 0     # Ticks that fired while the previous one was still pending
+
+        # Per-stage control loop timing (LoopStats) - None when loop_stats_enabled is off so it costs nothing
+        self.loop_stats_enabled = False
+        self.loop_stats = None
+        self.loop_stats_line = 0                 # Stage shown on the Loop Stats screen
+        self.loop_stats_report_interval = 30 * 1000  # ms between serial console reports
+        self.loop_stats_last_report_time = 0
+
         #Maybe make below options have more info eg:
         # setup_rotary_values in inputhandler 
         # options screen timeout to return to home (or none for graphs etc)
@@ -165,6 +259,10 @@ class SharedState:
         
         self.session_start_time = 0
         self.mode = "Off" 
+        self.mode_seq = 0          # Bumped on every mode change so the control core can spot them
+        self.pid_reset_count = 0   # Bumped by reset_pid() so the control core can repeat resets
+        self.profile_config = None # Last profile config applied
+        self.profile_seq = 0       # Bumped on every apply_profile()
 
         # Error tracking (simpler approach without exceptions)
         self.current_error = None  # Tuple of (error_code, error_message) or None
@@ -185,9 +283,18 @@ class SharedState:
                        "thermocouple-above_limit": "Temperature above limit"
         }
 
+        # Errors raised from the control loop by raise_error() - made once here so raising one doesn't allocate
+        self.error_records = {}
+        for error_code in SharedState.ERROR_RECORD_CODES:
+            self.error_records[error_code] = ErrorRecord(error_code, self.error_messages[error_code])
+        self.error_repeats = 0   # Times in a row the current error has been raised again
+
         # Controls that are currently enabled/available on this hardware
         # Possible values: 'temperature_pid', 'duty_cycle', 'watts'
         self.enabled_controls = ['temperature_pid', 'duty_cycle', 'watts']
+
+        # Input voltage check for power_type - rebuilt by apply_profile()
+        self.power_safety = create_power_safety(self)
         
         # Initialize menu options
         self.update_menu_options()
@@ -199,6 +306,7 @@ class SharedState:
             self.led_green_pin.off()
             self.led_blue_pin.off()  # In case session manually ended when light on
             self.mode = "Off"  # Set off here rather than after playing sounds as this can get called again while sounds being played
+            self.mode_seq += 1
             # Clear heater-too_hot error when session ends
             if self.current_error and self.current_error[0] == "heater-too_hot":
                 self.clear_error()
@@ -222,6 +330,7 @@ class SharedState:
             self.mode = "autosession"
         else:
             raise ValueError("Invalid mode. Must be 'Off', 'Session', 'Manual', or 'autosession'")
+        self.mode_seq += 1
         
         if new_mode == "Off":
             self.led_blue_pin.off() # In case session manually ended when light on
@@ -235,7 +344,7 @@ class SharedState:
                 self.clear_error()
         else:
             self.led_green_pin.on()
-            self.pid.reset()
+            self.reset_pid()
             print("PID Stats reset")
         
         # Always update menu to keep it in sync with current state
@@ -261,6 +370,10 @@ class SharedState:
             "Temp Watts Line",
             "Watts Line",
             "Show Settings",
+        ])
+        if self.loop_stats_enabled:
+            options.append("Loop Stats")
+        options.extend([
             "Display Contrast",
             "Reboot"
         ])
@@ -271,6 +384,18 @@ class SharedState:
         """Update menu_options list with current state."""
         self.menu_options = self.get_menu_options()
 
+    def reset_pid(self):
+        """Reset the PID - use this rather than pid.reset() so dual core control sees it."""
+        self.pid.reset()
+        self.pid_reset_count += 1
+        self.pid_last_sample_us = None
+
+    def set_pid_components(self, p, i, d):
+        """Mirror PID terms from the control core so pid.components reads the same on both cores."""
+        self.pid._proportional = p
+        self.pid._integral = i
+        self.pid._derivative = d
+
     def get_session_mode_duration(self):
         if self.session_start_time is None or self.session_start_time == 0:
             return 0
@@ -284,6 +409,24 @@ class SharedState:
         if error_message is None:
             error_message = self.error_messages.get(error_code, "Unknown error")
         self.current_error = (error_code, error_message)
+        self.error_repeats = 0
+        self.last_error_time = utime.ticks_ms()
+
+    def raise_error(self, error_code, detail=None, source=None):
+        """
+        Set one of the error_records as the current error without allocating.
+        detail is a number (or exception) shown after the message, source a name shown before it.
+        current_error[1] is the ErrorRecord - str() it for the message.
+        """
+        record = self.error_records[error_code]
+        record.source = source
+        record.detail = detail
+        record.count += 1
+        if self.current_error is record.error:
+            self.error_repeats += 1
+        else:
+            self.current_error = record.error
+            self.error_repeats = 0
         self.last_error_time = utime.ticks_ms()
     
     def has_error(self):
@@ -295,6 +438,8 @@ class SharedState:
         self.current_error = None
     
     def apply_profile(self, profile_config):
+        self.profile_config = profile_config
+        self.profile_seq += 1
 
         # Update only the attributes that exist in the profile config
         if 'session_timeout' in profile_config:
@@ -322,6 +467,14 @@ class SharedState:
             self.lead_safe_volts = profile_config['lead_safe_volts']
         if 'mains_safe_volts' in profile_config:
             self.mains_safe_volts = profile_config['mains_safe_volts']
+        if 'lead_cells' in profile_config:
+            self.lead_cells = profile_config['lead_cells']
+        if 'battery_capacity_wh' in profile_config:
+            self.battery_capacity_wh = profile_config['battery_capacity_wh']
+        if 'battery_sag_limit' in profile_config:
+            self.battery_sag_limit = profile_config['battery_sag_limit']
+        if 'battery_sag_margin' in profile_config:
+            self.battery_sag_margin = profile_config['battery_sag_margin']
         if 'power_threshold' in profile_config:
             self.power_threshold = profile_config['power_threshold']
         if 'heater_on_temperature_difference_threshold' in profile_config:
@@ -341,6 +494,7 @@ class SharedState:
 
         if 'heater_resistance' in profile_config:
             self.heater_resistance = profile_config['heater_resistance']
+            self.power_model.set_resistance(self.heater_resistance)
         if 'display_contrast' in profile_config:
             self.display_contrast = profile_config['display_contrast']
         if 'display_rotate' in profile_config:
@@ -354,6 +508,9 @@ class SharedState:
         if 'pid_temperature_tunings' in profile_config:
             self.pid_temperature_tunings = profile_config['pid_temperature_tunings']
             self.pid.tunings = self.pid_temperature_tunings  # Update PID tunings immediately
+        if 'pid_watts_tunings' in profile_config:
+            self.pid_watts_tunings = profile_config['pid_watts_tunings']
+            self.watts_pid.tunings = self.pid_watts_tunings
         if 'pid_reset_high_temperature' in profile_config:
             self.pid_reset_high_temperature = profile_config['pid_reset_high_temperature']
         if 'pid_reset_low_temperature' in profile_config:
@@ -366,6 +523,32 @@ class SharedState:
             self.default_autosession_profile = profile_config['default_autosession_profile']
         if 'autosession_log_buffer_flush_threshold' in profile_config:
             self.autosession_log_buffer_flush_threshold = profile_config['autosession_log_buffer_flush_threshold']
+        if 'sensor_synchronised_control' in profile_config:
+            self.sensor_synchronised_control = profile_config['sensor_synchronised_control']
+        if 'control_period_conversions' in profile_config:
+            self.control_period_conversions = profile_config['control_period_conversions']
+        if 'loop_stats_enabled' in profile_config:
+            self.set_loop_stats_enabled(profile_config['loop_stats_enabled'])
+        if 'thermocouple_filter' in profile_config:
+            self.thermocouple_filter = profile_config['thermocouple_filter']
+        if 'thermocouple_filter_samples' in profile_config:
+            self.thermocouple_filter_samples = profile_config['thermocouple_filter_samples']
+        if 'thermocouple_filter_trim' in profile_config:
+            self.thermocouple_filter_trim = profile_config['thermocouple_filter_trim']
+        if 'thermocouple_filter_max_rate' in profile_config:
+            self.thermocouple_filter_max_rate = profile_config['thermocouple_filter_max_rate']
+        if 'thermocouple_combine' in profile_config:
+            self.thermocouple_combine = profile_config['thermocouple_combine']
+        if 'temperature_estimator' in profile_config:
+            self.temperature_estimator = profile_config['temperature_estimator']
+        if 'estimator_control_period_ms' in profile_config:
+            self.estimator_control_period_ms = profile_config['estimator_control_period_ms']
+        if 'estimator_alpha' in profile_config:
+            self.estimator_alpha = profile_config['estimator_alpha']
+        if 'estimator_beta' in profile_config:
+            self.estimator_beta = profile_config['estimator_beta']
+        if 'estimator_heat_rate' in profile_config:
+            self.estimator_heat_rate = profile_config['estimator_heat_rate']
         
         if 'hardware' in profile_config:
             self.hardware = profile_config['hardware']
@@ -382,9 +565,61 @@ class SharedState:
                     self.control = enabled[0]
                 else:
                     self.control = 'duty_cycle'
+
+        # Thresholds only change with the profile so work the check out once here
+        self.power_safety = create_power_safety(self)
         
         print(f"Profile applied to SharedState")
 
+    def get_control_period_ms(self, conversion_period_ms=None):
+        """Control timer period - a whole number of sensor conversions when synchronised."""
+        if self.temperature_estimator:
+            return self.estimator_control_period_ms  # Estimator fills in between conversions
+        if self.sensor_synchronised_control and conversion_period_ms:
+            return self.control_period_conversions * (conversion_period_ms + self.control_period_guard_ms)
+        return self.control_period_ms
+
+    def pid_sample_dt_us(self, sample_us):
+        """
+        Microseconds from the last sample the PID ran on to this one (ticks_us it was taken),
+        and keep the dt jitter figures. Returns None for the first sample after a PID reset
+        and 0 if it's the same sample again.
+        """
+        last_us = self.pid_last_sample_us
+        self.pid_last_sample_us = sample_us
+        if last_us is None:
+            return None
+        dt_us = utime.ticks_diff(sample_us, last_us)
+        if dt_us <= 0:
+            self.pid_last_sample_us = last_us
+            return 0
+        loop_stats = self.loop_stats
+        if self.pid_dt_us:
+            jitter_us = abs(dt_us - self.pid_dt_us)
+            self.pid_dt_jitter_us = jitter_us
+            if jitter_us > self.pid_dt_max_jitter_us:
+                self.pid_dt_max_jitter_us = jitter_us
+            if loop_stats: loop_stats.record_us(LoopStats.DT_JITTER, jitter_us)
+        self.pid_dt_us = dt_us
+        if loop_stats: loop_stats.record_us(LoopStats.SAMPLE_DT, dt_us)
+        return dt_us
+
+    def set_probes(self, names):
+        """Size the per thermocouple readings - called with the names of the thermocouples fitted."""
+        self.probe_names = names
+        self.probe_temperatures = [0] * len(names)
+        self.probe_temperature_readings = [deque([], self.display_width) for _ in names]
+
+    def set_loop_stats_enabled(self, enabled):
+        """Create or drop the LoopStats recorder and refresh the menu."""
+        self.loop_stats_enabled = enabled
+        if enabled:
+            if self.loop_stats is None:
+                self.loop_stats = LoopStats()
+        else:
+            self.loop_stats = None
+        self.update_menu_options()
+
     # Control enable/disable helpers
     def enable_control(self, control_name):
         if control_name not in self.enabled_controls:
@@ -429,6 +664,10 @@ class SharedState:
             'lipo_safe_volts': 3.3,
             'lead_safe_volts': 12.0,
             'mains_safe_volts': 28.0,
+            'lead_cells': 6,
+            'battery_capacity_wh': 0.0,
+            'battery_sag_limit': True,
+            'battery_sag_margin': 0.2,
             'power_threshold': 0,
             'heater_on_temperature_difference_threshold': 20,
             'heater_type': 'element',
@@ -440,10 +679,24 @@ class SharedState:
             'temperature_max_allowed_setpoint': 250,
             'pi_temperature_limit': 60,
             'pid_temperature_tunings': (2.3, 0.03, 0),
+            'pid_watts_tunings': (0.02, 0.2, 0),
             'pid_reset_high_temperature': 15,
             'pid_reset_low_temperature': 10,
             'pid_reset_i_threshold': 20,
             'autosession_logging_enabled': False,
             'default_autosession_profile': None,
             'autosession_log_buffer_flush_threshold': 20,
+            'loop_stats_enabled': False,
+            'sensor_synchronised_control': False,
+            'control_period_conversions': 2,
+            'thermocouple_filter': 'none',
+            'thermocouple_filter_samples': 3,
+            'thermocouple_filter_trim': 1,
+            'thermocouple_filter_max_rate': 0,
+            'thermocouple_combine': 'max',
+            'temperature_estimator': False,
+            'estimator_control_period_ms': 100,
+            'estimator_alpha': 0.5,
+            'estimator_beta': 0.1,
+            'estimator_heat_rate': 0.0,
         }
@@ -0,0 +1,35 @@
+"""
+Host side simulation of the heater controller.
+
+Provides stand ins for the MicroPython modules the firmware imports
+(machine, utime, uasyncio, framebuf, micropython, rp2) backed by a virtual clock
+and a model of the board: a MAX6675 on the thermocouple pins, a first order
+plus dead time heater plant driven by the heater PWM duty, a power supply
+with internal resistance feeding the voltage divider ADC, and an SSD1306 on
+I2C. main.py runs unmodified on top of it, faster than real time.
+
+    python -m sim.runner --seconds 120 --mode Session
+
+See sim/runner.py for the options. Dual core control (_thread) is not
+simulated - use dual_core_control = 0.
+"""
+import builtins
+import sys
+import os
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def install():
+    """Put the fake MicroPython modules in sys.modules and the firmware on sys.path."""
+    from sim import utime, uasyncio, machine, framebuf, micropython, rp2
+    sys.modules['utime'] = utime
+    sys.modules['uasyncio'] = uasyncio
+    sys.modules['machine'] = machine
+    sys.modules['framebuf'] = framebuf
+    sys.modules['micropython'] = micropython
+    sys.modules['rp2'] = rp2
+    builtins.const = micropython.const  # MicroPython's compiler accepts const() without importing it
+    for path in (os.path.join(REPO_ROOT, 'lib'), REPO_ROOT):
+        if path not in sys.path:
+            sys.path.insert(0, path)
@@ -0,0 +1,316 @@
+"""
+Closed loop control benchmarks on the simulated board.
+
+    python -m sim.bench                       # All scenarios, JSON to stdout
+    python -m sim.bench --output bench.json   # ... or to a file
+    python -m sim.bench --list
+    python -m sim.bench --scenario cold_start
+
+Each scenario runs main.py in its own interpreter (the firmware keeps
+module level state) and reports:
+  rise_time_s        session start to 90% of the step to the setpoint
+  overshoot_c        highest temperature above the setpoint after rising
+  settle_time_s      session start until it stays within SETTLE_BAND_C
+  iae_c_s            integral of |setpoint - temperature| while heating
+  energy_j           energy into the heater
+  final_mode         mode at the end of the run
+  final_error        error code showing at the end of the run, None if none
+  off_after_fault_s  for the fault scenarios, how long the heater stayed off
+                     after the fault went away - the rest of the run if it
+                     never came back on
+  control_iteration  host us and bytes allocated per updatePIDandHeater()
+Temperatures are the heater model's, not the thermocouple reading, so
+sensor noise and dropouts don't hide what the heater really did.
+Host timings are for comparing code changes, they are not device timings.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import sim
+
+SAMPLE_MS = 100
+START_MS = 2000        # Session starts once the firmware is up
+RECORD_DELAY_MS = 500  # Give the control loop a tick to pick up the new mode/setpoint
+SETTLE_BAND_C = 5
+SESSION_SECONDS = 120
+
+
+class Recorder:
+    """Samples the plant every SAMPLE_MS and works out the control metrics."""
+
+    def __init__(self, simulation):
+        self.simulation = simulation
+        self.samples = []   # (time_s, temperature_c, setpoint_c, heating, heater_w)
+        simulation.every(SAMPLE_MS, self.sample, start_ms=START_MS + RECORD_DELAY_MS)
+
+    def sample(self, simulation):
+        shared_state = simulation.shared_state
+        if shared_state is None:
+            return
+        from sim.clock import clock
+        heating = shared_state.mode != "Off"
+        self.samples.append((clock.elapsed_ms() / 1000, simulation.board.plant.temperature_c, shared_state.temperature_setpoint, heating,
+                             simulation.board.heater_power_w()))
+
+    def metrics(self, step_response=True):
+        heating = [s for s in self.samples if s[3]]
+        result = {'rise_time_s': None, 'overshoot_c': None, 'settle_time_s': None, 'iae_c_s': 0.0, 'max_error_c': 0.0}
+        if not heating:
+            return result
+        start_s = START_MS / 1000
+        _, start_c, setpoint_c, _, _ = heating[0]
+        iae = 0.0
+        max_error = 0.0
+        for _, temperature_c, sample_setpoint_c, _, _ in heating:
+            error = abs(sample_setpoint_c - temperature_c)
+            iae += error * SAMPLE_MS / 1000
+            max_error = max(max_error, error)
+        result['iae_c_s'] = round(iae, 1)
+        result['max_error_c'] = round(max_error, 2)
+        if not step_response:
+            return result  # Setpoint moves so rise/overshoot/settle don't mean much
+
+        rise_c = start_c + 0.9 * (setpoint_c - start_c)
+        risen_at = None
+        for t, temperature_c, _, _, _ in heating:
+            if temperature_c >= rise_c:
+                risen_at = t
+                break
+        if risen_at is not None:
+            result['rise_time_s'] = round(risen_at - start_s, 2)
+            result['overshoot_c'] = round(max(0.0, max(s[1] - s[2] for s in heating if s[0] >= risen_at)), 2)
+        last_outside = None
+        for t, temperature_c, sample_setpoint_c, _, _ in heating:
+            if abs(temperature_c - sample_setpoint_c) > SETTLE_BAND_C:
+                last_outside = t
+        if last_outside is None:
+            result['settle_time_s'] = 0.0
+        elif last_outside < heating[-1][0]:
+            result['settle_time_s'] = round(last_outside + SAMPLE_MS / 1000 - start_s, 2)
+        return result
+
+    def off_after_fault_s(self, fault_cleared_ms):
+        """Seconds from fault_cleared_ms until the heater next had power, the rest of the run if it never did."""
+        cleared_s = fault_cleared_ms / 1000
+        after = [s for s in self.samples if s[0] >= cleared_s]
+        if not after:
+            return None
+        for t, _, _, _, heater_w in after:
+            if heater_w > 0:
+                return round(t - cleared_s, 2)
+        return round(after[-1][0] - cleared_s, 2)
+
+
+class IterationProfiler:
+    """
+    Wraps main.updatePIDandHeater to time it on the host and measure what it
+    allocates. Alternate calls are timed or traced as tracemalloc slows the
+    call down too much to time it at the same time.
+    """
+
+    def __init__(self, simulation, name='updatePIDandHeater'):
+        self.simulation = simulation
+        self.name = name
+        self.times_us = []
+        self.peak_bytes = []
+        self.retained_bytes = []
+        self.calls = 0
+        simulation.at(START_MS - 1, self.install)
+
+    def install(self, simulation):
+        original = simulation.globals[self.name]
+
+        def wrapper(*args, **kwargs):
+            self.calls += 1
+            if self.calls % 2:
+                start = time.perf_counter_ns()
+                result = original(*args, **kwargs)
+                self.times_us.append((time.perf_counter_ns() - start) / 1000)
+            else:
+                tracemalloc.start()
+                result = original(*args, **kwargs)
+                current, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                self.peak_bytes.append(peak)
+                self.retained_bytes.append(current)
+            return result
+        simulation.globals[self.name] = wrapper
+
+    def metrics(self):
+        times = sorted(self.times_us)
+        if not times:
+            return {'calls': self.calls}
+        return {
+            'calls': self.calls,
+            'us_mean': round(sum(times) / len(times), 1),
+            'us_p99': round(times[min(len(times) - 1, len(times) * 99 // 100)], 1),
+            'us_max': round(times[-1], 1),
+            'alloc_peak_bytes_mean': round(sum(self.peak_bytes) / len(self.peak_bytes), 1) if self.peak_bytes else None,
+            'alloc_peak_bytes_max': max(self.peak_bytes) if self.peak_bytes else None,
+            'alloc_retained_bytes_mean': round(sum(self.retained_bytes) / len(self.retained_bytes), 1) if self.retained_bytes else None,
+        }
+
+
+def start_mode(mode):
+    def start(simulation):
+        if simulation.shared_state is not None:
+            simulation.shared_state.set_mode(mode)
+    return start
+
+
+def autosession_seconds(name):
+    with open(os.path.join(sim.REPO_ROOT, 'profiles_autosession', name + '.txt')) as f:
+        for line in f:
+            if line.startswith('temperature_profile='):
+                last_point = line.split('=', 1)[1].strip().split(',')[-1]
+                return int(last_point.split(':')[0])
+    return SESSION_SECONDS
+
+
+def scenario_cold_start(simulation):
+    simulation.at(START_MS, start_mode("Session"))
+    return SESSION_SECONDS, True, {}
+
+
+def scenario_voltage_sag(simulation):
+    """Supply drops from 24V to 16V for 20s once the heater is near setpoint."""
+    board = simulation.board
+    simulation.at(START_MS, start_mode("Session"))
+    simulation.at(60000, lambda s: setattr(board.supply, 'volts', 16.0))
+    simulation.at(80000, lambda s: setattr(board.supply, 'volts', 24.0))
+    return SESSION_SECONDS, True, {}
+
+
+def scenario_thermocouple_dropout(simulation):
+    """Thermocouple goes open circuit for 1s then reads zero for 0.5s."""
+    board = simulation.board
+    thermocouple = simulation.thermocouple
+    extra = {'energy_during_fault_j': 0.0}
+    fault_energy = {}
+
+    def fault(kind):
+        def apply(s):
+            if kind is None:
+                extra['energy_during_fault_j'] += round(board.energy_j - fault_energy.pop('start'), 1)
+            else:
+                fault_energy['start'] = board.energy_j
+            thermocouple.fault = kind
+        return apply
+    simulation.at(START_MS, start_mode("Session"))
+    simulation.at(60000, fault('open'))
+    simulation.at(61000, fault(None))
+    simulation.at(80000, fault('zero'))
+    simulation.at(80500, fault(None))
+    return SESSION_SECONDS, True, extra, 80500
+
+
+def scenario_thermocouple_spike(simulation):
+    """One conversion reads SPIKE_C, with the heater near setpoint."""
+    thermocouple = simulation.thermocouple
+    simulation.at(START_MS, start_mode("Session"))
+    simulation.at(60000, lambda s: setattr(thermocouple, 'fault', 'spike'))
+    # The spike is read once, the next conversion is good
+    return SESSION_SECONDS, True, {}, 60000 + thermocouple.CONVERSION_MS
+
+
+def scenario_autosession(name):
+    def scenario(simulation):
+        simulation.at(START_MS, start_mode("autosession"))
+        return autosession_seconds(name) + 10, False, {}
+    return scenario
+
+
+def scenarios():
+    found = {
+        'cold_start': (scenario_cold_start, {}),
+        'voltage_sag': (scenario_voltage_sag, {}),
+        'thermocouple_dropout': (scenario_thermocouple_dropout, {}),
+        'thermocouple_spike': (scenario_thermocouple_spike, {}),
+    }
+    for filename in sorted(os.listdir(os.path.join(sim.REPO_ROOT, 'profiles_autosession'))):
+        if filename.endswith('.txt'):
+            name = filename[:-4]
+            found['autosession:' + name] = (scenario_autosession(name), {'autosession_profile': name})
+    return found
+
+
+def run_scenario(name):
+    """Run one scenario in this process and return its metrics."""
+    from sim.runner import Simulation
+    scenario, options = scenarios()[name]
+    simulation = Simulation(quiet=True, **options)
+    recorder = Recorder(simulation)
+    profiler = IterationProfiler(simulation)
+    setup = scenario(simulation)
+    seconds, step_response, extra = setup[:3]
+    fault_cleared_ms = setup[3] if len(setup) > 3 else None   # Fault scenarios also give when the fault went away
+    summary = simulation.run(seconds)
+
+    result = {'reason': summary['reason'], 'virtual_s': summary['virtual_s'], 'wall_s': summary['wall_s']}
+    result.update(recorder.metrics(step_response))
+    result['energy_j'] = summary['energy_j']
+    result.update(extra)
+    shared_state = simulation.shared_state
+    current_error = shared_state.current_error if shared_state is not None else None
+    result['final_mode'] = shared_state.get_mode() if shared_state is not None else None
+    result['final_error'] = current_error[0] if current_error is not None else None
+    if fault_cleared_ms is not None:
+        result['off_after_fault_s'] = recorder.off_after_fault_s(fault_cleared_ms)
+    result['control_iteration'] = profiler.metrics()
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=sim.REPO_ROOT, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Closed loop control benchmarks on the simulated board")
+    parser.add_argument('--scenario', action='append', help="scenario to run (repeat for more, default all)")
+    parser.add_argument('--list', action='store_true', help="list scenarios")
+    parser.add_argument('--output', help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    names = list(scenarios())
+    if args.list:
+        print("\n".join(names))
+        return
+
+    selected = args.scenario or names
+    for name in selected:
+        if name not in names:
+            parser.error(f"unknown scenario {name}")
+
+    if len(selected) == 1 and os.environ.get('HEATER_BENCH_CHILD'):
+        print(json.dumps(run_scenario(selected[0])))
+        return
+
+    results = {}
+    for name in selected:
+        env = dict(os.environ, HEATER_BENCH_CHILD='1')
+        proc = subprocess.run([sys.executable, '-m', 'sim.bench', '--scenario', name], cwd=sim.REPO_ROOT,
+                              env=env, capture_output=True, text=True)
+        try:
+            results[name] = json.loads(proc.stdout.strip().splitlines()[-1])
+        except (ValueError, IndexError):
+            results[name] = {'reason': 'failed', 'stderr': proc.stderr.strip().splitlines()[-5:]}
+
+    report = {'commit': git_commit(), 'scenarios': results}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,440 @@
+import random
+
+from sim.clock import clock, SimReset
+from sim.plant import HeaterPlant, Supply
+
+
+ADC_TEMPERATURE_CHANNEL = 4
+PWM_BASE = 0x40050000
+PWM_SLICE_STRIDE = 0x14
+PWM_TOP = 0xFFFE     # Counter steps per cycle less one, as the RP2040 port sets it for low frequencies
+
+
+def adc_channel(source):
+    """ADC channel for an ADC() argument - GPIO 26-29 are channels 0-3."""
+    if isinstance(source, int) and source >= 26:
+        return source - 26
+    return source
+
+
+class PinState:
+    """State of one GPIO - shared by every machine.Pin made for the same id, as on the chip."""
+
+    def __init__(self, pin_id):
+        self.pin_id = pin_id
+        self.mode = None
+        self.pull = None
+        self.output = 0         # Last value written
+        self.external = None    # Value driven from outside (button, sensor) or None
+        self.irq_handler = None
+        self.irq_trigger = 0
+        self.irq_pin = None     # Pin object passed to the handler
+        self.listeners = []     # Called with the new value when the output changes
+
+    def value(self):
+        if self.external is not None:
+            return self.external
+        if self.mode == 'out':
+            return self.output
+        return 1 if self.pull == 'up' else 0
+
+
+class Board:
+    """
+    Everything outside the RP2040: pins, PWM outputs, ADC inputs, I2C devices,
+    the heater plant and the power supply.
+    The machine fakes read and write this, test code and scenarios drive it.
+    """
+
+    def __init__(self):
+        self.pins = {}
+        self.pwm_duty = {}       # pin id -> duty_u16
+        self.pwm_freq = {}
+        self.adc_sources = {}    # channel -> callable returning a read_u16 value
+        self.i2c_devices = {}    # address -> device
+        self.watchdog_timeout_ms = None
+        self.watchdog_last_feed_us = 0
+        self.resets = 0
+
+        self.plant = HeaterPlant()
+        self.supply = Supply()
+        self.heater_pins = []            # PWM or on/off pins that power the element/coils
+        self.heater_resistance = 0.49
+        self.energy_j = 0.0
+        self.die_temperature_c = 30.0
+        self.adc_noise_counts = 0
+        self.adc_dnl_rate = 0.0    # Chance of a reading landing on one of the RP2040's bad codes
+        self.random = random.Random(1)   # Seeded so runs are repeatable
+
+        self.adc_sources[ADC_TEMPERATURE_CHANNEL] = self._die_temperature_u16
+        clock.listeners.append(self._advance)
+
+    def pin(self, pin_id):
+        state = self.pins.get(pin_id)
+        if state is None:
+            state = PinState(pin_id)
+            self.pins[pin_id] = state
+        return state
+
+    def write_pin(self, pin_id, value):
+        state = self.pin(pin_id)
+        value = 1 if value else 0
+        if state.output != value:
+            state.output = value
+            for listener in state.listeners:
+                listener(value)
+
+    def drive_input(self, pin_id, value):
+        """Drive a pin from outside (e.g. press a button) - fires its irq on a matching edge."""
+        state = self.pin(pin_id)
+        old = state.value()
+        state.external = None if value is None else (1 if value else 0)
+        new = state.value()
+        if old != new and state.irq_handler is not None:
+            from sim.machine import Pin
+            trigger = Pin.IRQ_RISING if new else Pin.IRQ_FALLING
+            if state.irq_trigger & trigger:
+                state.irq_handler(state.irq_pin)
+
+    def heater_duty(self):
+        """Fraction of time (0-1) the heater is powered."""
+        duty = 0.0
+        for pin_id in self.heater_pins:
+            if pin_id in self.pwm_duty:
+                pin_duty = self.pwm_duty[pin_id] / 65535
+            else:
+                pin_duty = float(self.pin(pin_id).output)
+            duty = max(duty, pin_duty)
+        return duty
+
+    def pwm_counter(self, pin_id):
+        """Slice counter for a PWM pin - every PWM is taken to have started at time 0."""
+        freq = self.pwm_freq.get(pin_id)
+        if not freq:
+            return 0
+        period_us = 1000000 // freq
+        return (clock.now_us % period_us) * (PWM_TOP + 1) // period_us
+
+    def pwm_compare(self, pin_id):
+        return self.pwm_duty.get(pin_id, 0) * (PWM_TOP + 1) // 65535
+
+    def read_mem32(self, address):
+        """machine.mem32 reads - the PWM slices' CTR, CC and TOP registers."""
+        offset = address - PWM_BASE
+        if not 0 <= offset < 8 * PWM_SLICE_STRIDE:
+            raise ValueError("sim has no register at " + hex(address))
+        pwm_slice, register = divmod(offset, PWM_SLICE_STRIDE)
+        # Pins 0-15 and 16-29 share the eight slices, even pins are channel A
+        pins = [pin_id for pin_id in self.pwm_duty if (pin_id >> 1) & 7 == pwm_slice]
+        if register == 0x08:
+            return self.pwm_counter(pins[0]) if pins else 0
+        if register == 0x0C:
+            value = 0
+            for pin_id in pins:
+                value |= self.pwm_compare(pin_id) << (16 if pin_id & 1 else 0)
+            return value
+        if register == 0x10:
+            return PWM_TOP
+        return 0
+
+    def heater_on_now(self):
+        """Whether the heater is powered at this instant, from the PWM phase."""
+        for pin_id in self.heater_pins:
+            if pin_id in self.pwm_duty:
+                if self.pwm_counter(pin_id) < self.pwm_compare(pin_id):
+                    return True
+            elif self.pin(pin_id).output:
+                return True
+        return False
+
+    def heater_power_w(self):
+        volts = self.supply.loaded_volts(self.heater_resistance)
+        return self.heater_duty() * volts * volts / self.heater_resistance
+
+    def input_volts(self):
+        return self.supply.terminal_volts(self.heater_resistance, self.heater_duty())
+
+    def instant_input_volts(self):
+        """Supply voltage right now - sagged while the heater's PWM is in its on time."""
+        if self.heater_on_now():
+            return self.supply.loaded_volts(self.heater_resistance)
+        return self.supply.volts
+
+    def read_adc(self, channel):
+        source = self.adc_sources.get(channel)
+        value = source() if source is not None else 0
+        if self.adc_noise_counts:
+            value += self.random.randint(-self.adc_noise_counts, self.adc_noise_counts)
+        code = max(0, min(4095, int(value) >> 4))  # 12 bit conversion
+        if self.adc_dnl_rate and code >= 512 and self.random.random() < self.adc_dnl_rate:
+            code = ((code - 512) & ~0x3FF) + 512  # Misread onto the bad code (512/1536/2560/3584) below it
+        return (code << 4) | (code >> 8)  # read_u16 scales up like the RP2040 port
+
+    def add_voltage_divider(self, pin_id, r1=910000, r2=102000):
+        """Feed supply voltage through the resistor divider into an ADC pin (no filter capacitor, so it follows the PWM)."""
+        def read():
+            return self.instant_input_volts() * r2 / (r1 + r2) / 3.3 * 65535
+        self.adc_sources[adc_channel(pin_id)] = read
+
+    def _die_temperature_u16(self):
+        volts = 0.706 - (self.die_temperature_c - 27) * 0.001721
+        return volts / 3.3 * 65536
+
+    def _advance(self, from_us, to_us):
+        # Integrate the plant in fixed steps - the heater output can't change
+        # while the clock is moving as the firmware isn't running
+        step_us = self.plant.step_ms * 1000
+        power_w = self.heater_power_w()
+        steps = (to_us // step_us) - (from_us // step_us)
+        for _ in range(steps):
+            self.plant.step(power_w)
+        self.energy_j += power_w * (to_us - from_us) / 1000000
+
+        if self.watchdog_timeout_ms is not None and to_us - self.watchdog_last_feed_us > self.watchdog_timeout_ms * 1000:
+            self.watchdog_timeout_ms = None
+            self.resets += 1
+            raise SimReset("watchdog timeout")
+
+
+class MAX6675Device:
+    """
+    MAX6675 on three GPIOs, bit-banged by the firmware.
+    Pulling CS low latches the last conversion and puts bit 15 on SO, each
+    falling SCK edge shifts out the next bit. CS high starts a conversion
+    which takes CONVERSION_MS - reading before then aborts it and returns the
+    previous result, as the real chip does.
+    Set fault to 'open' (open thermocouple bit) or 'zero' (reads 0C) to
+    simulate dropouts, or 'spike' (one conversion reads SPIKE_C) for a noisy reading.
+    """
+
+    CONVERSION_MS = 220
+    FRAME_BITS = 16
+    SPIKE_C = 1010
+
+    def __init__(self, board, sck, cs, so, noise_c=0.25, offset_c=0.0):
+        self.board = board
+        self.so = so
+        self.noise_c = noise_c
+        self.offset_c = offset_c
+        self.fault = None
+        self.conversion_start_us = -self.CONVERSION_MS * 1000
+        self.result = 0
+        self.frame = 0
+        self.bit = 0
+        self.selected = False
+        self.conversions = 0
+        board.pin(cs).listeners.append(self._cs_changed)
+        board.pin(sck).listeners.append(self._sck_changed)
+
+    def _reading_c(self):
+        # Thermocouple temperature for a new conversion, None if it's open
+        if self.fault == 'open':
+            return None
+        if self.fault == 'zero':
+            return 0
+        if self.fault == 'spike':
+            self.fault = None
+            return self.SPIKE_C
+        temperature_c = self.board.plant.temperature_c + self.offset_c
+        if self.noise_c:
+            temperature_c += self.board.random.gauss(0, self.noise_c)
+        return temperature_c
+
+    def _convert(self):
+        temperature_c = self._reading_c()
+        if temperature_c is None:
+            return 1 << 2
+        code = int(temperature_c * 4)
+        code = max(0, min(4095, code))
+        return code << 3
+
+    def _cs_changed(self, value):
+        if value == 0:
+            self.selected = True
+            if clock.now_us - self.conversion_start_us >= self.CONVERSION_MS * 1000:
+                self.result = self._convert()
+                self.conversions += 1
+            self.frame = self.result
+            self.bit = self.FRAME_BITS - 1
+            self._drive()
+        else:
+            self.selected = False
+            self.conversion_start_us = clock.now_us
+
+    def _sck_changed(self, value):
+        if self.selected and value == 0 and self.bit > 0:
+            self.bit -= 1
+            self._drive()
+
+    def _drive(self):
+        self.board.pin(self.so).external = (self.frame >> self.bit) & 1
+
+
+class MAX31855Device(MAX6675Device):
+    """
+    MAX31855 - read like the MAX6675 but a 32 bit frame with a 14 bit signed
+    thermocouple temperature, fault bits and the cold junction temperature.
+    """
+
+    CONVERSION_MS = 100
+    FRAME_BITS = 32
+
+    def _convert(self):
+        internal = int(self.board.plant.ambient_c * 16) & 0xFFF
+        temperature_c = self._reading_c()
+        if temperature_c is None:
+            return (1 << 16) | (internal << 4) | 0x01
+        code = max(-1080, min(5488, int(temperature_c * 4)))
+        return ((code & 0x3FFF) << 18) | (internal << 4)
+
+
+class MAX31856Device(MAX6675Device):
+    """
+    MAX31856 - register based, SPI mode 1 on four GPIOs (SDI is the
+    firmware's MOSI). The first byte after CS low is the register address,
+    bit 7 set for a write, then data bytes auto increment the address.
+    In automatic mode (CR0 bit 7) a conversion finishes every period set by
+    the averaging in CR1 and the 50/60Hz filter in CR0, and is latched into
+    LTCBH/M/L and SR when CS goes low.
+    """
+
+    def __init__(self, board, sck, cs, sdi, sdo, noise_c=0.25, offset_c=0.0):
+        super().__init__(board, sck, cs, sdo, noise_c, offset_c)
+        self.sdi = sdi
+        self.registers = bytearray(16)
+        self.registers[0x01] = 0x03   # K type, no averaging
+        self.registers[0x0F] = 0x01   # No conversion yet
+        self.address = 0
+        self.writing = False
+        self.clocks = 0
+        self.shift = 0
+
+    def period_us(self):
+        cr0 = self.registers[0x00]
+        averaging = 1 << min(4, (self.registers[0x01] >> 4) & 0x07)
+        if cr0 & 0x01:
+            return (95 + (averaging - 1) * 40) * 1000
+        return (80 + (averaging - 1) * 33) * 1000
+
+    def _convert_registers(self):
+        temperature_c = self._reading_c()
+        registers = self.registers
+        if temperature_c is None:
+            code = 0
+            registers[0x0F] = 0x01 if registers[0x00] & 0x30 else 0
+        else:
+            code = max(-270 * 128, min(1800 * 128, int(temperature_c * 128))) & 0x7FFFF
+            registers[0x0F] = 0
+        registers[0x0C] = (code >> 11) & 0xFF
+        registers[0x0D] = (code >> 3) & 0xFF
+        registers[0x0E] = (code & 0x07) << 5
+
+    def _cs_changed(self, value):
+        if value == 0:
+            self.selected = True
+            if self.registers[0x00] & 0x80 and clock.now_us - self.conversion_start_us >= self.period_us():
+                self._convert_registers()
+                self.conversions += 1
+                self.conversion_start_us = clock.now_us
+            self.clocks = 0
+            self.shift = 0
+        else:
+            self.selected = False
+
+    def _sck_changed(self, value):
+        if not self.selected:
+            return
+        if value == 1:
+            # Data out changes on the rising edge
+            if self.clocks >= 8 and not self.writing:
+                register = (self.address + (self.clocks - 8) // 8) & 0x0F
+                bit = 7 - (self.clocks % 8)
+                self.board.pin(self.so).external = (self.registers[register] >> bit) & 1
+            return
+        self.shift = ((self.shift << 1) | self.board.pin(self.sdi).output) & 0xFF
+        self.clocks += 1
+        if self.clocks % 8:
+            return
+        if self.clocks == 8:
+            self.address = self.shift & 0x7F
+            self.writing = bool(self.shift & 0x80)
+        elif self.writing:
+            register = (self.address + self.clocks // 8 - 2) & 0x0F
+            if register < 0x0C:
+                self.registers[register] = self.shift
+                if register == 0x00 and self.shift & 0x80:
+                    self.conversion_start_us = clock.now_us
+
+
+class INA226Device:
+    """
+    INA226 power monitor on I2C with the shunt in the heater supply.
+    A register write sets the pointer (and the value for CONFIG/CALIBRATION),
+    reads return the register at the pointer. Results are the mean over the
+    conversion period - the heater's duty times its loaded current - and
+    CVRF in MASK_ENABLE is set once each period has passed, cleared on read.
+    """
+
+    AVERAGES = (1, 4, 16, 64, 128, 256, 512, 1024)
+    CONVERSION_US = (140, 204, 332, 588, 1100, 2116, 4156, 8244)
+
+    def __init__(self, board, address=0x40, shunt_ohms=0.002):
+        self.board = board
+        self.shunt_ohms = shunt_ohms
+        self.registers = {0x00: 0x4127, 0x05: 0, 0x06: 0, 0xFE: 0x5449, 0xFF: 0x2260}
+        self.pointer = 0
+        self.result_us = clock.now_us
+        self.results = 0
+        board.i2c_devices[address] = self
+
+    def period_us(self):
+        config = self.registers[0x00]
+        averages = self.AVERAGES[(config >> 9) & 0x07]
+        return averages * (self.CONVERSION_US[(config >> 6) & 0x07] + self.CONVERSION_US[(config >> 3) & 0x07])
+
+    def _convert(self):
+        board = self.board
+        amps = board.heater_duty() * board.supply.loaded_volts(board.heater_resistance) / board.heater_resistance
+        bus_volts = board.input_volts()
+        calibration = self.registers[0x05]
+        current = int(amps * self.shunt_ohms / 0.0000025 * calibration / 2048) if calibration else 0
+        registers = self.registers
+        registers[0x01] = int(amps * self.shunt_ohms / 0.0000025) & 0xFFFF
+        registers[0x02] = min(0x7FFF, int(bus_volts / 0.00125))
+        registers[0x04] = current & 0xFFFF
+        registers[0x03] = min(0xFFFF, abs(current) * registers[0x02] // 20000)
+        registers[0x06] |= 0x0008
+        self.results += 1
+
+    def write(self, data):
+        self.pointer = data[0]
+        if len(data) >= 3 and self.pointer in (0x00, 0x05):
+            self.registers[self.pointer] = (data[1] << 8) | data[2]
+
+    def read(self, nbytes):
+        period_us = self.period_us()
+        if clock.now_us - self.result_us >= period_us:
+            self.result_us += (clock.now_us - self.result_us) // period_us * period_us
+            self._convert()
+        value = self.registers.get(self.pointer, 0)
+        if self.pointer == 0x06:
+            self.registers[0x06] &= ~0x0008
+        return bytes([(value >> 8) & 0xFF, value & 0xFF])[:nbytes]
+
+
+class SSD1306Device:
+    """I2C OLED - accepts commands and frame data and counts frames."""
+
+    def __init__(self, board, address=0x3C):
+        self.frames = 0
+        self.last_frame = b''
+        board.i2c_devices[address] = self
+
+    def write(self, data):
+        data = bytes(data)
+        if data and data[0] == 0x40:
+            self.frames += 1
+            self.last_frame = data[1:]
+
+
+board = Board()
@@ -0,0 +1,111 @@
+import heapq
+
+
+TICKS_PERIOD = 1 << 30   # Same wrap as MicroPython ticks_ms/ticks_us
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALFPERIOD = TICKS_PERIOD // 2
+
+
+class SimulationComplete(BaseException):
+    """
+    Raised when virtual time reaches the end of the run.
+    BaseException so the firmware's `except Exception` blocks don't catch it.
+    """
+
+
+class SimReset(BaseException):
+    """Raised for machine.reset() and watchdog timeouts."""
+
+
+class Event:
+    def __init__(self, due_us, callback, period_us=0):
+        self.due_us = due_us
+        self.callback = callback
+        self.period_us = period_us  # 0 for one shot
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class VirtualClock:
+    """
+    Virtual time for the simulation.
+    Time only moves when something sleeps (utime.sleep_*, uasyncio waiting
+    for its next task) so a run goes as fast as the host can execute it.
+    Timer callbacks are events that fire as time passes them, like IRQs.
+    Listeners are called with (from_us, to_us) every time the clock moves so
+    the plant models can integrate over the step.
+    """
+
+    def __init__(self, start_us=0):
+        self.now_us = start_us
+        self.start_us = start_us
+        self.end_us = None
+        self._events = []
+        self._seq = 0
+        self._in_irq = False
+        self.listeners = []
+
+    def elapsed_ms(self):
+        return (self.now_us - self.start_us) // 1000
+
+    def run_for(self, duration_ms):
+        """End the simulation duration_ms of virtual time from now."""
+        self.end_us = self.now_us + duration_ms * 1000
+
+    def call_at(self, due_us, callback, period_us=0):
+        event = Event(due_us, callback, period_us)
+        self._push(event)
+        return event
+
+    def call_later(self, delay_ms, callback, period_ms=0):
+        return self.call_at(self.now_us + delay_ms * 1000, callback, period_ms * 1000)
+
+    def _push(self, event):
+        self._seq += 1
+        heapq.heappush(self._events, (event.due_us, self._seq, event))
+
+    def next_event_us(self):
+        while self._events and self._events[0][2].cancelled:
+            heapq.heappop(self._events)
+        return self._events[0][0] if self._events else None
+
+    def advance(self, us):
+        self.advance_to(self.now_us + us)
+
+    def advance_to(self, target_us):
+        # Callbacks don't nest - a timer callback that sleeps just lets time pass
+        if not self._in_irq:
+            while True:
+                due_us = self.next_event_us()
+                if due_us is None or due_us > target_us:
+                    break
+                _, _, event = heapq.heappop(self._events)
+                self._move(due_us)
+                if event.period_us:
+                    event.due_us += event.period_us
+                    self._push(event)
+                self._in_irq = True
+                try:
+                    event.callback()
+                finally:
+                    self._in_irq = False
+        self._move(target_us)
+
+    def _move(self, to_us):
+        if to_us <= self.now_us:
+            return
+        if self.end_us is not None and to_us > self.end_us:
+            to_us = self.end_us
+        from_us = self.now_us
+        for listener in self.listeners:
+            listener(from_us, to_us)
+        self.now_us = to_us
+        if self.end_us is not None and self.now_us >= self.end_us:
+            raise SimulationComplete()
+
+
+# One simulation per process - firmware modules keep module level state
+# (utils.scheduler etc.) so a fresh run needs a fresh interpreter anyway
+clock = VirtualClock()
@@ -0,0 +1,88 @@
+"""
+Fake framebuf with the drawing the display code uses.
+Only MONO_VLSB (the SSD1306 layout) is drawn into the buffer. text() has no
+font so it only records what was written since the last fill(), which is
+enough to check what a screen shows.
+"""
+
+MONO_VLSB = 0
+MONO_HLSB = 3
+MONO_HMSB = 4
+RGB565 = 1
+GS2_HMSB = 5
+GS4_HMSB = 2
+GS8 = 6
+
+
+class FrameBuffer:
+    def __init__(self, buffer, width, height, buf_format, stride=None):
+        self._buffer = buffer
+        self._width = width
+        self._height = height
+        self._format = buf_format
+        self.texts = []
+
+    def pixel(self, x, y, c=None):
+        if not (0 <= x < self._width and 0 <= y < self._height):
+            return None
+        index = (y >> 3) * self._width + x
+        bit = 1 << (y & 7)
+        if c is None:
+            return 1 if self._buffer[index] & bit else 0
+        if c:
+            self._buffer[index] |= bit
+        else:
+            self._buffer[index] &= ~bit & 0xFF
+
+    def fill(self, c):
+        value = 0xFF if c else 0
+        for i in range(len(self._buffer)):
+            self._buffer[i] = value
+        self.texts = []
+
+    def fill_rect(self, x, y, w, h, c):
+        for yy in range(max(y, 0), min(y + h, self._height)):
+            for xx in range(max(x, 0), min(x + w, self._width)):
+                self.pixel(xx, yy, c)
+
+    def rect(self, x, y, w, h, c, f=False):
+        if f:
+            self.fill_rect(x, y, w, h, c)
+            return
+        self.hline(x, y, w, c)
+        self.hline(x, y + h - 1, w, c)
+        self.vline(x, y, h, c)
+        self.vline(x + w - 1, y, h, c)
+
+    def hline(self, x, y, w, c):
+        self.fill_rect(x, y, w, 1, c)
+
+    def vline(self, x, y, h, c):
+        self.fill_rect(x, y, 1, h, c)
+
+    def line(self, x1, y1, x2, y2, c):
+        dx = abs(x2 - x1)
+        dy = -abs(y2 - y1)
+        sx = 1 if x1 < x2 else -1
+        sy = 1 if y1 < y2 else -1
+        err = dx + dy
+        while True:
+            self.pixel(x1, y1, c)
+            if x1 == x2 and y1 == y2:
+                break
+            e2 = 2 * err
+            if e2 >= dy:
+                err += dy
+                x1 += sx
+            if e2 <= dx:
+                err += dx
+                y1 += sy
+
+    def text(self, s, x, y, c=1):
+        self.texts.append((x, y, str(s)))
+
+    def scroll(self, xstep, ystep):
+        pass
+
+    def blit(self, fbuf, x, y, key=-1, palette=None):
+        pass
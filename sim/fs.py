@@ -0,0 +1,53 @@
+"""
+Map the device's absolute paths ('/profiles/...', '/current_profile.txt')
+onto a directory on the host.
+A path is mapped when its parent directory exists under the sim root, so
+the host's own files (/usr/lib/...) are left alone.
+"""
+import builtins
+import os
+
+_root = None
+_open = builtins.open
+_os = {}
+
+
+def map_path(path):
+    if _root is None or not isinstance(path, str) or not path.startswith('/') or path.startswith(_root):
+        return path
+    candidate = _root + path.rstrip('/') if path != '/' else _root
+    if os.path.exists(candidate) or _real_isdir(os.path.dirname(candidate)):
+        return candidate
+    return path
+
+
+def _real_isdir(path):
+    try:
+        return _os['stat'](path).st_mode & 0o170000 == 0o040000
+    except OSError:
+        return False
+
+
+def _wrap(name):
+    real = _os[name]
+
+    def wrapper(path, *args, **kwargs):
+        return real(map_path(path), *args, **kwargs)
+    return wrapper
+
+
+def install(root):
+    """Point the device filesystem at root."""
+    global _root
+    _root = os.path.abspath(root).rstrip('/')
+    for name in ('listdir', 'remove', 'mkdir', 'rmdir', 'stat', 'statvfs', 'chdir'):
+        if name not in _os and hasattr(os, name):
+            _os[name] = getattr(os, name)
+            setattr(os, name, _wrap(name))
+
+    def sim_open(file, *args, **kwargs):
+        return _open(map_path(file), *args, **kwargs)
+    builtins.open = sim_open
+
+    rename = _os.setdefault('rename', os.rename)
+    os.rename = lambda old, new: rename(map_path(old), map_path(new))
@@ -0,0 +1,293 @@
+"""Fake machine module backed by sim.board and the virtual clock."""
+from sim.board import board, adc_channel
+from sim.clock import clock, SimReset
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    def __init__(self, pin_id, mode=-1, pull=-1, value=None):
+        self.pin_id = pin_id
+        self._state = board.pin(pin_id)
+        self.init(mode, pull, value)
+
+    def init(self, mode=-1, pull=-1, value=None):
+        if mode == Pin.OUT or mode == Pin.OPEN_DRAIN:
+            self._state.mode = 'out'
+        elif mode == Pin.IN:
+            self._state.mode = 'in'
+        if pull == Pin.PULL_UP:
+            self._state.pull = 'up'
+        elif pull == Pin.PULL_DOWN:
+            self._state.pull = 'down'
+        if value is not None:
+            board.write_pin(self.pin_id, value)
+
+    def value(self, value=None):
+        if value is None:
+            return self._state.value()
+        board.write_pin(self.pin_id, value)
+
+    __call__ = value
+
+    def on(self):
+        board.write_pin(self.pin_id, 1)
+
+    def off(self):
+        board.write_pin(self.pin_id, 0)
+
+    high = on
+    low = off
+
+    def toggle(self):
+        board.write_pin(self.pin_id, not self._state.output)
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING, priority=1, wake=None, hard=False):
+        self._state.irq_handler = handler
+        self._state.irq_trigger = trigger if handler is not None else 0
+        self._state.irq_pin = self
+
+    def __repr__(self):
+        return f"Pin({self.pin_id})"
+
+
+def _pin_id(pin):
+    return pin.pin_id if isinstance(pin, Pin) else pin
+
+
+class PWM:
+    def __init__(self, pin, freq=None, duty_u16=None):
+        self.pin_id = _pin_id(pin)
+        board.pwm_duty[self.pin_id] = 0
+        if freq is not None:
+            self.freq(freq)
+        if duty_u16 is not None:
+            self.duty_u16(duty_u16)
+
+    def freq(self, value=None):
+        if value is None:
+            return board.pwm_freq.get(self.pin_id, 0)
+        board.pwm_freq[self.pin_id] = value
+
+    def duty_u16(self, value=None):
+        if value is None:
+            return board.pwm_duty.get(self.pin_id, 0)
+        board.pwm_duty[self.pin_id] = max(0, min(65535, int(value)))
+
+    def deinit(self):
+        board.pwm_duty.pop(self.pin_id, None)
+
+
+class _Mem32:
+    """machine.mem32 - reads go to the board's register model."""
+
+    def __getitem__(self, address):
+        return board.read_mem32(address)
+
+
+mem32 = _Mem32()
+
+
+class ADC:
+    CORE_TEMP = 4
+
+    def __init__(self, source):
+        self.channel = adc_channel(_pin_id(source))
+
+    def read_u16(self):
+        return board.read_adc(self.channel)
+
+
+class Timer:
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, timer_id=-1, mode=PERIODIC, period=-1, freq=-1, callback=None):
+        self._event = None
+        if callback is not None:
+            self.init(mode=mode, period=period, freq=freq, callback=callback)
+
+    def init(self, mode=PERIODIC, period=-1, freq=-1, callback=None, tick_hz=1000):
+        self.deinit()
+        if freq > 0:
+            period_us = 1000000 // freq
+        else:
+            period_us = int(period * 1000000 // tick_hz)
+        period_us = max(period_us, 1)
+        self._event = clock.call_at(clock.now_us + period_us, lambda: callback(self), period_us if mode == Timer.PERIODIC else 0)
+
+    def deinit(self):
+        if self._event is not None:
+            self._event.cancel()
+            self._event = None
+
+
+class I2C:
+    def __init__(self, bus_id=0, scl=None, sda=None, freq=400000, timeout=50000):
+        self.bus_id = bus_id
+        self.freq = freq
+
+    def _device(self, addr):
+        device = board.i2c_devices.get(addr)
+        if device is None:
+            raise OSError(19)  # ENODEV, as the real driver reports a missing device
+        return device
+
+    def scan(self):
+        return sorted(board.i2c_devices)
+
+    def writeto(self, addr, buf, stop=True):
+        self._device(addr).write(bytes(buf))
+        return len(buf)
+
+    def writevto(self, addr, vector, stop=True):
+        data = b''.join(bytes(buf) for buf in vector)
+        self._device(addr).write(data)
+        return len(data)
+
+    def readfrom(self, addr, nbytes, stop=True):
+        return bytes(self._device(addr).read(nbytes))
+
+    def readfrom_into(self, addr, buf, stop=True):
+        data = self.readfrom(addr, len(buf))
+        buf[:len(data)] = data
+
+    def writeto_mem(self, addr, memaddr, buf, addrsize=8):
+        self._device(addr).write(bytes([memaddr]) + bytes(buf))
+
+    def readfrom_mem(self, addr, memaddr, nbytes, addrsize=8):
+        device = self._device(addr)
+        device.write(bytes([memaddr]))
+        return bytes(device.read(nbytes))
+
+    def readfrom_mem_into(self, addr, memaddr, buf, addrsize=8):
+        data = self.readfrom_mem(addr, memaddr, len(buf))
+        buf[:len(data)] = data
+
+
+SoftI2C = I2C
+
+
+# RP2040 pins each SPI block can use
+SPI_PINS = {
+    0: {'sck': (2, 6, 18, 22), 'mosi': (3, 7, 19, 23), 'miso': (0, 4, 16, 20)},
+    1: {'sck': (10, 14, 26), 'mosi': (11, 15, 27), 'miso': (8, 12, 28)},
+}
+
+
+class SoftSPI:
+    """
+    Mode 0 or 1 SPI clocked bit by bit on the board pins so devices that
+    watch the pins (MAX6675Device, MAX31856Device) see real edges. Advances
+    the clock by the transfer time.
+    """
+    MSB = 0
+    LSB = 1
+
+    def __init__(self, baudrate=500000, polarity=0, phase=0, bits=8, firstbit=MSB, sck=None, mosi=None, miso=None):
+        if sck is None or mosi is None or miso is None:
+            raise TypeError("sck, mosi and miso are required")
+        self.init(baudrate, polarity, phase, bits, firstbit, sck, mosi, miso)
+
+    def init(self, baudrate=500000, polarity=0, phase=0, bits=8, firstbit=MSB, sck=None, mosi=None, miso=None):
+        if polarity != 0:
+            raise ValueError("only polarity 0 is simulated")
+        self.baudrate = baudrate
+        self.phase = phase
+        if sck is not None:
+            self.sck = _pin_id(sck)
+            self.mosi = _pin_id(mosi)
+            self.miso = _pin_id(miso)
+            board.write_pin(self.sck, 0)
+
+    def deinit(self):
+        pass
+
+    def _transfer_byte(self, out):
+        value = 0
+        for bit in range(7, -1, -1):
+            if self.phase:
+                # Mode 1 - both ends change data on the rising edge, sample on the falling edge
+                board.write_pin(self.sck, 1)
+                board.write_pin(self.mosi, (out >> bit) & 1)
+                value = (value << 1) | board.pin(self.miso).value()
+            else:
+                board.write_pin(self.mosi, (out >> bit) & 1)
+                board.write_pin(self.sck, 1)
+                value = (value << 1) | board.pin(self.miso).value()
+            board.write_pin(self.sck, 0)
+        return value
+
+    def write_readinto(self, write_buf, read_buf):
+        for i in range(len(read_buf)):
+            read_buf[i] = self._transfer_byte(write_buf[i])
+        clock.advance(len(read_buf) * 8 * 1000000 // self.baudrate)
+
+    def readinto(self, buf, write=0x00):
+        self.write_readinto(bytes([write]) * len(buf), buf)
+
+    def read(self, nbytes, write=0x00):
+        buf = bytearray(nbytes)
+        self.readinto(buf, write)
+        return bytes(buf)
+
+    def write(self, buf):
+        self.write_readinto(buf, bytearray(len(buf)))
+
+
+class SPI(SoftSPI):
+    """Hardware SPI block - same as SoftSPI but only on the pins the block can use."""
+
+    def __init__(self, spi_id, baudrate=1000000, polarity=0, phase=0, bits=8, firstbit=SoftSPI.MSB, sck=None, mosi=None, miso=None):
+        if spi_id not in SPI_PINS:
+            raise ValueError("SPI(%d) doesn't exist" % spi_id)
+        pins = SPI_PINS[spi_id]
+        if mosi is None:
+            mosi = pins['mosi'][0]
+        for name, pin in (('sck', sck), ('mosi', mosi), ('miso', miso)):
+            if pin is not None and _pin_id(pin) not in pins[name]:
+                raise ValueError("bad %s pin" % name.upper())
+        self.spi_id = spi_id
+        self.init(baudrate, polarity, phase, bits, firstbit, sck or pins['sck'][0], mosi, miso or pins['miso'][0])
+
+
+class WDT:
+    def __init__(self, id=0, timeout=5000):
+        board.watchdog_timeout_ms = timeout
+        board.watchdog_last_feed_us = clock.now_us
+
+    def feed(self):
+        board.watchdog_last_feed_us = clock.now_us
+
+
+def reset():
+    raise SimReset("machine.reset()")
+
+
+soft_reset = reset
+
+
+def freq(hz=None):
+    return 125000000
+
+
+def unique_id():
+    return b'\x00sim\x00\x00\x00\x01'
+
+
+def idle():
+    pass
+
+
+def disable_irq():
+    return 0
+
+
+def enable_irq(state=0):
+    pass
@@ -0,0 +1,30 @@
+"""Fake micropython module."""
+
+
+def const(value):
+    return value
+
+
+def schedule(func, arg):
+    # Soft IRQs run straight away - there is no real interrupt context here
+    func(arg)
+    return True
+
+
+def alloc_emergency_exception_buf(size):
+    pass
+
+
+def opt_level(level=None):
+    return 0
+
+
+def mem_info(verbose=False):
+    print("mem: simulated")
+
+
+def native(func):
+    return func
+
+
+viper = native
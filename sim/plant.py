@@ -0,0 +1,51 @@
+from collections import deque
+
+
+class HeaterPlant:
+    """
+    First order plus dead time (FOPDT) thermal model of the heater.
+    Temperature rises towards ambient + gain * power with the given time
+    constant, with the power seen by the model delayed by dead_time_s to
+    cover the time for heat to get from the element to the thermocouple.
+    Defaults are roughly a 0.49 ohm element in a small chamber - set them
+    from a logged session to match real hardware.
+    """
+
+    def __init__(self, ambient_c=22.0, gain_c_per_w=3.5, time_constant_s=45.0, dead_time_s=1.5, step_ms=10, initial_c=None):
+        self.ambient_c = ambient_c
+        self.gain_c_per_w = gain_c_per_w
+        self.time_constant_s = time_constant_s
+        self.dead_time_s = dead_time_s
+        self.step_ms = step_ms
+        self.temperature_c = ambient_c if initial_c is None else initial_c
+        delay_steps = int(dead_time_s * 1000 / step_ms)
+        self._delay = deque([0.0] * delay_steps, delay_steps) if delay_steps > 0 else None
+
+    def step(self, power_w):
+        """Advance the model by one step_ms with power_w going into the element."""
+        if self._delay is not None:
+            delayed_power_w = self._delay[0]
+            self._delay.append(power_w)  # Full deque drops the oldest from the left
+        else:
+            delayed_power_w = power_w
+        target_c = self.ambient_c + self.gain_c_per_w * delayed_power_w
+        self.temperature_c += (target_c - self.temperature_c) * (self.step_ms / 1000) / self.time_constant_s
+
+
+class Supply:
+    """
+    Power supply or battery as an open circuit voltage behind an internal
+    resistance, so the voltage sags while the heater is on.
+    Change volts during a run to simulate a failing supply or flat battery.
+    """
+
+    def __init__(self, volts=24.0, internal_resistance=0.05):
+        self.volts = volts
+        self.internal_resistance = internal_resistance
+
+    def loaded_volts(self, load_ohms):
+        return self.volts * load_ohms / (load_ohms + self.internal_resistance)
+
+    def terminal_volts(self, load_ohms, duty):
+        """Average voltage at the terminals with the load switched on for duty (0-1) of the time."""
+        return self.volts - duty * (self.volts - self.loaded_volts(load_ohms))
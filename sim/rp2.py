@@ -0,0 +1,411 @@
+"""
+Fake rp2 module: asm_pio assembles the program the same way MicroPython
+does (the names are put in the function's globals while it runs) and
+StateMachine interprets it against the board pins on the virtual clock.
+
+Only the instructions the firmware uses are interpreted (jmp, wait is not,
+in_, out, push, pull, mov, irq, set, nop). Instructions run in bursts at
+the state machine's clock rate and a jmp x_dec/y_dec to itself is fast
+forwarded, so a delay loop costs one step.
+"""
+from collections import deque
+
+from sim.board import board
+from sim.clock import clock
+from sim.machine import _pin_id
+
+
+class PIO:
+    IN_LOW = 0
+    IN_HIGH = 1
+    OUT_LOW = 2
+    OUT_HIGH = 3
+    SHIFT_LEFT = 0
+    SHIFT_RIGHT = 1
+    JOIN_NONE = 0
+    JOIN_TX = 1
+    JOIN_RX = 2
+    IRQ_SM0 = 0x100
+    IRQ_SM1 = 0x200
+    IRQ_SM2 = 0x400
+    IRQ_SM3 = 0x800
+
+    def __init__(self, pio_id):
+        self.pio_id = pio_id
+
+    def state_machine(self, index, program=None, *args, **kwargs):
+        return StateMachine(self.pio_id * 4 + index, program, *args, **kwargs)
+
+
+class Instruction:
+    def __init__(self, op, *args):
+        self.op = op
+        self.args = args
+        self.side_value = None
+        self.delay = 0
+
+    def side(self, value):
+        self.side_value = value
+        return self
+
+    def __getitem__(self, delay):
+        self.delay = delay
+        return self
+
+    def __repr__(self):
+        return f"{self.op}{self.args}"
+
+
+class Program:
+    def __init__(self, config):
+        self.config = config
+        self.instructions = []
+        self.labels = {}
+        self.wrap_target = 0
+        self.wrap = None
+
+
+def _count(init):
+    if init is None:
+        return 0
+    return len(init) if isinstance(init, tuple) else 1
+
+
+# Operands, as strings so the interpreter can switch on them
+_OPERANDS = ('x', 'y', 'osr', 'isr', 'pins', 'pindirs', 'null', 'status', 'pc', 'exec',
+             'block', 'noblock', 'clear', 'x_dec', 'y_dec', 'not_x', 'not_y', 'x_not_y',
+             'pin', 'not_osre', 'gpio', 'invert', 'reverse')
+
+
+def asm_pio(out_init=None, set_init=None, sideset_init=None, side_pindir=False, in_shiftdir=PIO.SHIFT_LEFT,
+            out_shiftdir=PIO.SHIFT_LEFT, autopush=False, autopull=False, push_thresh=32, pull_thresh=32,
+            fifo_join=PIO.JOIN_NONE):
+    config = {'out_init': out_init, 'set_init': set_init, 'sideset_init': sideset_init, 'in_shiftdir': in_shiftdir,
+              'out_shiftdir': out_shiftdir, 'autopush': autopush, 'autopull': autopull,
+              'push_thresh': push_thresh, 'pull_thresh': pull_thresh, 'fifo_join': fifo_join}
+
+    def decorator(func):
+        program = Program(config)
+        sideset_count = _count(sideset_init)
+        max_delay = (1 << (5 - sideset_count)) - 1
+
+        def emit(op):
+            def make(*args):
+                instruction = Instruction(op, *args)
+                program.instructions.append(instruction)
+                return instruction
+            return make
+
+        def label(name):
+            program.labels[name] = len(program.instructions)
+
+        def wrap_target():
+            program.wrap_target = len(program.instructions)
+
+        def wrap():
+            program.wrap = len(program.instructions) - 1
+
+        def rel(index):
+            return ('rel', index)
+
+        names = {op: emit(op) for op in ('jmp', 'wait', 'in_', 'out', 'push', 'pull', 'mov', 'irq', 'set', 'nop')}
+        names.update(label=label, wrap_target=wrap_target, wrap=wrap, rel=rel)
+        names.update({operand: operand for operand in _OPERANDS})
+
+        namespace = func.__globals__
+        saved = {name: namespace[name] for name in names if name in namespace}
+        namespace.update(names)
+        try:
+            func()
+        finally:
+            for name in names:
+                if name in saved:
+                    namespace[name] = saved[name]
+                else:
+                    del namespace[name]
+
+        if len(program.instructions) > 32:
+            raise ValueError("program too long")
+        for instruction in program.instructions:
+            if instruction.delay > max_delay:
+                raise ValueError(f"delay too large: {instruction}")
+            if sideset_count and instruction.side_value is None:
+                raise ValueError(f"side set missing: {instruction}")
+        if program.wrap is None:
+            program.wrap = len(program.instructions) - 1
+        return program
+    return decorator
+
+
+_state_machines = {}
+
+
+class StateMachine:
+    BURST_US = 100   # Run this much state machine time before letting the clock catch up
+
+    def __init__(self, sm_id, program=None, freq=-1, **kwargs):
+        if not 0 <= sm_id < 8:
+            raise ValueError("StateMachine id must be 0-7")
+        self.sm_id = sm_id
+        self._active = False
+        self._event = None
+        self._handler = None
+        if program is not None:
+            self.init(program, freq, **kwargs)
+
+    def init(self, program, freq=-1, in_base=None, out_base=None, set_base=None, jmp_pin=None, sideset_base=None,
+             in_shiftdir=None, out_shiftdir=None, push_thresh=None, pull_thresh=None):
+        self.active(0)
+        _state_machines[self.sm_id] = self
+        self.program = program
+        config = program.config
+        self.freq = freq if freq > 0 else 125000000
+        self.in_base = _pin_id(in_base) if in_base is not None else None
+        self.out_base = _pin_id(out_base) if out_base is not None else None
+        self.set_base = _pin_id(set_base) if set_base is not None else None
+        self.sideset_base = _pin_id(sideset_base) if sideset_base is not None else None
+        self.jmp_pin = _pin_id(jmp_pin) if jmp_pin is not None else None
+        self.in_shiftdir = config['in_shiftdir'] if in_shiftdir is None else in_shiftdir
+        self.out_shiftdir = config['out_shiftdir'] if out_shiftdir is None else out_shiftdir
+        self.push_thresh = config['push_thresh'] if push_thresh is None else push_thresh
+        self.pull_thresh = config['pull_thresh'] if pull_thresh is None else pull_thresh
+        join = config['fifo_join']
+        self.rx_capacity = 8 if join == PIO.JOIN_RX else 0 if join == PIO.JOIN_TX else 4
+        self.tx_capacity = 8 if join == PIO.JOIN_TX else 0 if join == PIO.JOIN_RX else 4
+        self.set_count = _count(config['set_init'])
+        self.out_count = _count(config['out_init'])
+        self.sideset_count = _count(config['sideset_init'])
+        for base, init in ((self.set_base, config['set_init']), (self.out_base, config['out_init']),
+                           (self.sideset_base, config['sideset_init'])):
+            if base is None or init is None:
+                continue
+            for i, pin_init in enumerate(init if isinstance(init, tuple) else (init,)):
+                if pin_init in (PIO.OUT_LOW, PIO.OUT_HIGH):
+                    board.write_pin(base + i, 1 if pin_init == PIO.OUT_HIGH else 0)
+        self.restart()
+
+    def restart(self):
+        self.pc = 0
+        self.x = 0
+        self.y = 0
+        self.isr = 0
+        self.isr_count = 0
+        self.osr = 0
+        self.osr_count = 32
+        self.rx = deque()
+        self.tx = deque()
+        self._time_us = clock.now_us
+        self._stalled = False
+
+    def active(self, value=None):
+        if value is None:
+            return self._active
+        value = bool(value)
+        if value and not self._active:
+            self._active = True
+            self._time_us = clock.now_us
+            self._wake()
+        elif not value and self._active:
+            self._active = False
+            if self._event is not None:
+                self._event.cancel()
+                self._event = None
+
+    def irq(self, handler=None, trigger=0, hard=False):
+        self._handler = handler
+
+    def put(self, value, shift=0):
+        if len(self.tx) >= self.tx_capacity:
+            raise RuntimeError("TX FIFO full - put() would block forever in the simulator")
+        self.tx.append((value >> shift) & 0xFFFFFFFF)
+        if self._stalled:
+            self._wake()
+
+    def get(self, buf=None, shift=0):
+        if not self.rx:
+            raise RuntimeError("RX FIFO empty - get() would block forever in the simulator")
+        value = self.rx.popleft() >> shift
+        if self._stalled:
+            self._wake()
+        return value
+
+    def rx_fifo(self):
+        return len(self.rx)
+
+    def tx_fifo(self):
+        return len(self.tx)
+
+    def _wake(self):
+        self._stalled = False
+        if self._active and self._event is None:
+            self._event = clock.call_at(max(clock.now_us, int(self._time_us)), self._run)
+
+    def _run(self):
+        self._event = None
+        if self._time_us < clock.now_us:
+            self._time_us = clock.now_us
+        limit_us = clock.now_us + self.BURST_US
+        while self._active:
+            if self._time_us > limit_us:
+                self._event = clock.call_at(int(self._time_us), self._run)
+                return
+            cycles = self._step()
+            if cycles is None:
+                self._stalled = True
+                return
+            self._time_us += cycles * 1000000 / self.freq
+
+    def _read_pins(self, base, count):
+        value = 0
+        for i in range(count):
+            value |= board.pin(base + i).value() << i
+        return value
+
+    def _write_pins(self, base, count, value):
+        for i in range(count):
+            board.write_pin(base + i, (value >> i) & 1)
+
+    def _source(self, source):
+        if source == 'x':
+            return self.x
+        if source == 'y':
+            return self.y
+        if source == 'osr':
+            return self.osr
+        if source == 'isr':
+            return self.isr
+        if source == 'null':
+            return 0
+        raise NotImplementedError(f"mov source {source}")
+
+    def _destination(self, destination, value):
+        value &= 0xFFFFFFFF
+        if destination == 'x':
+            self.x = value
+        elif destination == 'y':
+            self.y = value
+        elif destination == 'osr':
+            self.osr = value
+            self.osr_count = 0
+        elif destination == 'isr':
+            self.isr = value
+            self.isr_count = 0
+        elif destination == 'pins':
+            self._write_pins(self.out_base, self.out_count, value)
+        elif destination == 'pindirs' or destination == 'null':
+            pass
+        else:
+            raise NotImplementedError(f"destination {destination}")
+
+    def _push(self, block):
+        if len(self.rx) >= self.rx_capacity:
+            return not block  # Full: stall, or noblock drops it
+        self.rx.append(self.isr)
+        self.isr = 0
+        self.isr_count = 0
+        return True
+
+    def _irq(self, index):
+        flag = index
+        if isinstance(index, tuple):
+            flag = (index[1] + self.sm_id) % 4
+        target = _state_machines.get((self.sm_id // 4) * 4 + (flag & 3))
+        if target is not None and target._handler is not None:
+            target._handler(target)
+
+    def _step(self):
+        """Run the instruction at pc. Returns the cycles it took or None if it stalled."""
+        program = self.program
+        instruction = program.instructions[self.pc]
+        if instruction.side_value is not None:
+            self._write_pins(self.sideset_base, self.sideset_count, instruction.side_value)
+        op = instruction.op
+        args = instruction.args
+        next_pc = program.wrap_target if self.pc == program.wrap else self.pc + 1
+        cycles = 1 + instruction.delay
+
+        if op == 'nop':
+            pass
+        elif op == 'set':
+            destination, value = args
+            if destination == 'pins':
+                self._write_pins(self.set_base, self.set_count, value)
+            else:
+                self._destination(destination, value)
+        elif op == 'mov':
+            self._destination(args[0], self._source(args[1]))
+        elif op == 'jmp':
+            if len(args) == 1:
+                condition, target = None, args[0]
+            else:
+                condition, target = args
+            target_pc = program.labels[target]
+            if condition in ('x_dec', 'y_dec') and target_pc == self.pc:
+                # Delay loop - run every pass at once
+                cycles *= (self.x if condition == 'x_dec' else self.y) + 1
+                self._destination(condition[0], 0xFFFFFFFF)
+            else:
+                if condition is None:
+                    taken = True
+                elif condition == 'not_x':
+                    taken = self.x == 0
+                elif condition == 'not_y':
+                    taken = self.y == 0
+                elif condition == 'x_dec':
+                    taken = self.x != 0
+                    self.x = (self.x - 1) & 0xFFFFFFFF
+                elif condition == 'y_dec':
+                    taken = self.y != 0
+                    self.y = (self.y - 1) & 0xFFFFFFFF
+                elif condition == 'x_not_y':
+                    taken = self.x != self.y
+                elif condition == 'pin':
+                    taken = board.pin(self.jmp_pin).value() == 1
+                elif condition == 'not_osre':
+                    taken = self.osr_count < self.pull_thresh
+                else:
+                    raise NotImplementedError(f"jmp condition {condition}")
+                if taken:
+                    next_pc = target_pc
+        elif op == 'in_':
+            source, count = args
+            if source == 'pins':
+                value = self._read_pins(self.in_base, count)
+            else:
+                value = self._source(source) & ((1 << count) - 1)
+            if self.in_shiftdir == PIO.SHIFT_LEFT:
+                self.isr = ((self.isr << count) | value) & 0xFFFFFFFF
+            else:
+                self.isr = (self.isr >> count) | (value << (32 - count))
+            self.isr_count += count
+            if self.program.config['autopush'] and self.isr_count >= self.push_thresh and not self._push(True):
+                return None
+        elif op == 'out':
+            destination, count = args
+            if self.out_shiftdir == PIO.SHIFT_LEFT:
+                value = self.osr >> (32 - count)
+                self.osr = (self.osr << count) & 0xFFFFFFFF
+            else:
+                value = self.osr & ((1 << count) - 1)
+                self.osr >>= count
+            self.osr_count += count
+            self._destination(destination, value)
+        elif op == 'push':
+            if not self._push('noblock' not in args):
+                return None
+        elif op == 'pull':
+            if self.tx:
+                self.osr = self.tx.popleft()
+                self.osr_count = 0
+            elif 'noblock' in args:
+                self.osr = self.x
+                self.osr_count = 0
+            else:
+                return None
+        elif op == 'irq':
+            self._irq(args[-1])
+        else:
+            raise NotImplementedError(f"PIO instruction {op}")
+
+        self.pc = next_pc
+        return cycles
@@ -0,0 +1,197 @@
+"""
+Run main.py on the simulated board.
+
+    python -m sim.runner --seconds 120 --mode Session --trace-ms 1000
+    python -m sim.runner --profile example --autosession quicktest --mode autosession
+
+The device filesystem is a copy of the repo's profiles in a temporary
+directory (or --root) so runs never touch the files in the repo.
+"""
+import argparse
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import sim
+from sim import fs
+from sim.clock import clock, SimulationComplete, SimReset
+
+DEVICE_FILES = ('profiles', 'profiles_autosession', 'hardware_profiles', 'hardware_default.txt', 'current_profile.txt')
+
+
+def prepare_root(root, profile=None, autosession_profile=None, hardware=None):
+    """Copy the files the firmware reads into root, optionally choosing what loads at start up."""
+    for name in DEVICE_FILES:
+        source = os.path.join(sim.REPO_ROOT, name)
+        target = os.path.join(root, name)
+        if os.path.isdir(source):
+            if not os.path.exists(target):
+                shutil.copytree(source, target)
+        elif os.path.exists(source) and not os.path.exists(target):
+            shutil.copy(source, target)
+    if profile is not None:
+        with open(os.path.join(root, 'current_profile.txt'), 'w') as f:
+            f.write(profile)
+    if autosession_profile is not None:
+        with open(os.path.join(root, 'current_autosession_profile.txt'), 'w') as f:
+            f.write(autosession_profile)
+    if hardware is not None:
+        with open(os.path.join(root, 'current_hardware.txt'), 'w') as f:
+            f.write(hardware)
+
+
+class Simulation:
+    """
+    One run of main.py on the simulated board. Only one per process as the
+    firmware keeps module level state.
+    Schedule actions with at()/every() before run() - they are called with
+    the Simulation and can use .shared_state, .board and .globals.
+    """
+
+    def __init__(self, root=None, profile=None, autosession_profile=None, hardware=None,
+                 supply_volts=24.0, internal_resistance=0.05, heater_resistance=0.49,
+                 plant=None, quiet=False):
+        sim.install()
+        self.root = root or tempfile.mkdtemp(prefix='heater-sim-')
+        prepare_root(self.root, profile, autosession_profile, hardware)
+        fs.install(self.root)
+
+        from sim.board import board, MAX6675Device, MAX31855Device, MAX31856Device, INA226Device, SSD1306Device
+        from sim.plant import HeaterPlant
+        self.board = board
+        self.quiet = quiet
+        self.globals = {'__name__': '__main__', '__file__': os.path.join(sim.REPO_ROOT, 'main.py')}
+        self.reason = None
+
+        board.supply.volts = supply_volts
+        board.supply.internal_resistance = internal_resistance
+        board.heater_resistance = heater_resistance
+        board.plant = plant if plant is not None else HeaterPlant()
+
+        # Wire the board up the same way the firmware will from the hardware profile
+        with self._output():
+            import utils
+            hw, _ = utils.load_hardware_config()
+        board.heater_pins = [hw.get('heater', 22), 12, 13]  # Induction coil pins are fixed in main.py
+        board.add_voltage_divider(hw.get('voltage_divider_adc', 28))
+        # One converter per CS pin on the shared SCK/SO lines, thermocouple is the first
+        sck = hw.get('thermocouple_sck', 6)
+        so = hw.get('thermocouple_so', 8)
+        thermocouple_type = hw.get('thermocouple_type', 'max6675')
+        self.thermocouples = []
+        for cs in str(hw.get('thermocouple_cs', 7)).split(','):
+            if thermocouple_type == 'max31856':
+                device = MAX31856Device(board, sck, int(cs), hw.get('thermocouple_mosi', 3), so)
+            elif thermocouple_type == 'max31855':
+                device = MAX31855Device(board, sck, int(cs), so)
+            else:
+                device = MAX6675Device(board, sck, int(cs), so)
+            self.thermocouples.append(device)
+        self.thermocouple = self.thermocouples[0]
+        self.display = SSD1306Device(board)
+        self.ina226 = None
+        if hw.get('ina226', 0) == 1:
+            self.ina226 = INA226Device(board, hw.get('ina226_address', 0x40), float(hw.get('ina226_shunt_ohms', 0.002)))
+
+    @property
+    def shared_state(self):
+        return self.globals.get('shared_state')
+
+    def at(self, ms, action):
+        """Call action(self) at ms of virtual time from power on."""
+        return clock.call_at(clock.start_us + ms * 1000, lambda: action(self))
+
+    def every(self, ms, action, start_ms=None):
+        """Call action(self) every ms of virtual time."""
+        start_ms = ms if start_ms is None else start_ms
+        return clock.call_at(clock.start_us + start_ms * 1000, lambda: action(self), ms * 1000)
+
+    def _output(self):
+        if self.quiet:
+            from contextlib import redirect_stdout
+            return redirect_stdout(io.StringIO())
+        from contextlib import nullcontext
+        return nullcontext()
+
+    def run(self, seconds):
+        """Run main.py for seconds of virtual time. Returns a summary dict."""
+        main_path = self.globals['__file__']
+        with open(main_path) as f:
+            code = compile(f.read(), main_path, 'exec')
+        clock.run_for(int(seconds * 1000))
+        wall_start = time.perf_counter()
+        try:
+            with self._output():
+                exec(code, self.globals)
+            self.reason = 'exited'
+        except SimulationComplete:
+            self.reason = 'complete'
+        except SimReset as e:
+            self.reason = 'reset: ' + str(e)
+        wall_s = time.perf_counter() - wall_start
+        virtual_s = clock.elapsed_ms() / 1000
+        return {
+            'reason': self.reason,
+            'virtual_s': virtual_s,
+            'wall_s': round(wall_s, 3),
+            'speedup': round(virtual_s / wall_s, 1) if wall_s > 0 else None,
+            'plant_temperature_c': round(self.board.plant.temperature_c, 2),
+            'energy_j': round(self.board.energy_j, 1),
+        }
+
+
+def trace(simulation):
+    shared_state = simulation.shared_state
+    if shared_state is None:
+        return
+    board = simulation.board
+    print(f"{clock.elapsed_ms() / 1000:8.2f}s plant {board.plant.temperature_c:6.1f}C read {shared_state.heater_temperature:6.1f}C "
+          f"set {shared_state.temperature_setpoint:5.1f}C duty {board.heater_duty() * 100:5.1f}% "
+          f"{board.heater_power_w():6.1f}W {board.input_volts():5.2f}V mode {shared_state.mode}", file=sys.__stdout__)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the heater controller firmware on a simulated board")
+    parser.add_argument('--seconds', type=float, default=60, help="virtual seconds to run for")
+    parser.add_argument('--profile', help="profile to load at start up (name in profiles/)")
+    parser.add_argument('--autosession', help="autosession profile to load at start up")
+    parser.add_argument('--hardware', help="hardware profile (name in hardware_profiles/)")
+    parser.add_argument('--mode', choices=['Off', 'Session', 'Manual', 'autosession'], default='Off', help="mode to switch to once started")
+    parser.add_argument('--start-ms', type=int, default=2000, help="when to switch mode (virtual ms)")
+    parser.add_argument('--setpoint', type=int, help="temperature setpoint to use")
+    parser.add_argument('--volts', type=float, default=24.0, help="supply open circuit voltage")
+    parser.add_argument('--internal-resistance', type=float, default=0.05, help="supply internal resistance (ohms)")
+    parser.add_argument('--resistance', type=float, default=0.49, help="real heater resistance (ohms)")
+    parser.add_argument('--trace-ms', type=int, default=0, help="print the plant state this often (virtual ms)")
+    parser.add_argument('--root', help="directory to use as the device filesystem")
+    parser.add_argument('--quiet', action='store_true', help="hide the firmware's own output")
+    args = parser.parse_args(argv)
+
+    simulation = Simulation(root=args.root, profile=args.profile, autosession_profile=args.autosession,
+                            hardware=args.hardware, supply_volts=args.volts,
+                            internal_resistance=args.internal_resistance,
+                            heater_resistance=args.resistance, quiet=args.quiet)
+
+    def start(simulation):
+        shared_state = simulation.shared_state
+        if shared_state is None:
+            return
+        if args.setpoint is not None:
+            shared_state.temperature_setpoint = args.setpoint
+        if args.mode != 'Off':
+            shared_state.set_mode(args.mode)
+    simulation.at(args.start_ms, start)
+    if args.trace_ms:
+        simulation.every(args.trace_ms, trace)
+
+    result = simulation.run(args.seconds)
+    print(result, file=sys.__stdout__)
+    if args.root is None:
+        shutil.rmtree(simulation.root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
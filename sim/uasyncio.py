@@ -0,0 +1,297 @@
+"""
+Fake uasyncio running tasks on the virtual clock.
+When every task is waiting the loop jumps the clock straight to the next
+task wake up or timer event, so nothing ever really sleeps.
+"""
+import heapq
+import sys
+
+from sim.clock import clock, SimulationComplete, SimReset
+
+
+class CancelledError(BaseException):
+    pass
+
+
+class TimeoutError(Exception):
+    pass
+
+
+class _Sleep:
+    def __init__(self, delay_us):
+        self.delay_us = delay_us
+
+    def __await__(self):
+        yield self
+
+    __iter__ = __await__
+
+
+class _Wait:
+    def __init__(self, waitable):
+        self.waitable = waitable
+
+    def __await__(self):
+        yield self
+
+    __iter__ = __await__
+
+
+class Task:
+    def __init__(self, coro, loop):
+        self.coro = coro
+        self.loop = loop
+        self.done_ = False
+        self.result = None
+        self.exception = None
+        self.waiters = []
+        self._cancel_pending = False
+        self._wake_seq = 0   # Bumped whenever the task is woken so stale sleep entries are ignored
+
+    def done(self):
+        return self.done_
+
+    def cancel(self):
+        if self.done_:
+            return False
+        self._cancel_pending = True
+        self.loop._wake(self)
+        return True
+
+    def __await__(self):
+        if not self.done_:
+            yield _Wait(self)
+        if self.exception is not None:
+            raise self.exception
+        return self.result
+
+    __iter__ = __await__
+
+
+class ThreadSafeFlag:
+    """Set from timer callbacks to wake one waiting task."""
+
+    def __init__(self):
+        self._flag = False
+        self.waiters = []
+
+    def set(self):
+        self._flag = True
+        if self.waiters:
+            task = self.waiters.pop(0)
+            self._flag = False
+            _loop._wake(task)
+
+    def clear(self):
+        self._flag = False
+
+    async def wait(self):
+        if self._flag:
+            self._flag = False
+            return
+        await _Wait(self)
+
+
+class Event:
+    def __init__(self):
+        self.state = False
+        self.waiters = []
+
+    def is_set(self):
+        return self.state
+
+    def set(self):
+        self.state = True
+        while self.waiters:
+            _loop._wake(self.waiters.pop(0))
+
+    def clear(self):
+        self.state = False
+
+    async def wait(self):
+        if not self.state:
+            await _Wait(self)
+        return True
+
+
+class Lock:
+    def __init__(self):
+        self.locked_ = False
+        self.waiters = []
+
+    def locked(self):
+        return self.locked_
+
+    async def acquire(self):
+        while self.locked_:
+            await _Wait(self)
+        self.locked_ = True
+        return True
+
+    def release(self):
+        self.locked_ = False
+        if self.waiters:
+            _loop._wake(self.waiters.pop(0))
+
+    async def __aenter__(self):
+        return await self.acquire()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class Loop:
+    def __init__(self):
+        self.ready = []
+        self.sleeping = []   # heap of (wake_us, seq, task, wake_seq)
+        self._seq = 0
+        self.current = None
+
+    def create_task(self, coro):
+        task = Task(coro, self)
+        self.ready.append((task, None))
+        return task
+
+    def _wake(self, task, value=None):
+        task._wake_seq += 1
+        self.ready.append((task, value))
+
+    def _sleep(self, task, delay_us):
+        self._seq += 1
+        heapq.heappush(self.sleeping, (clock.now_us + delay_us, self._seq, task, task._wake_seq))
+
+    def _step(self, task, value):
+        if task.done_:
+            return
+        self.current = task
+        try:
+            if task._cancel_pending:
+                task._cancel_pending = False
+                awaiting = task.coro.throw(CancelledError())
+            else:
+                awaiting = task.coro.send(value)
+        except StopIteration as e:
+            self._finish(task, result=e.value)
+            return
+        except CancelledError as e:
+            self._finish(task, exception=e)
+            return
+        except (SimulationComplete, SimReset):
+            raise
+        except BaseException as e:
+            print(f"Task exception wasn't retrieved: {e!r}", file=sys.stderr)
+            self._finish(task, exception=e)
+            return
+        finally:
+            self.current = None
+
+        if isinstance(awaiting, _Sleep):
+            if awaiting.delay_us <= 0:
+                self.ready.append((task, None))
+            else:
+                self._sleep(task, awaiting.delay_us)
+        elif isinstance(awaiting, _Wait):
+            awaiting.waitable.waiters.append(task)
+        else:
+            self.ready.append((task, None))  # Bare yield
+
+    def _finish(self, task, result=None, exception=None):
+        task.done_ = True
+        task.result = result
+        task.exception = exception
+        while task.waiters:
+            self._wake(task.waiters.pop(0))
+
+    def _run_until(self, done):
+        while not done():
+            if self.ready:
+                batch = self.ready
+                self.ready = []
+                for task, value in batch:
+                    self._step(task, value)
+                continue
+
+            # Nothing to run - jump to whichever comes first, a task waking or a timer event
+            while self.sleeping and self.sleeping[0][3] != self.sleeping[0][2]._wake_seq:
+                heapq.heappop(self.sleeping)  # Task was woken or cancelled since it went to sleep
+            wake_us = self.sleeping[0][0] if self.sleeping else None
+            event_us = clock.next_event_us()
+            if wake_us is None and event_us is None:
+                raise RuntimeError("uasyncio: all tasks are waiting and nothing will wake them")
+            if event_us is not None and (wake_us is None or event_us < wake_us):
+                clock.advance_to(event_us)
+            else:
+                clock.advance_to(wake_us)
+                while self.sleeping and self.sleeping[0][0] <= clock.now_us:
+                    _, _, task, wake_seq = heapq.heappop(self.sleeping)
+                    if wake_seq == task._wake_seq:
+                        self._wake(task)
+
+    def run_until_complete(self, coro):
+        task = coro if isinstance(coro, Task) else self.create_task(coro)
+        self._run_until(task.done)
+        if task.exception is not None:
+            raise task.exception
+        return task.result
+
+    def run_forever(self):
+        self._run_until(lambda: False)
+
+    def stop(self):
+        pass
+
+    def close(self):
+        pass
+
+
+_loop = Loop()
+
+
+def get_event_loop(runq_len=0, waitq_len=0):
+    return _loop
+
+
+def new_event_loop():
+    return _loop
+
+
+def create_task(coro):
+    return _loop.create_task(coro)
+
+
+def current_task():
+    return _loop.current
+
+
+def run(coro):
+    return _loop.run_until_complete(coro)
+
+
+def sleep_ms(ms):
+    return _Sleep(int(ms) * 1000)
+
+
+def sleep(seconds):
+    return _Sleep(int(seconds * 1000000))
+
+
+async def wait_for_ms(awaitable, timeout_ms):
+    # No real timeout support - enough for firmware that awaits things that finish
+    return await awaitable
+
+
+async def wait_for(awaitable, timeout):
+    return await awaitable
+
+
+async def gather(*awaitables, return_exceptions=False):
+    results = []
+    for awaitable in awaitables:
+        task = awaitable if isinstance(awaitable, Task) else create_task(awaitable)
+        try:
+            results.append(await task)
+        except Exception as e:
+            if not return_exceptions:
+                raise
+            results.append(e)
+    return results
@@ -0,0 +1,65 @@
+"""Fake utime on the virtual clock."""
+import calendar as _calendar
+import time as _time
+
+from sim.clock import clock, TICKS_MAX, TICKS_HALFPERIOD
+
+
+EPOCH_OFFSET_S = 1704067200  # 2024-01-01 so log file timestamps look sensible
+
+
+def ticks_us():
+    return clock.now_us & TICKS_MAX
+
+
+def ticks_ms():
+    return (clock.now_us // 1000) & TICKS_MAX
+
+
+def ticks_cpu():
+    return ticks_us()
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & TICKS_MAX
+
+
+def ticks_diff(ticks1, ticks2):
+    return ((ticks1 - ticks2 + TICKS_HALFPERIOD) & TICKS_MAX) - TICKS_HALFPERIOD
+
+
+def sleep_us(us):
+    if us > 0:
+        clock.advance(us)
+
+
+def sleep_ms(ms):
+    if ms > 0:
+        clock.advance(int(ms) * 1000)
+
+
+def sleep(seconds):
+    if seconds > 0:
+        clock.advance(int(seconds * 1000000))
+
+
+def time():
+    return EPOCH_OFFSET_S + clock.now_us // 1000000
+
+
+def time_ns():
+    return (EPOCH_OFFSET_S * 1000000 + clock.now_us) * 1000
+
+
+def localtime(secs=None):
+    if secs is None:
+        secs = time()
+    t = _time.gmtime(secs)
+    return (t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec, t.tm_wday, t.tm_yday)
+
+
+gmtime = localtime
+
+
+def mktime(t):
+    return _calendar.timegm(tuple(t[:6]))
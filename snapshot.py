@@ -0,0 +1,40 @@
+class Snapshot:
+    """
+    Double buffered record for passing values from one core to the other
+    without locks.
+    Only one core may publish. The writer fills the back buffer then flips
+    which buffer is the front one and bumps a sequence number. A reader
+    copies the front buffer and retries if a publish happened while it was
+    copying, as after a flip the writer may start refilling the buffer being
+    copied. Publishes are far slower than a copy so retries are rare.
+    Buffers are preallocated lists so publishing does not allocate.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._buffers = ([0] * size, [0] * size)
+        self._front = 0
+        self._seq = 0
+
+    def back_buffer(self):
+        """Buffer to fill before calling publish() - writer only."""
+        return self._buffers[1 - self._front]
+
+    def publish(self):
+        """Make the back buffer the front one - writer only."""
+        self._front = 1 - self._front
+        self._seq += 1
+
+    def seq(self):
+        """Number of publishes so far - use to tell if there is anything new."""
+        return self._seq
+
+    def read_into(self, values):
+        """Copy the latest published values into a list of the same size. Returns seq read."""
+        while True:
+            seq = self._seq
+            front = self._buffers[self._front]
+            for i in range(self.size):
+                values[i] = front[i]
+            if self._seq == seq:
+                return seq
@@ -0,0 +1,103 @@
+import utime
+from array import array
+
+
+class TemperatureFilter:
+    """
+    Outlier rejection for thermocouple readings, set up from the profile.
+    Keeps the last `samples` readings in a preallocated ring buffer as
+    integer 1/UNITS_PER_C degrees (the MAX31856's resolution, the MAX6675's
+    quarter degrees are whole multiples of it) and sorts a preallocated copy
+    in place, so adding a reading doesn't allocate.
+
+    mode 'median' takes the middle reading, 'trimmed_mean' drops `trim`
+    readings from each end and averages the rest, 'none' uses the newest.
+    With max_rate (C/s, 0 = off) a reading that moved further than the
+    heater can since the last accepted one is thrown away, unless
+    GATE_LIMIT in a row do - then the change is taken as real.
+    """
+    NONE = 'none'
+    MEDIAN = 'median'
+    TRIMMED_MEAN = 'trimmed_mean'
+    MODES = (NONE, MEDIAN, TRIMMED_MEAN)
+
+    MAX_SAMPLES = 9
+    GATE_LIMIT = 3
+    UNITS_PER_C = 128
+    GATE_MIN_UNITS = 64     # Steps of 0.5C or less are never gated, that's just sensor noise
+
+    def __init__(self, mode=NONE, samples=1, trim=0, max_rate=0):
+        self._ring = array('i', [0] * TemperatureFilter.MAX_SAMPLES)
+        self._sorted = array('i', [0] * TemperatureFilter.MAX_SAMPLES)
+        self.rejected_count = 0   # Readings thrown away by rate gating
+        self.configure(mode, samples, trim, max_rate)
+
+    def configure(self, mode, samples, trim, max_rate):
+        self.mode = mode
+        self.samples = samples if mode != TemperatureFilter.NONE else 1
+        self.trim = trim
+        self.max_rate = max_rate
+        self.enabled = self.samples > 1 or max_rate > 0
+        self.reset()
+
+    def reset(self):
+        self._head = 0
+        self._count = 0
+        self._gated = 0
+        self._last_units = 0
+        self._last_time = 0
+        self.temperature = None
+
+    def update(self, temperature, sample_time):
+        """
+        Add a new reading taken at sample_time (ticks_ms).
+        Returns False if rate gating threw it away, temperature is unchanged then.
+        """
+        units = int(round(temperature * TemperatureFilter.UNITS_PER_C))
+        if self.max_rate and self._count:
+            allowed = self.max_rate * TemperatureFilter.UNITS_PER_C * utime.ticks_diff(sample_time, self._last_time) // 1000
+            if allowed < TemperatureFilter.GATE_MIN_UNITS:
+                allowed = TemperatureFilter.GATE_MIN_UNITS
+            if abs(units - self._last_units) > allowed and self._gated < TemperatureFilter.GATE_LIMIT:
+                self._gated += 1
+                self.rejected_count += 1
+                return False
+        self._gated = 0
+        self._last_units = units
+        self._last_time = sample_time
+
+        self._ring[self._head] = units
+        self._head = (self._head + 1) % self.samples
+        if self._count < self.samples:
+            self._count += 1
+        self.temperature = self._filtered_units() / TemperatureFilter.UNITS_PER_C
+        return True
+
+    def _filtered_units(self):
+        count = self._count
+        if count == 1 or self.mode == TemperatureFilter.NONE:
+            return self._last_units
+
+        # Insertion sort into the scratch buffer - at most MAX_SAMPLES readings
+        ring = self._ring
+        ordered = self._sorted
+        for i in range(count):
+            value = ring[i]
+            j = i
+            while j > 0 and ordered[j - 1] > value:
+                ordered[j] = ordered[j - 1]
+                j -= 1
+            ordered[j] = value
+
+        if self.mode == TemperatureFilter.MEDIAN:
+            if count & 1:
+                return ordered[count >> 1]
+            return (ordered[(count >> 1) - 1] + ordered[count >> 1]) / 2
+
+        trim = self.trim
+        if trim > (count - 1) >> 1:
+            trim = (count - 1) >> 1  # Still filling - keep at least one reading
+        total = 0
+        for i in range(trim, count - trim):
+            total += ordered[i]
+        return total / (count - 2 * trim)
@@ -423,6 +423,8 @@ def test_thermocouple(hw):
     
     tc_sck = hw.get('thermocouple_sck')
     tc_cs = hw.get('thermocouple_cs')
+    if tc_cs is not None:
+        tc_cs = int(str(tc_cs).split(',')[0])  # Tests the first thermocouple when there's more than one
     tc_so = hw.get('thermocouple_so')
 
     if tc_sck is None or tc_cs is None or tc_so is None:
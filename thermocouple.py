@@ -1,24 +1,181 @@
-from machine import Pin
+from machine import Pin, SPI, SoftSPI
 from max6675_utime import MAX6675
+from max6675_spi import MAX6675SPI
+from max31855 import MAX31855
+from max31856 import MAX31856
+from temperaturefilter import TemperatureFilter
 import utime
 
+THERMOCOUPLE_SPI_BAUDRATE = 1000000  # MAX6675 is good for up to 4.3MHz, MAX31855/MAX31856 5MHz
+MAX_PROBES = 4                       # Converters sharing SCK/SO, one CS pin each
+THERMOCOUPLE_TYPES = ('max6675', 'max31855', 'max31856')
+
+# Thermocouple.combine_index for the combine policies that aren't a single probe
+COMBINE_MAX = -1
+COMBINE_MEAN = -2
+
+# Errors that only pause the heater - cleared by the next good reading
+THERMOCOUPLE_PAUSE_ERRORS = ("thermocouple-above_limit", "thermocouple-read_error")
+ABOVE_LIMIT = 1000          # C, hotter than any heater here gets
+ABOVE_LIMIT_READINGS = 2    # Fresh readings in a row over ABOVE_LIMIT before it's believed
+
+
+class OffTemperatureSampler:
+    """
+    Multi-tick state machine for getting a heater off temperature reading.
+    Induction coils corrupt the thermocouple while on, so when a clean reading
+    is needed the heater is switched off, and the reading is taken on a later
+    control tick once settle_ms has passed. Nothing sleeps in the control path.
+    """
+    IDLE = 0
+    SETTLING = 1
+    SETTLE_MARGIN_MS = 81   # Off time on top of one conversion
+
+    def __init__(self, settle_ms=301):
+        self.settle_ms = settle_ms  # Heater off time before reading - longer than a conversion
+        self.state = OffTemperatureSampler.IDLE
+        self.off_start_time = 0
+
+    def start(self):
+        """Start the off window - caller must switch the heater off."""
+        if self.state == OffTemperatureSampler.IDLE:
+            self.state = OffTemperatureSampler.SETTLING
+            self.off_start_time = utime.ticks_ms()
+
+    def is_settling(self):
+        return self.state == OffTemperatureSampler.SETTLING
+
+    def ready(self):
+        """True once the heater has been off long enough to take the reading."""
+        return self.state == OffTemperatureSampler.SETTLING and utime.ticks_diff(utime.ticks_ms(), self.off_start_time) >= self.settle_ms
+
+    def done(self):
+        """Reading taken (or failed) - heater power can be restored."""
+        self.state = OffTemperatureSampler.IDLE
+
+
+class TemperatureEstimator:
+    """
+    Alpha-beta estimator of the heater temperature between thermocouple
+    conversions, so the control loop can run faster than the sensor.
+    The temperature is predicted forward with a rate made of the heater's
+    known power (heat_rate C/s at 100%) plus a learnt rate for everything
+    the power term doesn't cover (losses, wrong heat_rate). Each new reading
+    corrects the temperature by alpha of the error and the learnt rate by
+    beta of the error per second.
+    Predictions stop max_predict_ms after the last reading so a dead sensor
+    doesn't let the estimate run away.
+    """
+
+    def __init__(self, alpha=0.5, beta=0.1, heat_rate=0.0, max_predict_ms=1500):
+        self.max_predict_ms = max_predict_ms
+        self.enabled = False
+        self.configure(False, alpha, beta, heat_rate)
+
+    def configure(self, enabled, alpha, beta, heat_rate):
+        """Set up from the profile. The estimate is kept if it stays enabled, so a profile reload mid-session carries on from it."""
+        if not enabled or not self.enabled:
+            self.reset()
+        self.enabled = enabled
+        self.alpha = alpha
+        self.beta = beta
+        self.heat_rate = heat_rate
+
+    def reset(self):
+        self.temperature = None
+        self.learnt_rate = 0.0     # C/s not explained by heater power
+        self.power = 0             # Heater power % applied since state_time
+        self.state_time = 0        # ticks_ms the temperature is for
+        self.sample_time = 0       # ticks_ms of the last reading used
+
+    def rate(self):
+        """Estimated rate of change in C/s at the current heater power."""
+        return self.heat_rate * self.power / 100 + self.learnt_rate
+
+    def predict(self, now, power):
+        """
+        Move the estimate on to now (ticks_ms). power is the heater power %
+        applied since the last call. Returns the estimated temperature.
+        """
+        if self.temperature is None:
+            return None
+        end = now
+        if utime.ticks_diff(end, self.sample_time) > self.max_predict_ms:
+            end = utime.ticks_add(self.sample_time, self.max_predict_ms)
+        dt_ms = utime.ticks_diff(end, self.state_time)
+        if dt_ms > 0:
+            self.temperature += self.rate() * dt_ms / 1000
+            self.state_time = end
+        self.power = power
+        return self.temperature
+
+    def correct(self, measured, sample_time):
+        """
+        Take a thermocouple reading taken at sample_time (ticks_ms), call after predict().
+        Readings already used are ignored.
+        """
+        if self.temperature is None:
+            self.temperature = measured
+            self.state_time = sample_time
+            self.sample_time = sample_time
+            return
+        if sample_time == self.sample_time:
+            return
+        # Error against the estimate for when the reading was taken
+        error = measured - (self.temperature - self.rate() * utime.ticks_diff(self.state_time, sample_time) / 1000)
+        dt_ms = utime.ticks_diff(sample_time, self.sample_time)
+        self.temperature += self.alpha * error
+        if dt_ms > 0:
+            self.learnt_rate += self.beta * error * 1000 / dt_ms
+        self.sample_time = sample_time
+
+
 class Thermocouple:
-    def __init__(self, sck_pin_number, cs_pin_number, so_pin_number, heater_on_temperature_difference_threshold, shared_state=None):
+    def __init__(self, sck_pin_number, cs_pin_number, so_pin_number, heater_on_temperature_difference_threshold, shared_state=None, driver='bitbang', spi_id=0, mosi_pin_number=None, pio_sm=0, probe_names=None, thermocouple_type='max6675', averaging=1, mains_hz=50):
         print("Thermocouple Initialising ...")
         
         self.shared_state = shared_state
 
+        # cs_pin_number can be a list - one converter per CS pin on the shared SCK/SO lines
+        cs_pin_numbers = cs_pin_number if isinstance(cs_pin_number, (list, tuple)) else [cs_pin_number]
+        if len(cs_pin_numbers) > MAX_PROBES:
+            raise ValueError(f"Too many thermocouples, max {MAX_PROBES}")
+        self.probe_count = len(cs_pin_numbers)
+        if not probe_names or len(probe_names) != self.probe_count:
+            probe_names = ["TC" + str(index + 1) for index in range(self.probe_count)]
+        self.probe_names = probe_names
+        self.probe_temps = [0] * self.probe_count
+        self.above_limit_readings = [0] * self.probe_count   # Fresh readings in a row over ABOVE_LIMIT
+        self.combine_index = COMBINE_MAX  # Set from the profile's thermocouple_combine
+
         self.sck = Pin(sck_pin_number, Pin.OUT)
-        self.cs = Pin(cs_pin_number, Pin.OUT)
+        self.cs_pins = [Pin(pin_number, Pin.OUT) for pin_number in cs_pin_numbers]
+        self.cs = self.cs_pins[0]
         self.so = Pin(so_pin_number, Pin.IN)
+        if shared_state:
+            shared_state.set_probes(self.probe_names)
 
         self.heater_on_temperature_difference_threshold = heater_on_temperature_difference_threshold
-        self.thermocouple_sensor = None
+        self.thermocouple_sensors = []
         self.last_known_safe_temp = None
         self.raw_temp = 0
+        self.sample_fresh = False  # False if the last read repeated the previous conversion
+        self.sample_time = 0       # ticks_ms the last reading was taken by the sensor
+        self.sample_time_us = 0    # ... and in ticks_us, for the PID's dt
+        self.conversion_period_ms = MAX6675.MEASUREMENT_PERIOD_MS
         self.filtered_temp_counter = 0
+        self.off_temperature_sampler = OffTemperatureSampler()
+        self.temperature_filters = [TemperatureFilter() for _ in range(self.probe_count)]  # Set up from the profile on the first read
+        self.temperature_estimator = TemperatureEstimator()                               # ... as is this
+        self.profile_seq = -1                                # shared_state.profile_seq they were set up for
+        self.driver = driver
+        self.thermocouple_type = thermocouple_type
+        self.averaging = averaging    # MAX31856 only
+        self.mains_hz = mains_hz      # ... as is this
         try:
-            self.thermocouple_sensor = MAX6675(self.sck, self.cs, self.so)
+            self.thermocouple_sensors = self.create_sensors(thermocouple_type, driver, spi_id, sck_pin_number, so_pin_number, mosi_pin_number, pio_sm)
+            self.conversion_period_ms = self.thermocouple_sensors[0].MEASUREMENT_PERIOD_MS
+            self.off_temperature_sampler.settle_ms = self.conversion_period_ms + OffTemperatureSampler.SETTLE_MARGIN_MS
             utime.sleep_ms(500)
             #self.update_filtered_temp(False) # Initialize last_known_safe_temp
             try:
@@ -43,45 +200,185 @@ class Thermocouple:
 
     def read_raw_temp(self):
         try:
-            raw_temp = self.thermocouple_sensor.read()
-            if self.thermocouple_sensor.error():
-                error_msg = self.shared_state.error_messages.get("thermocouple-read_error", "Thermocouple read error") if self.shared_state else "Thermocouple read error"
-                if self.shared_state:
-                    self.shared_state.set_error("thermocouple-read_error", error_msg)
-                return None
-            if raw_temp is None:
-                error_msg = self.shared_state.error_messages.get("thermocouple-invalid_reading", "Invalid reading") if self.shared_state else "Invalid reading"
-                if self.shared_state:
-                    self.shared_state.set_error("thermocouple-invalid_reading", error_msg)
-                return None
-            if raw_temp == 0:
-                base_msg = self.shared_state.error_messages.get("thermocouple-zero_reading", "Zero reading") if self.shared_state else "Zero reading"
-                error_msg = base_msg + " " + str(raw_temp)
-                if self.shared_state:
-                    self.shared_state.set_error("thermocouple-zero_reading", error_msg)
-                return None
-            if raw_temp < 0:
-                base_msg = self.shared_state.error_messages.get("thermocouple-below_zero", "Below zero") if self.shared_state else "Below zero"
-                error_msg = base_msg + " " + str(raw_temp)
-                if self.shared_state:
-                    self.shared_state.set_error("thermocouple-below_zero", error_msg)
-                return None
-            if raw_temp > 1000:
-                base_msg = self.shared_state.error_messages.get("thermocouple-above_limit", "Above limit") if self.shared_state else "Above limit"
-                error_msg = base_msg + " " + str(raw_temp)
-                if self.shared_state:
-                    self.shared_state.set_error("thermocouple-above_limit", error_msg)
-                return None
+            sensors = self.thermocouple_sensors
+            probe_temps = self.probe_temps
+            # Batched - every probe is read in the same pass on the shared SCK/SO lines
+            for index in range(self.probe_count):
+                sensor = sensors[index]
+                raw_temp = sensor.read()
+                if index == 0:
+                    # First probe sets the timing, they all convert together
+                    self.sample_fresh = sensor.fresh()
+                    self.sample_time = sensor.sample_time()
+                    self.sample_time_us = sensor.sample_time_us()
+                if sensor.error():
+                    self.set_probe_error(index, "thermocouple-read_error")
+                    return None
+                if raw_temp is None:
+                    self.set_probe_error(index, "thermocouple-invalid_reading")
+                    return None
+                if raw_temp == 0:
+                    self.set_probe_error(index, "thermocouple-zero_reading", raw_temp)
+                    return None
+                if raw_temp < 0:
+                    self.set_probe_error(index, "thermocouple-below_zero", raw_temp)
+                    return None
 
+                # Out of range and noisy readings are checked after filtering so one bad read doesn't pause the heater
+                raw_temp = self.filter_temp(index, raw_temp, sensor.fresh(), sensor.sample_time())
+                if raw_temp > ABOVE_LIMIT:
+                    if sensor.fresh():
+                        self.above_limit_readings[index] += 1
+                    if self.above_limit_readings[index] >= ABOVE_LIMIT_READINGS or probe_temps[index] == 0:
+                        self.set_probe_error(index, "thermocouple-above_limit", raw_temp)
+                        return None
+                    # Could be one bad conversion - keep the last good reading until the next one confirms it
+                    raw_temp = probe_temps[index]
+                    if index == 0:
+                        self.sample_fresh = False  # Treat it like a repeated reading so the PID isn't kicked
+                else:
+                    self.above_limit_readings[index] = 0
+                probe_temps[index] = raw_temp
+
+            raw_temp = self.combine()
             self.raw_temp = raw_temp
+            shared_state = self.shared_state
+            if shared_state:
+                current_error = shared_state.current_error
+                if current_error is not None and current_error[0] in THERMOCOUPLE_PAUSE_ERRORS:
+                    shared_state.clear_error()  # Good readings again - the pause is over
+                hottest = probe_temps[0]
+                for index in range(self.probe_count):
+                    shared_state.probe_temperatures[index] = probe_temps[index]
+                    if probe_temps[index] > hottest:
+                        hottest = probe_temps[index]
+                shared_state.heater_max_temperature = hottest
         except Exception as e:
             #print(f"Error reading temperature: {e}")
             if self.shared_state:
-                base_msg = self.shared_state.error_messages.get("thermocouple-read_error", "Read error")
-                self.shared_state.set_error("thermocouple-read_error", f"{base_msg}: {str(e)}")
+                self.shared_state.raise_error("thermocouple-read_error", e)
             return None
         return raw_temp
 
+    def set_probe_error(self, index, error_code, value=None):
+        # Runs in the control loop during fault bursts - raise_error doesn't allocate, the text is made when it's shown
+        if not self.shared_state:
+            return
+        self.shared_state.raise_error(error_code, value, self.probe_names[index] if self.probe_count > 1 else None)
+
+    def combine(self):
+        # Single temperature for the control loop from the profile's thermocouple_combine policy
+        probe_temps = self.probe_temps
+        if self.probe_count == 1:
+            return probe_temps[0]
+        if self.combine_index >= 0:
+            return probe_temps[self.combine_index]
+        if self.combine_index == COMBINE_MEAN:
+            return sum(probe_temps) / self.probe_count
+        return max(probe_temps)
+
+    def filter_temp(self, index, raw_temp, fresh, sample_time):
+        # Run new readings through the probe's thermocouple filter, returns the filtered temperature
+        shared_state = self.shared_state
+        if shared_state is None:
+            return raw_temp
+        if shared_state.profile_seq != self.profile_seq:
+            self.apply_profile_settings()
+        temperature_filter = self.temperature_filters[index]
+        if not temperature_filter.enabled:
+            return raw_temp
+        if fresh or temperature_filter.temperature is None:
+            if not temperature_filter.update(raw_temp, sample_time) and index == 0:
+                self.sample_fresh = False  # Gated out - treat it like a repeated reading so the PID isn't kicked
+        return temperature_filter.temperature
+
+    def apply_profile_settings(self):
+        shared_state = self.shared_state
+        self.profile_seq = shared_state.profile_seq
+        for temperature_filter in self.temperature_filters:
+            temperature_filter.configure(shared_state.thermocouple_filter, shared_state.thermocouple_filter_samples,
+                                         shared_state.thermocouple_filter_trim, shared_state.thermocouple_filter_max_rate)
+        self.temperature_estimator.configure(shared_state.temperature_estimator, shared_state.estimator_alpha,
+                                             shared_state.estimator_beta, shared_state.estimator_heat_rate)
+        combine = shared_state.thermocouple_combine
+        if combine == 'mean':
+            self.combine_index = COMBINE_MEAN
+        elif combine in self.probe_names:
+            self.combine_index = self.probe_names.index(combine)
+        else:
+            if combine != 'max':
+                print(f"Thermocouple {combine} not found, using the hottest probe")
+            self.combine_index = COMBINE_MAX
+
+    def create_sensors(self, thermocouple_type, driver, spi_id, sck_pin_number, so_pin_number, mosi_pin_number, pio_sm):
+        # One driver per CS pin, all on the same SCK/SO
+        # PIO reads in the background, SPI reads the frame in one transaction, bit banging works on any pins so is the fallback
+        # Hardware SPI needs SCK/SO on the same SPI block and claims a MOSI pin (the block's default if not set)
+        if thermocouple_type not in THERMOCOUPLE_TYPES:
+            raise ValueError(f"Unknown thermocouple_type {thermocouple_type}")
+        phase = 0
+        if thermocouple_type == 'max31856':
+            # Set up through its registers so needs MOSI wired to SDI, and clocks data out on the rising edge
+            if mosi_pin_number is None:
+                raise ValueError("MAX31856 needs thermocouple_mosi set")
+            if driver not in ('spi', 'softspi'):
+                print("Thermocouple MAX31856 needs SPI, using SPI")
+                driver = 'spi'
+            phase = 1
+        if driver == 'pio':
+            if thermocouple_type != 'max6675':
+                print("Thermocouple PIO reader only handles the MAX6675, using bit banged driver")
+                driver = 'bitbang'
+            elif self.probe_count > 1:
+                print("Thermocouple PIO reader only handles one thermocouple, using bit banged driver")
+                driver = 'bitbang'
+            else:
+                try:
+                    from max6675_pio import MAX6675PIO
+                    sensor = MAX6675PIO(pio_sm, self.sck, self.cs, self.so)
+                    print(f"Thermocouple using PIO state machine {pio_sm}")
+                    return [sensor]
+                except Exception as e:
+                    print(f"Thermocouple PIO not available, using bit banged driver: {e}")
+                    driver = 'bitbang'
+        if driver == 'spi':
+            try:
+                if mosi_pin_number is not None:
+                    spi = SPI(spi_id, baudrate=THERMOCOUPLE_SPI_BAUDRATE, polarity=0, phase=phase, sck=Pin(sck_pin_number), mosi=Pin(mosi_pin_number), miso=Pin(so_pin_number))
+                else:
+                    spi = SPI(spi_id, baudrate=THERMOCOUPLE_SPI_BAUDRATE, polarity=0, phase=phase, sck=Pin(sck_pin_number), miso=Pin(so_pin_number))
+                print(f"Thermocouple using SPI{spi_id}")
+                return [self.create_sensor(thermocouple_type, cs, spi) for cs in self.cs_pins]
+            except Exception as e:
+                print(f"Thermocouple SPI{spi_id} not available on these pins, trying SoftSPI: {e}")
+                driver = 'softspi'
+        if driver == 'softspi':
+            if mosi_pin_number is None:
+                print("Thermocouple SoftSPI needs thermocouple_mosi set, using bit banged driver")
+            else:
+                try:
+                    spi = SoftSPI(baudrate=THERMOCOUPLE_SPI_BAUDRATE, polarity=0, phase=phase, sck=Pin(sck_pin_number), mosi=Pin(mosi_pin_number), miso=Pin(so_pin_number))
+                    print("Thermocouple using SoftSPI")
+                    self.driver = 'softspi'
+                    return [self.create_sensor(thermocouple_type, cs, spi) for cs in self.cs_pins]
+                except Exception as e:
+                    if thermocouple_type == 'max31856':
+                        raise
+                    print(f"Thermocouple SoftSPI failed, using bit banged driver: {e}")
+        self.driver = 'bitbang'
+        return [self.create_sensor(thermocouple_type, cs) for cs in self.cs_pins]
+
+    def create_sensor(self, thermocouple_type, cs, spi=None):
+        # Bit banged on self.sck/self.so if there's no spi
+        if thermocouple_type == 'max31856':
+            return MAX31856(spi, cs, self.averaging, self.mains_hz)
+        if thermocouple_type == 'max31855':
+            if spi is not None:
+                return MAX31855(cs, spi=spi)
+            return MAX31855(cs, self.sck, self.so)
+        if spi is not None:
+            return MAX6675SPI(spi, cs)
+        return MAX6675(self.sck, cs, self.so)
 
     def update_filtered_temp(self, heater_on):
         raw_temp = self.read_raw_temp()
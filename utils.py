@@ -2,48 +2,192 @@
 import utime
 import os
 from machine import Pin, I2C, ADC, reset, Timer
+import uasyncio as asyncio
 from ssd1306 import SSD1306_I2C
 
 from autosession import AutoSessionTemperatureProfile
+from voltagesampler import VoltageSampler
+from thermocouple import THERMOCOUPLE_PAUSE_ERRORS
+
+
+# Job priorities for the Scheduler - lower runs first when jobs are due together
+PRIORITY_SAFETY = 0
+PRIORITY_CONTROL = 1
+PRIORITY_UI = 2
+
+# Thermocouple errors that stop the heater and the PID timer - the ones that just pause it are in thermocouple.py
+THERMOCOUPLE_STOP_ERRORS = ("thermocouple-invalid_reading", "thermocouple-zero_reading", "thermocouple-below_zero")
+
+
+class Scheduler:
+    """
+    Runs every periodic and one-shot CustomTimer job from a single virtual
+    Timer. Rather than ticking at a fixed rate the timer is re-armed as a
+    one-shot for the next job that is due so there is one timer IRQ per
+    job run at most.
+    Jobs due at the same time run in priority order (safety > control > UI).
+    Each job keeps stats on runs, late runs, missed periods and run time.
+    """
+    LATE_TOLERANCE_MS = 10  # Job counts as late if it runs more than this after it was due
+
+    def __init__(self, max_sleep_ms=100):
+        self.timer = Timer(-1)
+        self.jobs = []               # Ordered by priority
+        self.max_sleep_ms = max_sleep_ms  # Re-check at least this often in case a start was missed
+        self.armed_for = None        # ticks_ms the timer will next fire, None if idle
+        self.dispatching = False
+        self.dispatch_count = 0
+
+    def add_job(self, job):
+        index = 0
+        while index < len(self.jobs) and self.jobs[index].priority <= job.priority:
+            index += 1
+        self.jobs.insert(index, job)
+
+    def job_started(self, job):
+        # If we are dispatching the timer gets re-armed once all due jobs have run
+        if self.dispatching:
+            return
+        if self.armed_for is None or utime.ticks_diff(job.due, self.armed_for) < 0:
+            self._arm(utime.ticks_ms())
+
+    def _arm(self, now):
+        next_due = None
+        for job in self.jobs:
+            if job.is_running and (next_due is None or utime.ticks_diff(job.due, next_due) < 0):
+                next_due = job.due
+        if next_due is None:
+            self.timer.deinit()
+            self.armed_for = None
+            return
+        delay = utime.ticks_diff(next_due, now)
+        if delay < 1:
+            delay = 1
+        elif delay > self.max_sleep_ms:
+            delay = self.max_sleep_ms
+        self.armed_for = utime.ticks_add(now, delay)
+        self.timer.init(period=delay, mode=Timer.ONE_SHOT, callback=self._dispatch)
+
+    def _dispatch(self, t):
+        self.dispatching = True
+        self.dispatch_count += 1
+        try:
+            now = utime.ticks_ms()
+            for job in self.jobs:  # Already in priority order
+                if job.is_running and utime.ticks_diff(now, job.due) >= 0:
+                    job.run(now)
+        finally:
+            self.dispatching = False
+            self._arm(utime.ticks_ms())
+
+    def report(self):
+        """Print per-job stats to the serial console."""
+        print("Scheduler jobs: prio  period   runs   late missed late_max run_max_us")
+        for job in self.jobs:
+            print(f"{job.name:<16}{job.priority:>4}{job.period:>8}{job.runs:>7}{job.late_runs:>7}{job.missed_deadlines:>7}{job.max_late_ms:>9}{job.max_run_us:>11}")
 
 
 class CustomTimer:
     # Need to extend existing Timer function to know if its running or not
     # Stops timer being started multiple times in case of some recusion or help catch other bugs 
-    def __init__(self, period, mode, callback):
-        self.timer = Timer(-1)
+    # All CustomTimers share one tick source - see Scheduler
+    def __init__(self, period, mode, callback, priority=PRIORITY_UI, name=None):
         self.is_running = False
         self.period = period
         self.mode = mode
         self.callback = callback
+        self.priority = priority
+        self.name = name if name is not None else callback.__name__
+        self.due = 0
+
+        # Stats
+        self.runs = 0
+        self.late_runs = 0
+        self.missed_deadlines = 0   # Periods skipped because the job ran too late
+        self.max_late_ms = 0
+        self.max_run_us = 0
+
+        scheduler.add_job(self)
 
     def start(self):
         if not self.is_running:
-            self.timer.init(period=self.period, mode=self.mode, callback=self.callback)
+            self.due = utime.ticks_add(utime.ticks_ms(), self.period)
             self.is_running = True
-            #print(f"{self.callback.__name__} timer started.")
+            scheduler.job_started(self)
+            #print(f"{self.name} timer started.")
         else:
-            raise RuntimeError(f"{self.callback.__name__} timer is already running. Cannot start again without stopping first.")
+            raise RuntimeError(f"{self.name} timer is already running. Cannot start again without stopping first.")
 
     def stop(self):
         if self.is_running:
-            self.timer.deinit()
-            self.is_running = False
-            #print(f"{self.callback.__name__} timer stopped.")
+            self.is_running = False  # Scheduler just skips it, timer is re-armed on next dispatch
+            #print(f"{self.name} timer stopped.")
         else:
-            raise RuntimeError(f"{self.callback.__name__} timer is not running. Cannot stop without starting first.")
+            raise RuntimeError(f"{self.name} timer is not running. Cannot stop without starting first.")
 
     def is_timer_running(self):
         return self.is_running
 
+    def set_period(self, period):
+        """Change the period, restarting the timer if it is running."""
+        self.period = period
+        if self.is_running:
+            self.stop()
+            self.start()
+
+    # machine.Timer style interface so a CustomTimer can be handed to code expecting a Timer
+    def init(self, period, mode, callback):
+        if self.is_running:
+            self.stop()
+        self.period = period
+        self.mode = mode
+        self.callback = callback
+        self.start()
+
+    def deinit(self):
+        if self.is_running:
+            self.stop()
+
+    def run(self, now):
+        """Called by the Scheduler when the job is due."""
+        late_ms = utime.ticks_diff(now, self.due)
+        if late_ms > Scheduler.LATE_TOLERANCE_MS:
+            self.late_runs += 1
+        if late_ms > self.max_late_ms:
+            self.max_late_ms = late_ms
+
+        if self.mode == Timer.PERIODIC:
+            if late_ms >= self.period:
+                # Skip the periods we missed rather than running them back to back
+                missed = late_ms // self.period
+                self.missed_deadlines += missed
+                self.due = utime.ticks_add(self.due, self.period * (missed + 1))
+            else:
+                self.due = utime.ticks_add(self.due, self.period)
+        else:
+            self.is_running = False
+
+        start_us = utime.ticks_us()
+        try:
+            self.callback(self)
+        except Exception as e:
+            print(f"Error in {self.name} timer callback: {e}")
+        run_us = utime.ticks_diff(utime.ticks_us(), start_us)
+        self.runs += 1
+        if run_us > self.max_run_us:
+            self.max_run_us = run_us
+
+
+scheduler = Scheduler()  # Shared by all CustomTimers
+
 
 # Hardware pin configuration
-_voltage_divider_adc_pin = 28  # Default value
+_voltage_sampler = None  # VoltageSampler for the divider, made by set_voltage_divider_adc_pin()
 
-def set_voltage_divider_adc_pin(pin_number):
-    """Set the ADC pin number for voltage divider monitoring."""
-    global _voltage_divider_adc_pin
-    _voltage_divider_adc_pin = pin_number
+def set_voltage_divider_adc_pin(pin_number, r1=910000, r2=102000, samples=8):
+    """Set the ADC pin number (and divider resistors) for voltage divider monitoring."""
+    global _voltage_sampler
+    _voltage_sampler = VoltageSampler(pin_number, r1, r2, samples)
 
 def get_free_disk_space():
     """Get free disk space in KB.
@@ -221,15 +365,19 @@ def log_autosession_data(log_file, log_buffer, elapsed_ms, heater_temperature, t
                 os.fsync(log_file.fileno())
             except (AttributeError, OSError):
                 pass  # fsync not available on this platform
-            #flash blue led to indicate log flush
-            led_pin.on()
-            utime.sleep_ms(50)
-            led_pin.off()  
+            #flash blue led to indicate log flush - done as a task so the control loop doesn't sleep
+            asyncio.create_task(flash_led(led_pin, 50))
         return log_buffer, log_file
     except Exception as e:
         print(f"Error logging autosession data: {e}")
         return log_buffer, log_file
 
+async def flash_led(led_pin, duration_ms):
+    """Turn an LED on for duration_ms without blocking the caller."""
+    led_pin.on()
+    await asyncio.sleep_ms(duration_ms)
+    led_pin.off()
+
 def flush_autosession_log(log_file, log_buffer):
     """Flush remaining buffered data and close file."""
     try:
@@ -273,8 +421,10 @@ def load_profile(profile_name, shared_state):
                 # Integer keys with optional validation
                 if key in ['session_timeout', 'session_extend_time', 'temperature_setpoint', 'power_threshold',
                           'heater_on_temperature_difference_threshold', 'max_watts', 'click_check_timeout',
-                          'temperature_max_allowed_setpoint', 'set_watts', 'lipo_count', 'pi_temperature_limit',
-                          'autosession_log_buffer_flush_threshold']:
+                          'temperature_max_allowed_setpoint', 'set_watts', 'lipo_count', 'lead_cells', 'pi_temperature_limit',
+                          'autosession_log_buffer_flush_threshold', 'control_period_conversions',
+                          'thermocouple_filter_samples', 'thermocouple_filter_trim', 'thermocouple_filter_max_rate',
+                          'estimator_control_period_ms']:
                     
                     int_value = int(value)
                     
@@ -307,6 +457,31 @@ def load_profile(profile_name, shared_state):
                             config[key] = int_value
                         else:
                             print(f"Warning: autosession_log_buffer_flush_threshold out of range (1-200): {value}")
+                    elif key == 'control_period_conversions':
+                        if 1 <= int_value <= 10:
+                            config[key] = int_value
+                        else:
+                            print(f"Warning: control_period_conversions out of range (1-10): {value}")
+                    elif key == 'thermocouple_filter_samples':
+                        if 1 <= int_value <= 9:
+                            config[key] = int_value
+                        else:
+                            print(f"Warning: thermocouple_filter_samples out of range (1-9): {value}")
+                    elif key == 'thermocouple_filter_trim':
+                        if 0 <= int_value <= 4:
+                            config[key] = int_value
+                        else:
+                            print(f"Warning: thermocouple_filter_trim out of range (0-4): {value}")
+                    elif key == 'thermocouple_filter_max_rate':
+                        if 0 <= int_value <= 500:
+                            config[key] = int_value
+                        else:
+                            print(f"Warning: thermocouple_filter_max_rate out of range (0-500): {value}")
+                    elif key == 'estimator_control_period_ms':
+                        if 50 <= int_value <= 1000:
+                            config[key] = int_value
+                        else:
+                            print(f"Warning: estimator_control_period_ms out of range (50-1000): {value}")
                     else:
                         # All other integer keys (no validation)
                         config[key] = int_value
@@ -332,6 +507,28 @@ def load_profile(profile_name, shared_state):
                 # Float voltage values
                 elif key in ['lipo_safe_volts', 'lead_safe_volts', 'mains_safe_volts']:
                     config[key] = float(value)
+                elif key == 'battery_capacity_wh':
+                    capacity = float(value)
+                    if capacity >= 0:
+                        config[key] = capacity
+                    else:
+                        print(f"Warning: battery_capacity_wh can't be negative: {value}")
+                elif key == 'battery_sag_margin':
+                    margin = float(value)
+                    if 0.0 <= margin <= 5.0:
+                        config[key] = margin
+                    else:
+                        print(f"Warning: battery_sag_margin out of range (0-5): {value}")
+                
+                # Temperature estimator gains (float 0-1) and heat rate
+                elif key in ['estimator_alpha', 'estimator_beta']:
+                    gain = float(value)
+                    if 0.0 < gain <= 1.0:
+                        config[key] = gain
+                    else:
+                        print(f"Warning: {key} out of range (0-1): {value}")
+                elif key == 'estimator_heat_rate':
+                    config[key] = float(value)
                 
                 # Display contrast (integer with validation)
                 elif key == 'display_contrast':
@@ -371,6 +568,19 @@ def load_profile(profile_name, shared_state):
                     else:
                         print(f"Warning: heater_type must be 'element' or 'induction': {value}")
                 
+                elif key == 'thermocouple_filter':
+                    if value in ['none', 'median', 'trimmed_mean']:
+                        config[key] = value
+                    else:
+                        print(f"Warning: thermocouple_filter must be 'none', 'median' or 'trimmed_mean': {value}")
+                
+                elif key == 'thermocouple_combine':
+                    # 'max', 'mean' or a thermocouple name from the hardware profile, checked when applied
+                    if value:
+                        config[key] = value
+                    else:
+                        print(f"Warning: thermocouple_combine cannot be empty")
+                
                 elif key == 'power_type':
                     if value in ['mains', 'lipo', 'lead']:
                         config[key] = value
@@ -378,7 +588,8 @@ def load_profile(profile_name, shared_state):
                         print(f"Warning: power_type must be 'mains', 'lipo', or 'lead': {value}")
                 
                 # Boolean values
-                elif key in ['display_rotate', 'autosession_logging_enabled']:
+                elif key in ['display_rotate', 'autosession_logging_enabled', 'loop_stats_enabled', 'sensor_synchronised_control',
+                             'temperature_estimator', 'battery_sag_limit']:
                     str_value = str(value).lower()
                     config[key] = str_value in ['true', '1', 'yes']
                     
@@ -390,14 +601,14 @@ def load_profile(profile_name, shared_state):
                             print(f"Warning: Autosession logging disabled - low disk space ({int(free_kb)}KB)")
                 
                 # PID tunings (tuple of floats)
-                elif key == 'pid_temperature_tunings':
+                elif key in ('pid_temperature_tunings', 'pid_watts_tunings'):
                     tunings_str = str(value).split(',')
                     if len(tunings_str) == 3:
                         config[key] = (float(tunings_str[0].strip()), 
                                       float(tunings_str[1].strip()), 
                                       float(tunings_str[2].strip()))
                     else:
-                        print(f"Warning: pid_temperature_tunings must be in format 'P,I,D' (got: {value})")
+                        print(f"Warning: {key} must be in format 'P,I,D' (got: {value})")
                 
             except (ValueError, TypeError) as e:
                 print(f"Warning: Could not parse {key}={value}: {e}")
@@ -454,7 +665,7 @@ def apply_and_save_profile(profile_name, shared_state):
         
         shared_state.apply_profile(config)
         shared_state.set_profile_name(profile_name)
-        shared_state.pid.reset() 
+        shared_state.reset_pid() 
         
         # Load autosession profile if specified in the profile
         if shared_state.default_autosession_profile:
@@ -558,10 +769,9 @@ def apply_and_save_autosession_profile(profile_name, shared_state):
         print(f"Error loading autosession profile: {e}")
         return False, f"Error loading autosession profile"
     
-def get_pi_temperature_or_handle_error(pi_temperature_sensor, display_manager, shared_state=None):
+def get_pi_temperature_or_handle_error(adc_acquisition, display_manager, shared_state=None):
     try:
-        ADC_voltage = pi_temperature_sensor.read_u16() * (3.3 / (65536))
-        pi_temperature = 27 - (ADC_voltage - 0.706) / 0.001721
+        pi_temperature = adc_acquisition.pi_temperature()  # From the background ADC readings
         return pi_temperature
     except Exception as e:
         error_message = str(e)
@@ -570,6 +780,7 @@ def get_pi_temperature_or_handle_error(pi_temperature_sensor, display_manager, s
             shared_state.set_error("pi-unknown_error", "PI temperature read error: " + error_message)
         #while True:
          #   utime.sleep_ms(1000)
+        pi_temperature = shared_state.pi_temperature if shared_state else 0  # Keep the last reading
     return pi_temperature
 
 def get_thermocouple_temperature_or_handle_error(thermocouple, heater, pidTimer, display_manager, shared_state=None):
@@ -588,16 +799,18 @@ def get_thermocouple_temperature_or_handle_error(thermocouple, heater, pidTimer,
             # Check if an error was set during read
             if shared_state and shared_state.has_error():
                 error_code, error_message = shared_state.current_error
-                if error_code in ["thermocouple-invalid_reading", "thermocouple-zero_reading", "thermocouple-below_zero"]:
+                if error_code in THERMOCOUPLE_STOP_ERRORS:
                     heater.off()
                     if pidTimer.is_timer_running():
                         pidTimer.stop()
-                    print("Stopped heater - " + error_message)
+                    if shared_state.error_repeats == 0:  # Only print (and format) it once per burst
+                        print("Stopped heater -", error_message)
                     # Don't return yet, let the error display in main loop
                     return -1, True
-                elif error_code in ["thermocouple-above_limit", "thermocouple-read_error"]:
+                elif error_code in THERMOCOUPLE_PAUSE_ERRORS:
                     heater.off()
-                    print("Pausing heater - " + error_message)
+                    if shared_state.error_repeats == 0:
+                        print("Pausing heater -", error_message)
                     return -1, True
         
         return new_temperature, need_off_temperature
@@ -641,50 +854,16 @@ def initialize_display(i2c_scl, i2c_sda, led_pin):
     return display
 
 
-def get_input_volts(previous_reading):
-    adc_pin = ADC(_voltage_divider_adc_pin)
-    r1 = 910000   # 910kΩ
-    r2 = 102000   # 102kΩ
-    adc_value = adc_pin.read_u16()
+def get_voltage_sampler():
+    if _voltage_sampler is None:
+        set_voltage_divider_adc_pin(28)
+    return _voltage_sampler
 
-    #print(str(adc_value))
-    
-    if adc_value in [512, 1536, 2560, 3584]:  #problematic_values for rp2040 adc reading
-        return previous_reading
-
-    voltage_adc = adc_value * (3.3 / 65535)  # Convert ADC value to voltage
-    voltage_in = voltage_adc * (r1 + r2) / r2 #calculate input voltage
-     
-    if voltage_in < 4.0:
-        correction = 0.220
-    elif voltage_in < 8.0:
-        correction = 0.180
-    else:
-        correction = 0.140
-        
-    if previous_reading == False: previous_reading = voltage_in  # for first reading
 
-    #print(str(adc_value) + " " + str(voltage_adc) + " " + str(voltage_in))
-    
-    if previous_reading - (voltage_in - correction) > 1:  
-        #its ok if it goes up we care more about max_duty cycle being too high
-        #this is to cover the adc bug with the rp2040
-        #maybe need to loop a few times and get average rather than just one reading as this still give od rreading sometimes
-        
-        #print("Retry Read Input Voltage:", voltage_in, "V")
-        utime.sleep_ms(150)
-        adc_value = adc_pin.read_u16()
-        voltage_adc = adc_value * (3.3 / 65535)  # Convert ADC value to voltage
-        voltage_in = voltage_adc * (r1 + r2) / r2 #calculate input voltage
-        if previous_reading - (voltage_in - correction) > 1:  
-            voltage_in = previous_reading - 0.3  # lets reduce by a little bit in case there really has been a drop
-                                                 # next time round it will drop again and again but it safer 
-                                                 # to drop in small amounts so we dont over power the mostfet in case its wrong
-            #print("Retry Read Input Voltage dropped by 0.5v:", voltage_in, "V")
-    
-    #print("Input Voltage:", voltage_in, "V")
-    return round(voltage_in - correction, 2)
-    
+def get_input_volts(previous_reading):
+    # Burst sampled with the RP2040 ADC's bad codes dropped - see VoltageSampler
+    return get_voltage_sampler().read(previous_reading)
+
 
 def buzzer_play_tone(buzzer, frequency, duration):
     #for time being just return here - we will make this asunchronous later
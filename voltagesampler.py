@@ -0,0 +1,76 @@
+from machine import ADC
+
+
+class VoltageSampler:
+    """
+    Supply voltage from the resistor divider on an ADC pin.
+    Keeps one ADC object and each read takes a burst of samples, drops the
+    RP2040 ADC's bad codes (DNL spikes at 512, 1536, 2560 and 3584 on the
+    12 bit scale) and averages the rest, so a bad conversion doesn't need a
+    sleep and re-read. A burst of 8 takes a few tens of microseconds.
+    """
+    DNL_CODES = (512, 1536, 2560, 3584)
+    VREF = 3.3
+    MAX_DROP_V = 1.0    # Drops bigger than this are taken in DROP_STEP_V steps
+    DROP_STEP_V = 0.3   # ... a low reading allows a higher duty cycle so it's safer to believe it slowly
+    # (below volts, correction) in order, the last applies above them all
+    CORRECTIONS = ((4.0, 0.220), (8.0, 0.180), (None, 0.140))
+
+    def __init__(self, pin, r1=910000, r2=102000, samples=8, corrections=CORRECTIONS):
+        """
+        :param pin: ADC pin number (26-28)
+        :param r1: divider resistor from the supply to the ADC pin, ohms
+        :param r2: divider resistor from the ADC pin to ground, ohms
+        :param samples: ADC samples averaged per read
+        :param corrections: (below volts, volts to subtract) curve
+        """
+        self.adc = ADC(pin)
+        self.samples = samples
+        self.corrections = corrections
+        self.volts_per_code = VoltageSampler.VREF / 4095 * (r1 + r2) / r2
+        self.rejected_count = 0   # Bad codes dropped since power on
+
+    def correction(self, volts):
+        for below, correction in self.corrections:
+            if below is None or volts < below:
+                return correction
+        return 0
+
+    def sample_code(self):
+        """
+        Returns the mean 12 bit code of a burst of samples, or None if every sample was a bad code.
+        """
+        adc = self.adc
+        total = 0
+        count = 0
+        for _ in range(self.samples):
+            code = adc.read_u16() >> 4   # read_u16 is the 12 bit conversion scaled up
+            if code in VoltageSampler.DNL_CODES:
+                self.rejected_count += 1
+                continue
+            total += code
+            count += 1
+        if count == 0:
+            return None
+        return total / count
+
+    def volts(self, code):
+        """Input voltage for a (mean) 12 bit code, through the divider and correction curve."""
+        voltage_in = code * self.volts_per_code
+        return voltage_in - self.correction(voltage_in)
+
+    def limit_drop(self, voltage_in, previous_reading):
+        """Take big drops from previous_reading in steps and round for display."""
+        if previous_reading is not False and previous_reading - voltage_in > VoltageSampler.MAX_DROP_V:
+            voltage_in = previous_reading - VoltageSampler.DROP_STEP_V
+        return round(voltage_in, 2)
+
+    def read(self, previous_reading=False):
+        """
+        Returns the input voltage, or previous_reading if every sample was a bad code.
+        Pass False as previous_reading for the first read.
+        """
+        code = self.sample_code()
+        if code is None:
+            return previous_reading
+        return self.limit_drop(self.volts(code), previous_reading)